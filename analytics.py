@@ -1,13 +1,35 @@
 import os
 import json
+import time
+import atexit
+import shutil
+import socket
 import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 from clickhouse_driver import Client
+from clickhouse_driver.errors import NetworkError
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 table_name = os.environ.get("ANALYTICS_TABLE_NAME", "dev_sf_events")
 
+# События копятся в памяти и пишутся в ClickHouse пачками из фонового потока
+ANALYTICS_BUFFER_SIZE = int(os.environ.get("ANALYTICS_BUFFER_SIZE", "10000"))
+ANALYTICS_BATCH_SIZE = int(os.environ.get("ANALYTICS_BATCH_SIZE", "500"))
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get("ANALYTICS_FLUSH_INTERVAL", "5"))
+# Пока ClickHouse недоступен, пачки складываются в файл и досылаются позже
+ANALYTICS_SPOOL_FILE = os.environ.get("ANALYTICS_SPOOL_FILE", "data/analytics_spool.jsonl")
+ANALYTICS_SPOOL_MAX_BYTES = int(float(os.environ.get("ANALYTICS_SPOOL_MAX_MB", "200")) * 1024 * 1024)
+ANALYTICS_RECONNECT_INTERVAL = float(os.environ.get("ANALYTICS_RECONNECT_INTERVAL", "30"))
+# Пачки, которые ClickHouse отверг (ошибка сервера, а не сети), - для ручного разбора
+ANALYTICS_DEAD_LETTER_FILE = os.environ.get("ANALYTICS_DEAD_LETTER_FILE", "data/analytics_dead_letter.jsonl")
+
+# Только эти ошибки означают, что ClickHouse недоступен и пачку стоит отложить
+CLICKHOUSE_NETWORK_ERRORS = (NetworkError, socket.error, EOFError)
+
 
 def get_clickhouse_client():
     """Создает и возвращает клиент для подключения к ClickHouse."""
@@ -52,23 +74,219 @@ def init_analytics_db():
     finally:
         client.disconnect()
 
-def log_event(user_id: int, event_type: str, data: dict):
-    """Логирует событие в ClickHouse."""
-    client = get_clickhouse_client()
-    if not client:
-        return
+class AnalyticsBuffer:
+    """
+    Bounded in-process buffer of analytics events with a background flusher thread.
+    Events are inserted in batches over one persistent ClickHouse connection, either when
+    ANALYTICS_BATCH_SIZE events are waiting or every ANALYTICS_FLUSH_INTERVAL seconds.
+    Batches that cannot be written because ClickHouse is unreachable go to
+    ANALYTICS_SPOOL_FILE and are replayed once it is reachable again; batches the
+    server rejects go to ANALYTICS_DEAD_LETTER_FILE and are not retried.
+    """
+
+    def __init__(self):
+        self._events = deque()
+        self._lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # клиент ClickHouse не потокобезопасен
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._client = None
+        self._next_connect_at = 0.0
+
+    def add(self, user_id: int, event_type: str, data: dict):
+        row = (time.time(), user_id, event_type, json.dumps(data, ensure_ascii=False))
+        with self._lock:
+            self._start_locked()
+            if len(self._events) >= ANALYTICS_BUFFER_SIZE:
+                overflow = [self._events.popleft() for _ in range(min(ANALYTICS_BATCH_SIZE, len(self._events)))]
+            else:
+                overflow = None
+            self._events.append(row)
+            if len(self._events) >= ANALYTICS_BATCH_SIZE:
+                self._wakeup.set()
+        if overflow:
+            # Флашер не успевает (ClickHouse завис) - самые старые события уходят в файл
+            self._spool(overflow)
+
+    def _start_locked(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="analytics-flusher", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _take_batch(self) -> list:
+        with self._lock:
+            return [self._events.popleft() for _ in range(min(ANALYTICS_BATCH_SIZE, len(self._events)))]
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(ANALYTICS_FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Analytics flusher error: {e}", exc_info=True)
+
+    def flush(self):
+        """Writes everything buffered; replays the spool file first if ClickHouse is back."""
+        with self._flush_lock:
+            # Сначала - остаток прерванного досыла (.replay), затем свежий spool
+            while self._spool_pending() and self._get_client() is not None:
+                if not self._replay_spool():
+                    break
+            batch = self._take_batch()
+            while batch:
+                if not self._insert(batch):
+                    self._spool(batch + self._take_all())
+                    return
+                batch = self._take_batch()
+
+    def _take_all(self) -> list:
+        with self._lock:
+            rows = list(self._events)
+            self._events.clear()
+            return rows
+
+    def _get_client(self):
+        if self._client is None and time.monotonic() >= self._next_connect_at:
+            self._client = get_clickhouse_client()
+            if self._client is None:
+                self._next_connect_at = time.monotonic() + ANALYTICS_RECONNECT_INTERVAL
+        return self._client
+
+    def _insert(self, rows: list) -> bool:
+        """
+        Writes one batch. Returns False only if ClickHouse is unreachable (the caller
+        spools the batch); a batch rejected by the server is dead-lettered instead.
+        """
+        client = self._get_client()
+        if client is None:
+            return False
+        try:
+            client.execute(
+                f"INSERT INTO {table_name} (event_timestamp, user_id, event_type, event_data) VALUES",
+                [(datetime.fromtimestamp(ts, tz=timezone.utc), user_id, event_type, event_data)
+                 for ts, user_id, event_type, event_data in rows]
+            )
+            return True
+        except CLICKHOUSE_NETWORK_ERRORS as e:
+            logger.error(f"ClickHouse unreachable, could not log {len(rows)} events: {e}")
+            self._disconnect()
+            self._next_connect_at = time.monotonic() + ANALYTICS_RECONNECT_INTERVAL
+            return False
+        except Exception as e:
+            # Повтор не поможет (схема, данные) - пачка уходит в dead-letter, поток событий не стоит
+            logger.error(f"ClickHouse rejected {len(rows)} events, moving them to {ANALYTICS_DEAD_LETTER_FILE}: {e}")
+            self._disconnect()
+            self._append_rows(ANALYTICS_DEAD_LETTER_FILE, rows)
+            return True
+
+    def _disconnect(self):
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
 
+    def _append_rows(self, path: str, rows: list, remaining_lines=None) -> bool:
+        """Appends rows (and already serialized lines, if given) to a JSONL file."""
+        with self._spool_lock:
+            try:
+                if os.path.exists(path) and os.path.getsize(path) >= ANALYTICS_SPOOL_MAX_BYTES:
+                    logger.error(f"{path} is full, dropping {len(rows)} events.")
+                    return False
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    for row in rows:
+                        f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    if remaining_lines is not None:
+                        shutil.copyfileobj(remaining_lines, f)
+                return True
+            except OSError as e:
+                logger.error(f"Failed to write analytics events to {path}: {e}")
+                return False
+
+    def _spool(self, rows: list):
+        if rows and self._append_rows(ANALYTICS_SPOOL_FILE, rows):
+            logger.warning(f"ClickHouse unavailable, spooled {len(rows)} events to {ANALYTICS_SPOOL_FILE}.")
+
+    @staticmethod
+    def _replay_path() -> str:
+        return f"{ANALYTICS_SPOOL_FILE}.replay"
+
+    def _spool_pending(self) -> bool:
+        return os.path.exists(self._replay_path()) or os.path.exists(ANALYTICS_SPOOL_FILE)
+
+    def _replay_spool(self) -> bool:
+        """
+        Streams the spool to ClickHouse batch by batch. A .replay file left by a crash
+        mid-replay is sent first. Returns False if ClickHouse went away again; the rest
+        of the file is then appended back to the spool.
+        """
+        replay_path = self._replay_path()
+        with self._spool_lock:
+            if not os.path.exists(replay_path):
+                try:
+                    os.replace(ANALYTICS_SPOOL_FILE, replay_path)
+                except OSError:
+                    return True
+        replayed = 0
+        completed = True
+        with open(replay_path, 'r', encoding='utf-8') as f:
+            batch = []
+            for line in f:
+                try:
+                    batch.append(tuple(json.loads(line)))
+                except ValueError:
+                    continue
+                if len(batch) < ANALYTICS_BATCH_SIZE:
+                    continue
+                if not self._insert(batch):
+                    completed = False
+                    break
+                replayed += len(batch)
+                batch = []
+            if completed and batch:
+                completed = self._insert(batch)
+                if completed:
+                    replayed += len(batch)
+            if not completed:
+                # Неотправленная пачка и непрочитанный хвост файла возвращаются в spool
+                self._append_rows(ANALYTICS_SPOOL_FILE, batch, remaining_lines=f)
+        os.remove(replay_path)
+        logger.info(f"Replayed {replayed} spooled analytics events.")
+        return completed
+
+    def close(self):
+        """Stops the flusher and writes (or spools) whatever is still buffered."""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=ANALYTICS_FLUSH_INTERVAL * 2)
+        try:
+            self.flush()
+        finally:
+            with self._flush_lock:
+                self._disconnect()
+
+
+_analytics_buffer = AnalyticsBuffer()
+
+
+def log_event(user_id: int, event_type: str, data: dict):
+    """Ставит событие в очередь на запись в ClickHouse (не блокирует вызывающий код)."""
     try:
-        event_data_json = json.dumps(data, ensure_ascii=False)
-        client.execute(
-            f"INSERT INTO {table_name} (user_id, event_type, event_data) VALUES",
-            [(user_id, event_type, event_data_json)]
-        )
+        _analytics_buffer.add(user_id, event_type, data)
     except Exception as e:
-        logger.error(f"Failed to log event to ClickHouse: {e}")
-    finally:
-        if client:
-            client.disconnect()
+        logger.error(f"Failed to buffer analytics event: {e}")
+
+
+def flush_analytics():
+    """Синхронно записывает накопленные события (например, перед остановкой процесса)."""
+    _analytics_buffer.flush()
 
 def clear_analytics_table():
     """Clears all data from the analytics table."""
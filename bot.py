@@ -1,9 +1,12 @@
 import os
+import socket
 import logging
 import asyncio
 import traceback
 import html
 import json
+import itertools
+import threading
 
 from telegram import Update, Bot, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, PreCheckoutQueryHandler, CallbackQueryHandler, ContextTypes, ConversationHandler, PicklePersistence
@@ -21,15 +24,24 @@ from handlers import (
     topup_stars, topup_crypto, topup_yookassa, get_yookassa_email, check_yookassa_payment,
     check_crypto_payment, back_to_package_selection, cancel_topup
 )
-from processing.bot_logic import main as process_video
+from processing.bot_logic import main as process_video, TaskCancelled
+from processing.clip_cache import get_cached_clip, set_clip_file_id
 from states import RATING, GET_LANGUAGE, GET_TOPUP_METHOD, GET_YOOKASSA_EMAIL, CRYPTO_PAYMENT, YOOKASSA_PAYMENT
 from analytics import init_analytics_db, log_event
 from config import (
-    TELEGRAM_BOT_TOKEN, MAX_CONCURRENT_TASKS, FORWARD_RESULTS_GROUP_ID, 
-    DELETE_OUTPUT_AFTER_SENDING, ADMIN_GROUP_ID, ADMIN_USER_TAG
+    TELEGRAM_BOT_TOKEN, FORWARD_RESULTS_GROUP_ID, 
+    DELETE_OUTPUT_AFTER_SENDING, ADMIN_GROUP_ID, ADMIN_USER_TAG,
+    TASK_HEARTBEAT_INTERVAL, TASK_POLL_INTERVAL, WORKER_MODE, TASK_EVENT_POLL_INTERVAL, TASK_EVENT_MAX_ATTEMPTS,
+    SCHEDULER_CPU_BUDGET, SCHEDULER_RAM_BUDGET_MB, SCHEDULER_MAX_JOBS
 )
 from localization import get_translation
-from database import get_user, add_task_to_queue, get_pending_tasks, remove_task_from_queue
+from scheduler import ResourceScheduler
+from broadcast import resume_broadcasts
+from database import (
+    run_db, get_user, get_pending_tasks, heartbeat_task, complete_task, fail_task,
+    purge_finished_tasks, TaskCheckpoint, get_pending_task_events, mark_task_event_delivered, mark_task_clip_sent,
+    record_task_event_failure, charge_task_once, is_task_charged
+)
 
 # Настройка логирования
 logging.basicConfig(
@@ -37,6 +49,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Завершённые задачи хранятся в БД для разбора, потом удаляются при старте
+FINISHED_TASKS_RETENTION_SECONDS = 7 * 24 * 3600
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log the error and send a telegram message to notify the admin."""
     logger.error("Exception while handling an update:", exc_info=context.error)
@@ -84,27 +99,51 @@ async def send_status_update(bot: Bot, chat_id: int, text: str, status_message_i
         logger.warning(f"Не удалось отредактировать сообщение о статусе: {e}. Отправляю новое.")
         await bot.send_message(chat_id=chat_id, text=text, reply_to_message_id=edit_message_id)
 
-async def send_video(bot: Bot, chat_id: int, file_path: str, caption: str, edit_message_id: int, forward_group_id: str = None, generation_id: str = None):
+def _is_transient_telegram_error(e: Exception) -> bool:
+    """Сетевые сбои и флуд-контроль Telegram: запрос стоит повторить (BadRequest тоже NetworkError, но не временный)."""
+    return (isinstance(e, (telegram.error.NetworkError, telegram.error.RetryAfter))
+            and not isinstance(e, telegram.error.BadRequest))
+
+async def send_video(bot: Bot, chat_id: int, file_path: str, caption: str, edit_message_id: int, forward_group_id: str = None, generation_id: str = None, clip_key: str = None, raise_transient: bool = False):
+    """
+    Sends a clip (by cached file_id when possible) and returns True on success.
+    Errors are reported to the user and return False; with raise_transient, network errors
+    and RetryAfter are re-raised instead so the caller can retry the delivery later.
+    """
     try:
-        _, _, _, lang, _ = get_user(chat_id)
+        _, _, _, lang, _ = await run_db(get_user, chat_id)
         # dislike_keyboard = InlineKeyboardMarkup([
         #     [InlineKeyboardButton(get_translation(lang, "dislike_button"), callback_data='dislike')]
         # ])
+        send_kwargs = dict(
+            chat_id=chat_id,
+            caption=caption,
+            parse_mode="HTML",
+            width=720,
+            height=1280,
+            supports_streaming=True,
+            read_timeout=600,
+            write_timeout=600,
+            reply_to_message_id=edit_message_id,
+            # reply_markup=dislike_keyboard
+        )
 
-        with open(file_path, 'rb') as video_file:
-            message = await bot.send_video(
-                chat_id=chat_id,
-                video=video_file,
-                caption=caption,
-                parse_mode="HTML",
-                width=720,
-                height=1280,
-                supports_streaming=True,
-                read_timeout=600,
-                write_timeout=600,
-                reply_to_message_id=edit_message_id,
-                # reply_markup=dislike_keyboard
-            )
+        message = None
+        cached_clip = await run_db(get_cached_clip, clip_key)
+        if cached_clip and cached_clip['telegram_file_id']:
+            # Такой клип уже загружали - отправляем по file_id, без повторной загрузки
+            try:
+                message = await bot.send_video(video=cached_clip['telegram_file_id'], **send_kwargs)
+            except telegram.error.BadRequest as e:
+                logger.warning(f"Cached file_id for clip {clip_key} was rejected, uploading the file: {e}")
+                if not file_path:
+                    raise
+
+        if message is None:
+            with open(file_path, 'rb') as video_file:
+                message = await bot.send_video(video=video_file, **send_kwargs)
+            if message.video:
+                await run_db(set_clip_file_id, clip_key, message.video.file_id)
 
         if forward_group_id:
             try:
@@ -127,54 +166,147 @@ async def send_video(bot: Bot, chat_id: int, file_path: str, caption: str, edit_
 
         return True
     except Exception as e:
+        if raise_transient and _is_transient_telegram_error(e):
+            raise
         logger.error(f"Ошибка при отправке видео {file_path} в чат {chat_id}: {e}")
         log_event(chat_id, 'send_video_error', {'file_path': file_path, 'error': str(e)})
-        _, _, _, lang, _ = get_user(chat_id)
+        _, _, _, lang, _ = await run_db(get_user, chat_id)
         await bot.send_message(chat_id, get_translation(lang, "send_video_error").format(file_path=file_path, e=e), reply_to_message_id=edit_message_id)
         return False
 
 
 
-async def processing_worker(queue: asyncio.Queue, application: Application):
-    """Воркер, который обрабатывает видео из очереди."""
+async def _heartbeat_loop(task_id: int, worker_id: str, cancelled: threading.Event):
+    """Продлевает аренду задачи, пока она обрабатывается; при потере аренды отменяет обработку."""
     while True:
-        task_id, user_id, chat_id, user_data_json, status_message_id = await queue.get()
-        user_data = json.loads(user_data_json)
-        
+        await asyncio.sleep(TASK_HEARTBEAT_INTERVAL)
         try:
-            async with application.bot_data['busy_workers_lock']:
-                application.bot_data['busy_workers'] += 1
-            logger.info(f"Начинаю обработку задачи {task_id} для чата {chat_id}")
-            await run_processing(chat_id, user_data, application, status_message_id)
-            logger.info(f"Задача {task_id} успешно обработана.")
+            if not await run_db(heartbeat_task, task_id, worker_id):
+                logger.warning(f"Аренда задачи {task_id} потеряна воркером {worker_id}, обработка отменяется.")
+                cancelled.set()
+                return
         except Exception as e:
-            logger.error(f"Ошибка в воркере для чата {chat_id}: {e}", exc_info=True)
+            logger.warning(f"Не удалось продлить аренду задачи {task_id}: {e}")
+
+
+async def _wait_for_task(application: Application):
+    """Ждёт сигнала о новой задаче или TASK_POLL_INTERVAL (задачи с истёкшей арендой)."""
+    wakeup = application.bot_data['task_wakeup']
+    try:
+        await asyncio.wait_for(wakeup.wait(), timeout=TASK_POLL_INTERVAL)
+    except asyncio.TimeoutError:
+        pass
+    wakeup.clear()
+
+
+async def process_leased_task(application: Application, task: tuple, worker_id: str, scheduler: ResourceScheduler, cost: dict):
+    """Обрабатывает задачу, взятую планировщиком под аренду, и освобождает её ресурсы."""
+    task_id, user_id, chat_id, user_data_json, status_message_id = task
+    user_data = json.loads(user_data_json)
+    cancelled = threading.Event()
+    heartbeat = asyncio.create_task(_heartbeat_loop(task_id, worker_id, cancelled))
+    failed_error = None
+    
+    try:
+        logger.info(f"Начинаю обработку задачи {task_id} для чата {chat_id}")
+        await run_processing(chat_id, user_data, application, status_message_id, task_id=task_id, cancelled=cancelled)
+        logger.info(f"Задача {task_id} успешно обработана.")
+    except TaskCancelled:
+        # Задачу доделает новый владелец аренды - пользователю не пишем
+        logger.warning(f"Обработка задачи {task_id} остановлена: аренда потеряна воркером {worker_id}.")
+    except Exception as e:
+        failed_error = str(e)
+        logger.error(f"Ошибка в воркере для чата {chat_id}: {e}", exc_info=True)
+        try:
+            _, _, _, lang, _ = await run_db(get_user, chat_id)
+            await application.bot.send_message(
+                chat_id,
+                get_translation(lang, "processing_error").format(e=e),
+                parse_mode="HTML"
+            )
+        except Exception as send_e:
+            logger.error(f"Не удалось отправить сообщение об ошибке в чат {chat_id}: {send_e}")
+    finally:
+        heartbeat.cancel()
+        # После потери аренды задача принадлежит другому воркеру - её итог не наш
+        if not cancelled.is_set():
             try:
-                _, _, _, lang, _ = get_user(chat_id)
-                await application.bot.send_message(
-                    chat_id,
-                    get_translation(lang, "processing_error").format(e=e),
-                    parse_mode="HTML"
-                )
-            except Exception as send_e:
-                logger.error(f"Не удалось отправить сообщение об ошибке в чат {chat_id}: {send_e}")
-        finally:
-            remove_task_from_queue(task_id) # This line removes the task
-            async with application.bot_data['busy_workers_lock']:
-                application.bot_data['busy_workers'] -= 1
-            queue.task_done()
-            logger.info(f"Завершена обработка задачи для чата {chat_id}. Задач в очереди: {queue.qsize()}")
+                if failed_error is None:
+                    await run_db(complete_task, task_id, worker_id)
+                else:
+                    await run_db(fail_task, task_id, failed_error, worker_id)
+            except Exception as e:
+                logger.error(f"Не удалось сохранить итог задачи {task_id}: {e}")
+        scheduler.release(cost)
+        # Освободились ресурсы - планировщик может взять следующую задачу
+        application.bot_data['task_wakeup'].set()
+        logger.info(f"Завершена обработка задачи {task_id} для чата {chat_id}.")
+
+
+async def scheduler_loop(application: Application, node_id: str):
+    """Берёт задачи из очереди, пока они помещаются в бюджет CPU/RAM, и запускает их параллельно."""
+    scheduler = ResourceScheduler()
+    application.bot_data['scheduler'] = scheduler
+    lease_numbers = itertools.count(1)
+    while True:
+        # Каждая аренда получает свой id, чтобы heartbeat/complete не путали параллельные задачи
+        worker_id = f"{node_id}:{next(lease_numbers)}"
+        try:
+            leased = await asyncio.to_thread(scheduler.lease_next, worker_id)
+        except Exception as e:
+            logger.error(f"Не удалось взять задачу из очереди: {e}")
+            leased = None
+        if leased is None:
+            await _wait_for_task(application)
+            continue
+        task, cost = leased
+        asyncio.create_task(process_leased_task(application, task, worker_id, scheduler, cost))
+
+
+def format_clip_caption(lang: str, hook: str, start: str, end: str, virality_score) -> str:
+    score_text = f" {virality_score}/10" if virality_score is not None else ""
+    if hook: # Check if hook is not empty
+        return get_translation(lang, "video_caption").format(hook=hook, start=start[:-2], end=end[:-2], score=score_text)
+    return get_translation(lang, "video_caption_no_hook").format(start=start[:-2], end=end[:-2], score=score_text)
+
+
+async def send_completion_message(bot: Bot, chat_id: int, extra_shorts_found: int, status_message_id: int):
+    """Final message with the updated balance and the rating keyboard."""
+    # Fetch the updated balance
+    _, new_balance, _, lang, _ = await run_db(get_user, chat_id)
+
+    final_message = get_translation(lang, "processing_complete").format(new_balance=new_balance)
+    if extra_shorts_found > 0:
+        final_message += get_translation(lang, "extra_shorts_found").format(extra_shorts_found=extra_shorts_found)
+
+    # Create rating keyboard
+    rating_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton(str(i), callback_data=f'rate_{i}') for i in range(1, 6)]
+    ])
+
+    # Send one message with keyboard
+    await send_message_safely(
+        bot,
+        chat_id=chat_id,
+        text=final_message,
+        parse_mode="HTML",
+        reply_markup=rating_keyboard,
+        reply_to_message_id=status_message_id
+    )
 
 
-async def run_processing(chat_id: int, user_data: dict, application: Application, status_message_id: int = None):
+async def run_processing(chat_id: int, user_data: dict, application: Application, status_message_id: int = None, task_id: int = None,
+                         cancelled: threading.Event = None):
     """Асинхронно запускает обработку видео и отправляет результат."""
     bot = application.bot
     from database import get_user # Локальный импорт для избежания циклических зависимостей
 
     generation_id = user_data.get('generation_id')
+    # Прогресс задачи в БД: после рестарта уже отправленные клипы не шлются повторно
+    checkpoint = await asyncio.to_thread(TaskCheckpoint, task_id, cancelled) if task_id is not None else None
     log_event(chat_id, 'generation_start', {'generation_id': generation_id})
 
-    _, current_balance, _, lang, _ = get_user(chat_id)
+    _, current_balance, _, lang, _ = await run_db(get_user, chat_id)
 
     processing_message = await send_message_safely(
         bot,
@@ -189,14 +321,10 @@ async def run_processing(chat_id: int, user_data: dict, application: Application
     def status_callback(status_text: str):
         asyncio.run_coroutine_threadsafe(send_status_update(bot, chat_id, status_text, status_message_id, edit_message_id), main_loop)
 
-    def send_video_callback(file_path, hook, start, end, virality_score):
-        score_text = f" {virality_score}/10" if virality_score is not None else ""
-        if hook: # Check if hook is not empty
-            caption = get_translation(lang, "video_caption").format(hook=hook, start=start[:-2], end=end[:-2], score=score_text)
-        else:
-            caption = get_translation(lang, "video_caption_no_hook").format(start=start[:-2], end=end[:-2], score=score_text)
-        return asyncio.run_coroutine_threadsafe(
-            send_video(
+    def send_video_callback(file_path, hook, start, end, virality_score, clip_key=None):
+        caption = format_clip_caption(lang, hook, start, end, virality_score)
+        async def send_and_checkpoint():
+            sent = await send_video(
                 bot,
                 chat_id,
                 file_path,
@@ -204,9 +332,13 @@ async def run_processing(chat_id: int, user_data: dict, application: Application
                 edit_message_id,
                 FORWARD_RESULTS_GROUP_ID,
                 generation_id,
-            ),
-            main_loop,
-        )
+                clip_key,
+            )
+            if sent and checkpoint is not None:
+                await asyncio.to_thread(checkpoint.mark_sent, start, end)
+            return sent
+
+        return asyncio.run_coroutine_threadsafe(send_and_checkpoint(), main_loop)
 
     try:
         delete_output = DELETE_OUTPUT_AFTER_SENDING
@@ -217,42 +349,26 @@ async def run_processing(chat_id: int, user_data: dict, application: Application
             user_data['config'],
             status_callback,
             send_video_callback,
-            delete_output
+            delete_output,
+            checkpoint
         )
 
         if shorts_generated_count > 0:
             from database import get_user, deduct_generation_from_balance
             
-            # Deduct a generation credit for the successful operation
-            deduct_generation_from_balance(chat_id)
+            # Deduct a generation credit for the successful operation (once, even if the task was resumed)
+            if checkpoint is None or not checkpoint.charged:
+                await run_db(deduct_generation_from_balance, chat_id)
+                if checkpoint is not None:
+                    checkpoint.mark_charged()
             
-            # Fetch the updated balance
-            _, new_balance, _, lang, _ = get_user(chat_id)
-
             log_event(chat_id, 'generation_success', {
                 'url': user_data['url'],
                 'generated_count': shorts_generated_count,
                 'generation_id': generation_id
             })
             
-            final_message = get_translation(lang, "processing_complete").format(new_balance=new_balance)
-            if extra_shorts_found > 0:
-                final_message += get_translation(lang, "extra_shorts_found").format(extra_shorts_found=extra_shorts_found)
-
-            # Create rating keyboard
-            rating_keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton(str(i), callback_data=f'rate_{i}') for i in range(1, 6)]
-            ])
-
-            # Send one message with keyboard
-            await send_message_safely(
-                bot,
-                chat_id=chat_id,
-                text=final_message,
-                parse_mode="HTML",
-                reply_markup=rating_keyboard,
-                reply_to_message_id=status_message_id
-            )
+            await send_completion_message(bot, chat_id, extra_shorts_found, status_message_id)
         else:
             log_event(chat_id, 'generation_error', {
                 'url': user_data['url'], 
@@ -268,6 +384,8 @@ async def run_processing(chat_id: int, user_data: dict, application: Application
             )
 
 
+    except TaskCancelled:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при обработке видео для чата {chat_id}: {e}", exc_info=True)
         log_event(chat_id, 'generation_error', {
@@ -282,28 +400,140 @@ async def run_processing(chat_id: int, user_data: dict, application: Application
             reply_to_message_id=edit_message_id
         )
 
+async def _deliver_task_event(application: Application, task_id: int, chat_id: int, kind: str, payload: dict, edit_message_ids: dict):
+    """Выполняет в Telegram одно событие, присланное воркером из worker.py."""
+    bot = application.bot
+    _, _, _, lang, _ = await run_db(get_user, chat_id)
+    status_message_id = payload.get('status_message_id')
+    # Ответы идут на сообщение «обработка началась»; после рестарта бота - на исходное сообщение
+    edit_message_id = edit_message_ids.get(task_id, status_message_id)
+
+    if kind == 'started':
+        processing_message = await send_message_safely(
+            bot, chat_id, get_translation(lang, "processing_started"), reply_to_message_id=status_message_id
+        )
+        if processing_message:
+            edit_message_ids[task_id] = processing_message.message_id
+
+    elif kind == 'status':
+        await send_status_update(bot, chat_id, payload['text'], status_message_id, edit_message_id)
+
+    elif kind == 'clip':
+        caption = format_clip_caption(lang, payload.get('hook'), payload['start'], payload['end'], payload.get('virality_score'))
+        # Временная ошибка Telegram пробрасывается: файл остаётся в outbox до повторной попытки
+        sent = await send_video(bot, chat_id, payload['file_path'], caption, edit_message_id, FORWARD_RESULTS_GROUP_ID,
+                                payload.get('generation_id'), payload.get('clip_key'), raise_transient=True)
+        if sent:
+            if payload.get('clip_id'):
+                await run_db(mark_task_clip_sent, task_id, payload['clip_id'])
+            # Генерация списывается один раз за задачу - когда пользователь получил первый клип
+            if await run_db(charge_task_once, task_id, chat_id):
+                logger.info(f"Charged chat {chat_id} for task {task_id} after the first delivered clip.")
+        _discard_event_file(kind, payload)
+
+    elif kind == 'finished':
+        edit_message_ids.pop(task_id, None)
+        # Итог по доставленным клипам: если ни один не дошёл, задача не списана
+        if payload.get('generated_count', 0) > 0 and await run_db(is_task_charged, task_id):
+            await send_completion_message(bot, chat_id, payload.get('extra_shorts_found', 0), status_message_id)
+        else:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=get_translation(lang, "no_shorts_generated"),
+                parse_mode="HTML",
+                reply_to_message_id=edit_message_id
+            )
+
+    elif kind == 'error':
+        edit_message_ids.pop(task_id, None)
+        await bot.send_message(
+            chat_id=chat_id,
+            text=get_translation(lang, "critical_processing_error").format(e=payload.get('error')),
+            reply_to_message_id=edit_message_id
+        )
+
+
+def _discard_event_file(kind: str, payload: dict):
+    """Удаляет из outbox файл клипа, который больше не будут отправлять."""
+    file_path = payload.get('file_path') if kind == 'clip' else None
+    if file_path and os.path.exists(file_path):
+        os.remove(file_path)
+
+
+async def _deliver_task_events(application: Application, task_id: int, events: list, edit_message_ids: dict):
+    """
+    Доставляет события одной задачи строго по порядку. На временной ошибке Telegram
+    событие и всё после него остаются в очереди: диспетчер повторит их после паузы.
+    """
+    for event_id, _, chat_id, kind, payload, attempts in events:
+        try:
+            await _deliver_task_event(application, task_id, chat_id, kind, payload, edit_message_ids)
+        except Exception as e:
+            if _is_transient_telegram_error(e) and attempts + 1 < TASK_EVENT_MAX_ATTEMPTS:
+                logger.warning(f"Событие {kind} задачи {task_id} не доставлено (попытка {attempts + 1}/{TASK_EVENT_MAX_ATTEMPTS}), повторим: {e}")
+                await run_db(record_task_event_failure, event_id)
+                retry_after = getattr(e, 'retry_after', None)
+                if hasattr(retry_after, 'total_seconds'):
+                    retry_after = retry_after.total_seconds()
+                # Пока consumer ждёт, диспетчер не берёт события этой задачи
+                await asyncio.sleep(retry_after or min(2 ** attempts, 60))
+                return
+            logger.error(f"Не удалось доставить событие {kind} задачи {task_id} в чат {chat_id}: {e}", exc_info=True)
+            _discard_event_file(kind, payload)
+        await run_db(mark_task_event_delivered, event_id)
+
+
+async def task_event_dispatcher(application: Application):
+    """
+    Доставляет в Telegram события отдельных воркеров (worker.py): у каждой задачи свой
+    consumer, который идёт по её событиям по порядку, так что медленная загрузка одного
+    клипа не задерживает остальных пользователей.
+    """
+    edit_message_ids = {}
+    consumers = {}  # task_id -> asyncio.Task, доставляющая события задачи
+    while True:
+        try:
+            for task_id in [task_id for task_id, consumer in consumers.items() if consumer.done()]:
+                consumer = consumers.pop(task_id)
+                if not consumer.cancelled() and consumer.exception():
+                    logger.error(f"Доставка событий задачи {task_id} прервалась: {consumer.exception()}")
+            events = await run_db(get_pending_task_events, exclude_task_ids=list(consumers))
+            events_by_task = {}
+            for event in events:
+                events_by_task.setdefault(event[1], []).append(event)
+            for task_id, task_events in events_by_task.items():
+                consumers[task_id] = asyncio.create_task(
+                    _deliver_task_events(application, task_id, task_events, edit_message_ids)
+                )
+        except Exception as e:
+            logger.error(f"Ошибка диспетчера событий задач: {e}", exc_info=True)
+        await asyncio.sleep(TASK_EVENT_POLL_INTERVAL)
+
+
 async def post_init_hook(application: Application):
     """Выполняется после инициализации приложения для настройки фоновых задач."""
-    # Создаем и сохраняем очередь в bot_data
-    processing_queue = asyncio.Queue()
-    application.bot_data['processing_queue'] = processing_queue
-    application.bot_data['busy_workers'] = 0
-    application.bot_data['busy_workers_lock'] = asyncio.Lock()
-
-    # Загружаем невыполненные задачи из базы данных
-    pending_tasks = get_pending_tasks()
-    for task in pending_tasks:
-        await processing_queue.put(task)
-    logger.info(f"Загружено {len(pending_tasks)} невыполненных задач из базы данных.")
-
-    # Запускаем воркеры в зависимости от MAX_CONCURRENT_TASKS
-    max_concurrent_tasks = MAX_CONCURRENT_TASKS
-
-    for i in range(max_concurrent_tasks):
-        asyncio.create_task(processing_worker(processing_queue, application))
-        logger.info(f"Запущен воркер #{i + 1}")
-
-    logger.info(f"Очередь обработки и {max_concurrent_tasks} воркер(а/ов) успешно запущены.")
+    # Очередь живёт в БД; событие будит воркеры при добавлении новой задачи
+    application.bot_data['task_wakeup'] = asyncio.Event()
+
+    purge_finished_tasks(FINISHED_TASKS_RETENTION_SECONDS)
+    # Задачи, прерванные рестартом, снова возьмутся воркерами, когда истечёт их аренда
+    logger.info(f"В очереди {len(get_pending_tasks())} невыполненных задач.")
+
+    # Результаты отдельных воркеров (worker.py) доставляются в любом режиме
+    asyncio.create_task(task_event_dispatcher(application))
+    # Рассылки, прерванные рестартом, продолжаются с неотправленных получателей
+    asyncio.create_task(resume_broadcasts(application.bot))
+
+    if WORKER_MODE == 'frontend':
+        logger.info("Режим frontend: задачи обрабатываются только отдельными воркерами (worker.py).")
+    else:
+        # Число параллельных задач определяет планировщик по бюджету CPU/RAM
+        node_id = f"{socket.gethostname()}:{os.getpid()}"
+        asyncio.create_task(scheduler_loop(application, node_id))
+        logger.info(
+            f"Очередь обработки запущена: бюджет {SCHEDULER_CPU_BUDGET} CPU, "
+            f"{SCHEDULER_RAM_BUDGET_MB} МБ RAM, до {SCHEDULER_MAX_JOBS} задач."
+        )
 
     # Инициализация аналитической базы данных
     init_analytics_db()
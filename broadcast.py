@@ -0,0 +1,196 @@
+import time
+import asyncio
+import logging
+from typing import Optional
+
+from telegram import Bot, Message, MessageEntity, InlineKeyboardMarkup
+from telegram.error import TelegramError, RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+from config import (
+    BROADCAST_RATE, BROADCAST_BURST, BROADCAST_CONCURRENCY, BROADCAST_PER_CHAT_INTERVAL,
+    BROADCAST_MAX_RETRIES, BROADCAST_CHECKPOINT_EVERY
+)
+from database import (
+    run_db, create_broadcast, get_broadcast, get_running_broadcast_ids, get_pending_broadcast_recipients,
+    record_broadcast_results, get_broadcast_stats, finish_broadcast,
+    RECIPIENT_SENT, RECIPIENT_FAILED, RECIPIENT_BLOCKED
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки BadRequest, после которых писать пользователю бессмысленно
+UNREACHABLE_CHAT_ERRORS = ('chat not found', 'user is deactivated', 'peer_id_invalid')
+
+
+class TokenBucket:
+    """
+    Global send limiter: `rate` messages per second with bursts of up to `capacity`.
+    pause() stops every sender, e.g. after Telegram answers with RetryAfter.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = max(rate, 0.1)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    # В новых версиях python-telegram-bot это timedelta
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else float(retry_after)
+
+
+def message_payload(message: Message, reply_markup: Optional[InlineKeyboardMarkup] = None) -> dict:
+    """Serializable copy of an admin's post, so an interrupted broadcast can be resumed."""
+    return {
+        'text': message.text,
+        'entities': [entity.to_dict() for entity in message.entities] if message.entities else None,
+        'caption': message.caption,
+        'caption_entities': [entity.to_dict() for entity in message.caption_entities] if message.caption_entities else None,
+        'photo': message.photo[-1].file_id if message.photo else None,
+        'animation': message.animation.file_id if message.animation else None,
+        'reply_markup': reply_markup.to_dict() if reply_markup else None,
+    }
+
+
+async def _send_payload(bot: Bot, chat_id: int, payload: dict):
+    entities = MessageEntity.de_list(payload.get('entities'), bot) if payload.get('entities') else None
+    caption_entities = MessageEntity.de_list(payload.get('caption_entities'), bot) if payload.get('caption_entities') else None
+    reply_markup = InlineKeyboardMarkup.de_json(payload['reply_markup'], bot) if payload.get('reply_markup') else None
+    if payload.get('photo'):
+        await bot.send_photo(chat_id=chat_id, photo=payload['photo'], caption=payload.get('caption'),
+                             caption_entities=caption_entities, reply_markup=reply_markup)
+    elif payload.get('animation'):
+        await bot.send_animation(chat_id=chat_id, animation=payload['animation'], caption=payload.get('caption'),
+                                 caption_entities=caption_entities, reply_markup=reply_markup)
+    elif payload.get('text'):
+        await bot.send_message(chat_id=chat_id, text=payload['text'], entities=entities, reply_markup=reply_markup)
+
+
+async def _send_to_user(bot: Bot, bucket: TokenBucket, last_sent_at: dict, user_id: int, payload: dict) -> str:
+    """Sends the post to one user with retries; returns the recipient status."""
+    for attempt in range(BROADCAST_MAX_RETRIES + 1):
+        # Не чаще одного сообщения в секунду в один чат (актуально для повторов)
+        wait = last_sent_at.get(user_id, 0.0) + BROADCAST_PER_CHAT_INTERVAL - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await bucket.acquire()
+        last_sent_at[user_id] = time.monotonic()
+        try:
+            await _send_payload(bot, user_id, payload)
+            return RECIPIENT_SENT
+        except RetryAfter as e:
+            seconds = _retry_after_seconds(e)
+            logger.warning(f"Broadcast throttled by Telegram, pausing all senders for {seconds}s.")
+            bucket.pause(seconds + 1)
+        except Forbidden:
+            return RECIPIENT_BLOCKED
+        except BadRequest as e:
+            if any(reason in str(e).lower() for reason in UNREACHABLE_CHAT_ERRORS):
+                return RECIPIENT_BLOCKED
+            logger.error(f"Failed to send broadcast message to {user_id}: {e}")
+            return RECIPIENT_FAILED
+        except (TimedOut, NetworkError) as e:
+            logger.warning(f"Network error while sending broadcast to {user_id} (attempt {attempt + 1}): {e}")
+            await asyncio.sleep(2 ** attempt)
+        except TelegramError as e:
+            logger.error(f"Failed to send broadcast message to {user_id}: {e}")
+            return RECIPIENT_FAILED
+    return RECIPIENT_FAILED
+
+
+async def run_broadcast(bot: Bot, broadcast_id: int):
+    """
+    Sends a stored broadcast to its pending recipients with BROADCAST_CONCURRENCY senders
+    sharing one token bucket. Results are checkpointed in batches, so after a restart
+    the broadcast continues with the recipients that were not reached yet.
+    """
+    broadcast = await run_db(get_broadcast, broadcast_id)
+    if broadcast is None:
+        return
+    admin_chat_id, label, payload, _ = broadcast
+    user_ids = await run_db(get_pending_broadcast_recipients, broadcast_id)
+    logger.info(f"Broadcast {broadcast_id} ({label}): {len(user_ids)} recipients left.")
+
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+    bucket = TokenBucket(BROADCAST_RATE, BROADCAST_BURST)
+    last_sent_at = {}
+    results = []
+    results_lock = asyncio.Lock()
+
+    async def checkpoint():
+        async with results_lock:
+            batch = results[:]
+            results.clear()
+        await run_db(record_broadcast_results, broadcast_id, batch)
+
+    async def sender():
+        while True:
+            try:
+                user_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            status = await _send_to_user(bot, bucket, last_sent_at, user_id, payload)
+            last_sent_at.pop(user_id, None)
+            async with results_lock:
+                results.append((user_id, status))
+                flush = len(results) >= BROADCAST_CHECKPOINT_EVERY
+            if flush:
+                await checkpoint()
+
+    try:
+        await asyncio.gather(*(sender() for _ in range(max(1, BROADCAST_CONCURRENCY))))
+    finally:
+        # Отправленное сохраняется даже при отмене, чтобы не слать повторно после рестарта
+        await checkpoint()
+
+    await run_db(finish_broadcast, broadcast_id)
+    stats = await run_db(get_broadcast_stats, broadcast_id)
+    sent = stats.get(RECIPIENT_SENT, 0)
+    failed = stats.get(RECIPIENT_FAILED, 0)
+    blocked = stats.get(RECIPIENT_BLOCKED, 0)
+    logger.info(f"Broadcast {broadcast_id} finished: sent {sent}, failed {failed}, blocked {blocked}.")
+    try:
+        await bot.send_message(
+            chat_id=admin_chat_id,
+            text=f"{label} завершена. Отправлено: {sent}. Ошибок: {failed + blocked} (заблокировали бота: {blocked})."
+        )
+    except TelegramError as e:
+        logger.error(f"Failed to report broadcast {broadcast_id} to admin: {e}")
+
+
+async def start_broadcast(bot: Bot, admin_chat_id: int, label: str, payload: dict, user_ids: Optional[list] = None) -> int:
+    """Stores a broadcast with its recipients and starts sending it in the background."""
+    broadcast_id = await run_db(create_broadcast, admin_chat_id, label, payload, user_ids)
+    asyncio.create_task(run_broadcast(bot, broadcast_id))
+    return broadcast_id
+
+
+async def resume_broadcasts(bot: Bot):
+    """Continues broadcasts interrupted by a restart."""
+    for broadcast_id in await run_db(get_running_broadcast_ids):
+        logger.info(f"Resuming broadcast {broadcast_id}.")
+        asyncio.create_task(run_broadcast(bot, broadcast_id))
@@ -1,10 +1,9 @@
 import logging
 import os
-import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand, BotCommandScopeChat
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.error import TelegramError
-from database import get_user, add_to_user_balance, set_user_balance, get_all_user_ids, delete_user, set_user_language, get_user_tasks_from_queue, get_queue_position, get_user_referrer, set_referral_discount, has_referral_discount, get_total_queue_length
+from database import run_db, get_user, add_to_user_balance, set_user_balance, delete_user, set_user_language, get_user_tasks_from_queue, get_queue_position, get_user_referrer, set_referral_discount, has_referral_discount
 from analytics import log_event
 from states import GET_URL, GET_TOPUP_METHOD, GET_BROADCAST_MESSAGE, GET_FEEDBACK_TEXT, GET_TARGETED_BROADCAST_MESSAGE, GET_LANGUAGE, GET_TOPUP_PACKAGE, GET_BROADCAST_W_PRICES_MESSAGE
 from config import TUTORIAL_LINK, ADMIN_USER_IDS, REFERRER_REWARD
@@ -15,7 +14,8 @@ from pricing import get_package_prices
 import csv
 import io
 import json
-from database import get_all_users_data
+from database import get_all_users_data, get_broadcast_stats, unmark_user_blocked, RECIPIENT_PENDING
+from broadcast import start_broadcast, message_payload
 
 # Configure logging
 logging.basicConfig(
@@ -50,14 +50,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
             except IndexError:
                 source = None
 
-    _, balance, _, lang, is_new = get_user(user_id, referrer_id=referrer_id, source=source)
+    _, balance, _, lang, is_new = await run_db(get_user, user_id, referrer_id=referrer_id, source=source)
+    # Пользователь мог раньше заблокировать бота - рассылки снова должны до него доходить
+    await run_db(unmark_user_blocked, user_id)
 
     if is_new:
         if referrer_id:
-            set_referral_discount(user_id, True)
-            set_referral_discount(referrer_id, True)
+            await run_db(set_referral_discount, user_id, True)
+            await run_db(set_referral_discount, referrer_id, True)
         lang = 'ru'
-        set_user_language(user_id, lang)
+        await run_db(set_user_language, user_id, lang)
         log_event(user_id, 'new_user', {'username': update.effective_user.username, 'referrer_id': referrer_id, 'source': source})
 
     # Set commands for the user
@@ -123,7 +125,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     await query.answer()
     lang = query.data.split('_')[-1]
     user_id = query.from_user.id
-    set_user_language(user_id, lang)
+    await run_db(set_user_language, user_id, lang)
     
     await query.edit_message_text(get_translation(lang, "language_set"))
     
@@ -133,7 +135,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 async def referral_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Sends the user their referral link."""
     user_id = update.effective_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     bot_username = context.bot.username
     referral_link = f"https://t.me/{bot_username}?start=ref_{user_id}"
     
@@ -145,7 +147,7 @@ async def referral_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправляет сообщение с помощью и списком команд."""
     user_id = update.effective_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     help_text = get_translation(lang, "help_text").format(tutorial_link=TUTORIAL_LINK)
     reply_markup = InlineKeyboardMarkup([
         [InlineKeyboardButton(get_translation(lang, "how_it_works_button"), url=TUTORIAL_LINK)]
@@ -161,7 +163,7 @@ async def topup_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         await query.answer()
     
     user_id = update.effective_user.id
-    _, balance, _, lang, _ = get_user(user_id)
+    _, balance, _, lang, _ = await run_db(get_user, user_id)
     log_event(user_id, 'topup_start', {})
 
     bot_username = context.bot.username
@@ -173,7 +175,7 @@ async def topup_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     is_discount_time = discount_active and discount_end_time and datetime.now(timezone.utc) < discount_end_time
 
     # Check for referral discount
-    referral_discount_active = has_referral_discount(user_id)
+    referral_discount_active = await run_db(has_referral_discount, user_id)
 
     packages = get_package_prices(discount_active=is_discount_time, referral_discount_active=referral_discount_active)
     
@@ -238,8 +240,8 @@ async def add_generations_command(update: Update, context: ContextTypes.DEFAULT_
             await update.message.reply_text("Количество генераций должно быть положительным числом.")
             return
 
-        add_to_user_balance(user_id, amount)
-        _, new_balance, _, _, _ = get_user(user_id)
+        await run_db(add_to_user_balance, user_id, amount)
+        _, new_balance, _, _, _ = await run_db(get_user, user_id)
 
         await update.message.reply_text(f"Баланс пользователя {user_id} успешно пополнен на {amount} генераций. Новый баланс: {new_balance}.")
 
@@ -271,7 +273,7 @@ async def set_user_balance_command(update: Update, context: ContextTypes.DEFAULT
 
         for user_id in user_ids:
             try:
-                set_user_balance(user_id, amount)
+                await run_db(set_user_balance, user_id, amount)
                 success_users.append(str(user_id))
             except Exception as e:
                 logger.error(f"Failed to set balance for user {user_id}: {e}")
@@ -299,94 +301,26 @@ async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return GET_BROADCAST_MESSAGE
 
 
-async def _send_broadcast(context: ContextTypes.DEFAULT_TYPE, admin_chat_id: int, text: str, entities, caption: str, caption_entities, photo: str, animation: str):
-    """Helper function to send broadcast messages in the background."""
-    user_ids = get_all_user_ids()
-    sent_count = 0
-    failed_count = 0
-
-    for user_id in user_ids:
-        try:
-            if photo:
-                await context.bot.send_photo(chat_id=user_id, photo=photo, caption=caption, caption_entities=caption_entities)
-            elif animation:
-                await context.bot.send_animation(chat_id=user_id, animation=animation, caption=caption, caption_entities=caption_entities)
-            elif text:
-                await context.bot.send_message(chat_id=user_id, text=text, entities=entities)
-            sent_count += 1
-        except TelegramError as e:
-            logger.error(f"Failed to send message to {user_id}: {e}")
-            failed_count += 1
-        
-        await asyncio.sleep(0.04) # ~25 messages per second
-
-    await context.bot.send_message(chat_id=admin_chat_id, text=f"Рассылка завершена. Отправлено: {sent_count}. Ошибок: {failed_count}.")
-
-
 async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the broadcast message task in the background."""
-    text = update.message.text
-    entities = update.message.entities
-    caption = update.message.caption
-    caption_entities = update.message.caption_entities
-    photo = update.message.photo[-1].file_id if update.message.photo else None
-    animation = update.message.animation.file_id if update.message.animation else None
-
-    asyncio.create_task(_send_broadcast(
-        context=context,
-        admin_chat_id=update.effective_chat.id,
-        text=text,
-        entities=entities,
-        caption=caption,
-        caption_entities=caption_entities,
-        photo=photo,
-        animation=animation
-    ))
-
-    await update.message.reply_text(f"Начинаю фоновую рассылку для {len(get_all_user_ids())} пользователей...")
+    broadcast_id = await start_broadcast(
+        context.bot, update.effective_chat.id, "Рассылка", message_payload(update.message)
+    )
+    recipients = (await run_db(get_broadcast_stats, broadcast_id)).get(RECIPIENT_PENDING, 0)
+    await update.message.reply_text(f"Начинаю фоновую рассылку для {recipients} пользователей...")
     return ConversationHandler.END
 
 
 async def broadcast_w_prices_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the broadcast with prices conversation."""
     user_id = update.effective_user.id
-    _, _, _, lang, _ = get_user(user_id) # Use get_user to retrieve language
+    _, _, _, lang, _ = await run_db(get_user, user_id) # Use get_user to retrieve language
     await update.message.reply_text(get_translation(lang, "broadcast_message_prompt"))
     return GET_BROADCAST_W_PRICES_MESSAGE
 
 
-async def _send_broadcast_w_prices(context: ContextTypes.DEFAULT_TYPE, admin_chat_id: int, message_text: str, entities, caption: str, caption_entities, photo: str, animation: str, reply_markup: InlineKeyboardMarkup):
-    """Helper function to send broadcast messages with prices in the background."""
-    user_ids = get_all_user_ids()
-    sent_count = 0
-    failed_count = 0
-
-    for user_id in user_ids:
-        try:
-            if photo:
-                await context.bot.send_photo(chat_id=user_id, photo=photo, caption=caption, caption_entities=caption_entities, reply_markup=reply_markup)
-            elif animation:
-                await context.bot.send_animation(chat_id=user_id, animation=animation, caption=caption, caption_entities=caption_entities, reply_markup=reply_markup)
-            elif message_text:
-                await context.bot.send_message(chat_id=user_id, text=message_text, entities=entities, reply_markup=reply_markup)
-            sent_count += 1
-        except TelegramError as e:
-            logger.error(f"Failed to send message to {user_id}: {e}")
-            failed_count += 1
-        await asyncio.sleep(0.04)  # ~25 messages per second
-
-    await context.bot.send_message(chat_id=admin_chat_id, text=f"Рассылка с ценами завершена. Отправлено: {sent_count}. Ошибок: {failed_count}.")
-
-
 async def broadcast_w_prices_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the broadcast message with prices task in the background."""
-    message_text = update.message.text
-    entities = update.message.entities
-    caption = update.message.caption
-    caption_entities = update.message.caption_entities
-    photo = update.message.photo[-1].file_id if update.message.photo else None
-    animation = update.message.animation.file_id if update.message.animation else None
-    
     lang = 'ru'
 
     # Create inline keyboard with pricing packages
@@ -430,19 +364,11 @@ async def broadcast_w_prices_message(update: Update, context: ContextTypes.DEFAU
     
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    asyncio.create_task(_send_broadcast_w_prices(
-        context=context,
-        admin_chat_id=update.effective_chat.id,
-        message_text=message_text,
-        entities=entities,
-        caption=caption,
-        caption_entities=caption_entities,
-        photo=photo,
-        animation=animation,
-        reply_markup=reply_markup
-    ))
-
-    await update.message.reply_text(f"Начинаю фоновую рассылку с ценами для {len(get_all_user_ids())} пользователей...")
+    broadcast_id = await start_broadcast(
+        context.bot, update.effective_chat.id, "Рассылка с ценами", message_payload(update.message, reply_markup)
+    )
+    recipients = (await run_db(get_broadcast_stats, broadcast_id)).get(RECIPIENT_PENDING, 0)
+    await update.message.reply_text(f"Начинаю фоновую рассылку с ценами для {recipients} пользователей...")
     return ConversationHandler.END
 
 
@@ -465,53 +391,16 @@ async def broadcast_to_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await update.message.reply_text("Неверный формат ID. Пожалуйста, укажите ID пользователей через запятую. Например: /broadcast_to 123,456,789")
         return ConversationHandler.END
 
-async def _send_broadcast_to(context: ContextTypes.DEFAULT_TYPE, admin_chat_id: int, user_ids: list, text: str, entities, caption: str, caption_entities, photo: str, animation: str):
-    """Helper function to send targeted broadcast messages in the background."""
-    sent_count = 0
-    failed_count = 0
-
-    for user_id in user_ids:
-        try:
-            if photo:
-                await context.bot.send_photo(chat_id=user_id, photo=photo, caption=caption, caption_entities=caption_entities)
-            elif animation:
-                await context.bot.send_animation(chat_id=user_id, animation=animation, caption=caption, caption_entities=caption_entities)
-            elif text:
-                await context.bot.send_message(chat_id=user_id, text=text, entities=entities)
-            sent_count += 1
-        except TelegramError as e:
-            logger.error(f"Failed to send message to {user_id}: {e}")
-            failed_count += 1
-        await asyncio.sleep(0.04)  # ~25 messages per second
-
-    await context.bot.send_message(chat_id=admin_chat_id, text=f"Целевая рассылка завершена. Отправлено: {sent_count}. Ошибок: {failed_count}.")
-
-
 async def broadcast_to_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the targeted broadcast message task in the background."""
-    text = update.message.text
-    entities = update.message.entities
-    caption = update.message.caption
-    caption_entities = update.message.caption_entities
-    photo = update.message.photo[-1].file_id if update.message.photo else None
-    animation = update.message.animation.file_id if update.message.animation else None
-
     user_ids = context.user_data.get('broadcast_to_ids', [])
     if not user_ids:
         await update.message.reply_text("Не найдены ID пользователей для рассылки.")
         return ConversationHandler.END
 
-    asyncio.create_task(_send_broadcast_to(
-        context=context,
-        admin_chat_id=update.effective_chat.id,
-        user_ids=user_ids,
-        text=text,
-        entities=entities,
-        caption=caption,
-        caption_entities=caption_entities,
-        photo=photo,
-        animation=animation
-    ))
+    await start_broadcast(
+        context.bot, update.effective_chat.id, "Целевая рассылка", message_payload(update.message), user_ids=user_ids
+    )
 
     await update.message.reply_text(f"Начинаю фоновую целевую рассылку для {len(user_ids)} пользователей...")
     return ConversationHandler.END
@@ -519,7 +408,7 @@ async def broadcast_to_message(update: Update, context: ContextTypes.DEFAULT_TYP
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancels and ends the current conversation."""
     user_id = update.effective_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     context.user_data.clear()
     context.user_data['config'] = {}
     await update.message.reply_text(
@@ -568,7 +457,7 @@ async def remove_user_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         user_id_str = context.args[0]
         user_id = int(user_id_str)
 
-        delete_user(user_id)
+        await run_db(delete_user, user_id)
 
         await update.message.reply_text(f"Пользователь {user_id} успешно удален.")
 
@@ -584,7 +473,7 @@ async def export_users_command(update: Update, context: ContextTypes.DEFAULT_TYP
     await update.message.reply_text("Выгружаю данные... Это может занять несколько секунд.")
 
     try:
-        users_data = get_all_users_data()
+        users_data = await run_db(get_all_users_data)
         
         output = io.StringIO()
         writer = csv.writer(output)
@@ -609,30 +498,24 @@ async def export_users_command(update: Update, context: ContextTypes.DEFAULT_TYP
 async def start_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Starts the feedback conversation."""
     user_id = update.effective_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     await update.message.reply_text(get_translation(lang, "send_feedback_prompt"))
     return GET_FEEDBACK_TEXT
 
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
-    user_tasks_from_db = get_user_tasks_from_queue(user_id)
+    user_tasks_from_db = await run_db(get_user_tasks_from_queue, user_id)
 
     if not user_tasks_from_db:
         await update.message.reply_text(get_translation(lang, "no_tasks_in_queue"))
         return
 
-    async with context.bot_data['busy_workers_lock']:
-        busy_workers = context.bot_data['busy_workers']
-    
-    total_queue_length = get_total_queue_length()
-    
     user_tasks = []
     for task_id, user_data_json in user_tasks_from_db:
-        absolute_position = get_queue_position(task_id)
-        # Your position in the waiting line
-        queue_position = absolute_position - busy_workers
+        # Your position in the waiting line; 0 means a worker has already taken the task
+        queue_position = await run_db(get_queue_position, task_id)
         user_data = json.loads(user_data_json)
         user_tasks.append({
             'position': queue_position,
@@ -15,6 +15,37 @@ REQUIRED_CHANNELS = [channel.strip() for channel in os.environ.get("REQUIRED_CHA
 FEEDBACK_GROUP_ID = os.environ.get("FEEDBACK_GROUP_ID")
 FORWARD_RESULTS_GROUP_ID = os.environ.get("FORWARD_RESULTS_GROUP_ID")
 MAX_CONCURRENT_TASKS = int(os.environ.get("MAX_CONCURRENT_TASKS", "1"))
+# Планировщик задач: бюджеты CPU (ядра) и RAM на процесс обработки; лимит одновременных задач
+def _total_memory_mb():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 8192
+SCHEDULER_CPU_BUDGET = float(os.environ.get("SCHEDULER_CPU_BUDGET", os.cpu_count() or 2))
+SCHEDULER_RAM_BUDGET_MB = float(os.environ.get("SCHEDULER_RAM_BUDGET_MB", int(_total_memory_mb() * 0.75)))
+SCHEDULER_MAX_JOBS = int(os.environ.get("SCHEDULER_MAX_JOBS", max(MAX_CONCURRENT_TASKS, 4)))
+# Сколько секунд тяжёлую задачу могут обгонять лёгкие, прежде чем планировщик придержит место под неё
+SCHEDULER_MAX_BYPASS_WAIT = float(os.environ.get("SCHEDULER_MAX_BYPASS_WAIT", "600"))
+# Очередь задач в БД: аренда задачи воркером продлевается heartbeat'ом, после истечения задачу берёт другой воркер
+TASK_LEASE_SECONDS = float(os.environ.get("TASK_LEASE_SECONDS", "300"))
+TASK_HEARTBEAT_INTERVAL = float(os.environ.get("TASK_HEARTBEAT_INTERVAL", "60"))
+TASK_MAX_ATTEMPTS = int(os.environ.get("TASK_MAX_ATTEMPTS", "3"))
+TASK_POLL_INTERVAL = float(os.environ.get("TASK_POLL_INTERVAL", "5"))
+# 'embedded' - бот сам обрабатывает задачи; 'frontend' - бот только принимает задачи и доставляет результаты,
+# обработку выполняют отдельные процессы worker.py (общая БД и общий WORKER_OUTBOX_DIR)
+WORKER_MODE = os.environ.get("WORKER_MODE", "embedded").lower()
+WORKER_OUTBOX_DIR = os.environ.get("WORKER_OUTBOX_DIR", "data/outbox")
+TASK_EVENT_POLL_INTERVAL = float(os.environ.get("TASK_EVENT_POLL_INTERVAL", "1"))
+# Сколько раз повторять доставку события при сетевых ошибках Telegram, прежде чем отказаться
+TASK_EVENT_MAX_ATTEMPTS = int(os.environ.get("TASK_EVENT_MAX_ATTEMPTS", "5"))
+# Рассылки: общий лимит сообщений в секунду (Telegram ~30/с), всплеск, параллельные отправители,
+# минимальный интервал между сообщениями в один чат и как часто сохранять прогресс в БД
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_BURST = int(os.environ.get("BROADCAST_BURST", "5"))
+BROADCAST_CONCURRENCY = int(os.environ.get("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.environ.get("BROADCAST_PER_CHAT_INTERVAL", "1"))
+BROADCAST_MAX_RETRIES = int(os.environ.get("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_CHECKPOINT_EVERY = int(os.environ.get("BROADCAST_CHECKPOINT_EVERY", "200"))
 REWARD_FOR_FEEDBACK = int(os.environ.get("REWARD_FOR_FEEDBACK", 1))
 REWARD_FOR_SUBSCRIPTION = int(os.environ.get("REWARD_FOR_SUBSCRIPTION", 1))
 START_BALANCE = int(os.environ.get("START_BALANCE", 1))
@@ -22,19 +53,77 @@ REFERRER_REWARD = int(os.environ.get("REFERRER_REWARD", 1))
 
 # --- OpenAI ---
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+GPT_HIGHLIGHTS_MODEL = os.environ.get("GPT_HIGHLIGHTS_MODEL", "gpt-5-nano")
+# Транскрипт длиннее лимита режется на окна по времени, которые оцениваются параллельно
+GPT_INLINE_MAX_CHARS = int(os.environ.get("GPT_INLINE_MAX_CHARS", "120000"))
+GPT_CHUNK_DURATION = float(os.environ.get("GPT_CHUNK_DURATION", "1800"))
+GPT_CHUNK_WORKERS = int(os.environ.get("GPT_CHUNK_WORKERS", "4"))
 
 # --- Video Processing ---
 MAX_SHORTS_PER_VIDEO = 15
 MIN_SHORT_DURATION = 35.0
 MAX_SHORT_DURATION = 60.0
 DELETE_OUTPUT_AFTER_SENDING = os.environ.get("DELETE_OUTPUT_AFTER_SENDING", "false").lower() == "true"
+# 'ffmpeg' - один проход ffmpeg (filter_complex), 'moviepy' - старый рендер через moviepy
+RENDER_ENGINE = os.environ.get("RENDER_ENGINE", "ffmpeg").lower()
+# Общий пул процессов рендера на все воркеры и лимит одновременных клипов на одну задачу
+RENDER_POOL_SIZE = int(os.environ.get("RENDER_POOL_SIZE", max(1, (os.cpu_count() or 2) // 2)))
+RENDER_WORKERS_PER_JOB = int(os.environ.get("RENDER_WORKERS_PER_JOB", "2"))
+# Ридеры фонов/баннеров, которые процесс рендера держит открытыми между клипами, и сколько клипов служит один ридер
+ASSET_MAX_OPEN_READERS = int(os.environ.get("ASSET_MAX_OPEN_READERS", "4"))
+ASSET_READER_MAX_USES = int(os.environ.get("ASSET_READER_MAX_USES", "50"))
+# Параллельная загрузка сегментов: число потоков, ретраи с бэкоффом, пауза между запросами к одному хосту
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "3"))
+DOWNLOAD_RETRIES = int(os.environ.get("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_RETRY_BACKOFF = float(os.environ.get("DOWNLOAD_RETRY_BACKOFF", "2.0"))
+DOWNLOAD_HOST_MIN_INTERVAL = float(os.environ.get("DOWNLOAD_HOST_MIN_INTERVAL", "1.0"))
+# Сколько скачанных, но ещё не отрендеренных сегментов может лежать на диске
+SEGMENT_BUFFER_SIZE = int(os.environ.get("SEGMENT_BUFFER_SIZE", "4"))
+# 'copy' - сегменты копируются без перекодирования (точная обрезка при рендере), 'reencode' - старый режим
+SEGMENT_EXTRACTION_MODE = os.environ.get("SEGMENT_EXTRACTION_MODE", "copy").lower()
+SEGMENT_MAX_PREROLL = float(os.environ.get("SEGMENT_MAX_PREROLL", "20.0"))  # макс. расстояние до ключевого кадра, сек
 PROJECT_ROOT = Path(__file__).parent
 KEEPERS_DIR = PROJECT_ROOT / "keepers"
 HAARCASCADE_FRONTALFACE_DEFAULT = str(PROJECT_ROOT / "haarcascade_frontalface_default.xml")
 HAARCASCADE_PROFILEFACE = str(PROJECT_ROOT / "haarcascade_profileface.xml")
+# DNN-детектор лиц YuNet (face_detection_yunet_2023mar.onnx из opencv_zoo); без файла используются каскады Хаара
+FACE_DETECTOR_MODEL = os.environ.get("FACE_DETECTOR_MODEL", str(PROJECT_ROOT / "face_detection_yunet_2023mar.onnx"))
+# Кэш траекторий лиц по (видео, начало, конец), общий для всех лейаутов
+FACE_TRACK_CACHE_DIR = os.environ.get("FACE_TRACK_CACHE_DIR", "data/face_tracks")
+FACE_TRACK_CACHE_MAX_FILES = int(os.environ.get("FACE_TRACK_CACHE_MAX_FILES", "5000"))
+# Нарезанные под размеры лейаутов фоны (python -m processing.backgrounds); без библиотеки берутся исходники из keepers
+BACKGROUNDS_DIR = os.environ.get("BACKGROUNDS_DIR", str(PROJECT_ROOT / "data" / "backgrounds"))
+# Баннеры, заранее уменьшенные до ширины оверлея, для ffmpeg-рендера
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", str(PROJECT_ROOT / "data" / "assets"))
+BACKGROUND_CHUNK_SECONDS = float(os.environ.get("BACKGROUND_CHUNK_SECONDS", "10"))
 CONFIG_EXAMPLES_DIR = PROJECT_ROOT / "config_examples"
 DEMO_SHORTS_DIR = PROJECT_ROOT / "demo_shorts"
 YOUTUBE_COOKIES_FILE = os.environ.get("YOUTUBE_COOKIES_FILE")
+# --- Whisper ---
+# Модели по режиму субтитров: пословные тайминги важнее качества распознавания фраз
+WHISPER_MODEL_WORD_BY_WORD = os.environ.get("WHISPER_MODEL_WORD_BY_WORD", "small")
+WHISPER_MODEL_PHRASES = os.environ.get("WHISPER_MODEL_PHRASES", "small")
+WHISPER_BEAM_SIZE_WORD_BY_WORD = int(os.environ.get("WHISPER_BEAM_SIZE_WORD_BY_WORD", "5"))
+WHISPER_COMPUTE_TYPE = os.environ.get("WHISPER_COMPUTE_TYPE", "int8")
+# Общий бюджет ядер Whisper на все размеры моделей и процессы рендера
+WHISPER_CPU_BUDGET = int(os.environ.get("WHISPER_CPU_BUDGET", max(1, (os.cpu_count() or 2) // 2)))
+# Сколько распознаваний идёт одновременно (на все пулы вместе) и потоки на инстанс (pool * threads <= бюджета)
+WHISPER_POOL_SIZE = int(os.environ.get("WHISPER_POOL_SIZE", "1"))
+WHISPER_CPU_THREADS = int(os.environ.get("WHISPER_CPU_THREADS", max(1, WHISPER_CPU_BUDGET // max(1, WHISPER_POOL_SIZE))))
+WHISPER_NUM_WORKERS = int(os.environ.get("WHISPER_NUM_WORKERS", "1"))
+# Батчевый пайплайн faster-whisper (>= 1.1) для транскрибации целых файлов, 0 - выключен
+WHISPER_BATCH_SIZE = int(os.environ.get("WHISPER_BATCH_SIZE", "8"))
+# Кэш метаданных yt-dlp (extract_info) по ID видео
+VIDEO_INFO_CACHE_TTL = int(os.environ.get("VIDEO_INFO_CACHE_TTL", "1800"))
+VIDEO_INFO_CACHE_SIZE = int(os.environ.get("VIDEO_INFO_CACHE_SIZE", "64"))
+# Кэш найденных хайлайтов (таймкоды + транскрипт) по ID видео и настройкам
+HIGHLIGHT_CACHE_DB = os.environ.get("HIGHLIGHT_CACHE_DB", "data/highlight_cache.db")
+HIGHLIGHT_CACHE_TTL = int(os.environ.get("HIGHLIGHT_CACHE_TTL", str(7 * 24 * 3600)))
+HIGHLIGHT_CACHE_MAX_ENTRIES = int(os.environ.get("HIGHLIGHT_CACHE_MAX_ENTRIES", "5000"))
+# Кэш готовых клипов (mp4 + Telegram file_id), LRU по суммарному размеру
+CLIP_CACHE_DIR = os.environ.get("CLIP_CACHE_DIR", "data/clip_cache")
+CLIP_CACHE_DB = os.environ.get("CLIP_CACHE_DB", "data/clip_cache.db")
+CLIP_CACHE_MAX_BYTES = int(float(os.environ.get("CLIP_CACHE_MAX_MB", "5120")) * 1024 * 1024)
 
 VIDEO_MAP = {
     'gta': str(KEEPERS_DIR / 'gta.mp4'),
@@ -51,6 +140,14 @@ TUTORIAL_LINK = "https://telegra.ph/Kak-sdelat-virusnyj-Shorts-za-5-minut-09-20"
 
 # --- Database ---
 DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite:///./data/database.db")
+# SQLite (data/clipcut.db): одно WAL-соединение на поток, ожидание блокировки, кэш подготовленных запросов
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "30000"))
+DB_CACHED_STATEMENTS = int(os.environ.get("DB_CACHED_STATEMENTS", "256"))
+# Потоки, на которых async-код бота выполняет запросы к БД (run_db)
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", "4"))
+# Кэш профилей пользователей (язык, баланс, флаги) в памяти процесса; записи через database.py его сбрасывают
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "120"))
 
 # --- Analytics ---
 ANALYTICS_DATABASE_URL = os.environ.get("ANALYTICS_DATABASE_URL", "sqlite:///./data/analytics.db")
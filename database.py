@@ -1,12 +1,84 @@
+import os
+import json
+import time
 import sqlite3
+import asyncio
+import bisect
+import threading
+import contextlib
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple
-from config import START_BALANCE
+from config import (
+    START_BALANCE, TASK_LEASE_SECONDS, TASK_MAX_ATTEMPTS,
+    DB_BUSY_TIMEOUT_MS, DB_CACHED_STATEMENTS, DB_EXECUTOR_WORKERS, USER_CACHE_SIZE, USER_CACHE_TTL
+)
 
 DB_FILE = "data/clipcut.db"
 
+_local = threading.local()
+_db_executor = None
+_db_executor_lock = threading.Lock()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение текущего потока (создаётся один раз на поток).
+    WAL позволяет читать во время записи воркером, busy_timeout - ждать блокировку вместо ошибки,
+    а кэш соединения переиспользует подготовленные запросы.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(
+        DB_FILE, timeout=DB_BUSY_TIMEOUT_MS / 1000, cached_statements=DB_CACHED_STATEMENTS
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+@contextlib.contextmanager
+def _transaction(immediate: bool = False):
+    """Транзакция на соединении потока: commit при выходе, rollback при исключении."""
+    conn = get_connection()
+    if immediate:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def close_connection():
+    """Закрывает соединение текущего потока."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.conn = None
+        conn.close()
+
+
+async def run_db(func, *args, **kwargs):
+    """
+    Выполняет синхронную функцию этого модуля на отдельном пуле потоков БД,
+    чтобы запросы не блокировали event loop бота.
+    """
+    global _db_executor
+    with _db_executor_lock:
+        if _db_executor is None:
+            _db_executor = ThreadPoolExecutor(max_workers=max(1, DB_EXECUTOR_WORKERS), thread_name_prefix="db")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(func, *args, **kwargs))
+
 def initialize_database():
     """Инициализирует базу данных и создает таблицу, если она не существует."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute(f"""
             CREATE TABLE IF NOT EXISTS users (
@@ -64,6 +136,13 @@ def initialize_database():
             conn.commit()
             print("Database schema updated: added 'has_subscribed_for_reward' column to 'users' table.")
 
+        # Пользователи, заблокировавшие бота: рассылки их пропускают
+        try:
+            cursor.execute("SELECT is_blocked FROM users LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE users ADD COLUMN is_blocked BOOLEAN NOT NULL DEFAULT 0")
+            conn.commit()
+            print("Database schema updated: added 'is_blocked' column to 'users' table.")
 
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS processing_queue (
@@ -80,100 +159,572 @@ def initialize_database():
             cursor.execute("ALTER TABLE processing_queue ADD COLUMN user_id INTEGER")
             conn.commit()
             print("Database schema updated: added 'user_id' column to 'processing_queue' table.")
+
+        # Durable queue: state, lease and checkpoint columns
+        for column, definition in (
+            ('status', "TEXT NOT NULL DEFAULT 'queued'"),
+            ('lease_owner', "TEXT"),
+            ('lease_expires_at', "REAL"),
+            ('attempts', "INTEGER NOT NULL DEFAULT 0"),
+            ('checkpoint', "TEXT"),
+            ('error', "TEXT"),
+            ('created_at', "REAL"),
+            ('updated_at', "REAL"),
+        ):
+            try:
+                cursor.execute(f"SELECT {column} FROM processing_queue LIMIT 1")
+            except sqlite3.OperationalError:
+                cursor.execute(f"ALTER TABLE processing_queue ADD COLUMN {column} {definition}")
+                conn.commit()
+                print(f"Database schema updated: added '{column}' column to 'processing_queue' table.")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_processing_queue_status ON processing_queue (status, id)")
+
+        # Исходящие события воркеров (статусы, клипы, итог) для Telegram-процесса
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS task_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                delivered_at REAL
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_events_pending ON task_events (delivered_at, id)")
+        # Клип, к которому относится событие: отправленным он считается только после доставки
+        try:
+            cursor.execute("SELECT clip_id FROM task_events LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE task_events ADD COLUMN clip_id TEXT")
+            conn.commit()
+            print("Database schema updated: added 'clip_id' column to 'task_events' table.")
+        # Сколько раз доставка события падала на временной ошибке Telegram
+        try:
+            cursor.execute("SELECT attempts FROM task_events LIMIT 1")
+        except sqlite3.OperationalError:
+            cursor.execute("ALTER TABLE task_events ADD COLUMN attempts INTEGER DEFAULT 0")
+            conn.commit()
+            print("Database schema updated: added 'attempts' column to 'task_events' table.")
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS task_clip_progress (
+                task_id INTEGER NOT NULL,
+                clip_id TEXT NOT NULL,
+                sent_at REAL NOT NULL,
+                PRIMARY KEY (task_id, clip_id)
+            )
+        """)
+
+        # Рассылки и их получатели: прогресс переживает рестарт бота
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                admin_chat_id INTEGER NOT NULL,
+                label TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'running',
+                created_at REAL NOT NULL,
+                finished_at REAL
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                broadcast_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                PRIMARY KEY (broadcast_id, user_id)
+            )
+        """)
+
+        # Версия набора активных задач: растёт при каждом добавлении/завершении (см. QueueIndex)
+        cursor.execute("CREATE TABLE IF NOT EXISTS queue_state (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)")
+        cursor.execute("INSERT OR IGNORE INTO queue_state (id, version) VALUES (1, 0)")
         conn.commit()
 
 
+# Статусы задач в processing_queue
+TASK_QUEUED = 'queued'
+TASK_LEASED = 'leased'
+TASK_DONE = 'done'
+TASK_FAILED = 'failed'
+ACTIVE_TASK_STATUSES = (TASK_QUEUED, TASK_LEASED)
+
+
+def _bump_queue_version(conn) -> int:
+    """Отмечает изменение набора активных задач; вызывается в транзакции, которая его меняет."""
+    conn.execute("UPDATE queue_state SET version = version + 1 WHERE id = 1")
+    return conn.execute("SELECT version FROM queue_state WHERE id = 1").fetchone()[0]
+
+
+class QueueIndex:
+    """
+    Активные задачи очереди в памяти процесса: отсортированные id ожидающих задач, взятые
+    в работу задачи и задачи по пользователям.
+    Позиция задачи, длина очереди и задачи пользователя берутся отсюда, а не COUNT(*) по таблице.
+    Перед чтением индекс сверяет queue_state.version (один запрос по первичному ключу) и
+    перечитывает активные задачи, только если очередь изменил другой процесс или поток.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._ids = []         # отсортированные id задач, ожидающих воркера
+        self._leased = set()   # id задач, которые сейчас обрабатываются
+        self._tasks = {}       # id -> (user_id, user_data)
+        self._by_user = {}     # user_id -> [id, ...] по возрастанию
+
+    def _add(self, task_id: int, user_id: int, user_data: str, status: str = TASK_QUEUED):
+        if task_id in self._tasks:
+            return
+        self._tasks[task_id] = (user_id, user_data)
+        if status == TASK_LEASED:
+            self._leased.add(task_id)
+        else:
+            bisect.insort(self._ids, task_id)
+        bisect.insort(self._by_user.setdefault(user_id, []), task_id)
+
+    def _unqueue(self, task_id: int):
+        index = bisect.bisect_left(self._ids, task_id)
+        if index < len(self._ids) and self._ids[index] == task_id:
+            self._ids.pop(index)
+
+    def _lease(self, task_id: int):
+        if task_id in self._tasks:
+            self._unqueue(task_id)
+            self._leased.add(task_id)
+
+    def _remove(self, task_id: int):
+        task = self._tasks.pop(task_id, None)
+        if task is None:
+            return
+        self._unqueue(task_id)
+        self._leased.discard(task_id)
+        user_ids = self._by_user[task[0]]
+        user_ids.remove(task_id)
+        if not user_ids:
+            del self._by_user[task[0]]
+
+    def _sync(self):
+        with _transaction() as conn:
+            version = conn.execute("SELECT version FROM queue_state WHERE id = 1").fetchone()[0]
+            if version == self._version:
+                return
+            rows = conn.execute(
+                "SELECT id, user_id, user_data, status FROM processing_queue WHERE status IN (?, ?) ORDER BY id",
+                ACTIVE_TASK_STATUSES
+            ).fetchall()
+        self._ids, self._leased, self._tasks, self._by_user = [], set(), {}, {}
+        for task_id, user_id, user_data, status in rows:
+            self._add(task_id, user_id, user_data, status)
+        self._version = version
+
+    def apply(self, version: int, added: Optional[tuple] = None, removed: Optional[int] = None,
+              leased: Optional[int] = None):
+        """Применяет собственное изменение этого процесса без перечитывания, если других изменений не было."""
+        with self._lock:
+            if self._version is None or version != self._version + 1:
+                return
+            if added is not None:
+                self._add(*added)
+            if leased is not None:
+                self._lease(leased)
+            if removed is not None:
+                self._remove(removed)
+            self._version = version
+
+    def position(self, task_id: int) -> int:
+        """
+        Место задачи среди ожидающих: 1 + число ожидающих задач перед ней.
+        0 - задача уже обрабатывается. Лёгкие задачи могут обогнать тяжёлые,
+        так что это оценка, но уже взятые в работу задачи она не считает.
+        """
+        with self._lock:
+            self._sync()
+            if task_id in self._leased:
+                return 0
+            return bisect.bisect_left(self._ids, task_id) + 1
+
+    def length(self) -> int:
+        """Сколько задач ждут воркера."""
+        with self._lock:
+            self._sync()
+            return len(self._ids)
+
+    def user_tasks(self, user_id: int) -> list:
+        with self._lock:
+            self._sync()
+            return [(task_id, self._tasks[task_id][1]) for task_id in self._by_user.get(user_id, [])]
+
+
+_queue_index = QueueIndex()
+
+
 def add_task_to_queue(user_id: int, chat_id: int, user_data: str, status_message_id: int) -> int:
     """Добавляет задачу в очередь обработки и возвращает ее ID."""
-    with sqlite3.connect(DB_FILE) as conn:
+    now = time.time()
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO processing_queue (user_id, chat_id, user_data, status_message_id) VALUES (?, ?, ?, ?)",
-            (user_id, chat_id, user_data, status_message_id)
+            "INSERT INTO processing_queue (user_id, chat_id, user_data, status_message_id, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, chat_id, user_data, status_message_id, TASK_QUEUED, now, now)
         )
-        conn.commit()
-        return cursor.lastrowid
+        task_id = cursor.lastrowid
+        version = _bump_queue_version(conn)
+    _queue_index.apply(version, added=(task_id, user_id, user_data))
+    return task_id
 
 
 def get_queue_position(task_id: int) -> int:
-    """Возвращает позицию задачи в очереди."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT COUNT(*) FROM processing_queue WHERE id <= ?",
-        (task_id,)
-    )
-    position = cursor.fetchone()[0]
-    conn.close()
-    return position
+    """Возвращает позицию задачи среди ожидающих; 0 - задача уже обрабатывается."""
+    return _queue_index.position(task_id)
 
 
 def get_total_queue_length() -> int:
-    """Возвращает общее количество задач в очереди."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(*) FROM processing_queue")
-    count = cursor.fetchone()[0]
-    conn.close()
-    return count
+    """Возвращает количество задач, ожидающих воркера."""
+    return _queue_index.length()
 
 def get_pending_tasks() -> list:
     """Возвращает все невыполненные задачи из очереди."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT id, user_id, chat_id, user_data, status_message_id FROM processing_queue")
+        cursor.execute(
+            "SELECT id, user_id, chat_id, user_data, status_message_id FROM processing_queue "
+            "WHERE status IN (?, ?) ORDER BY id", ACTIVE_TASK_STATUSES
+        )
         return cursor.fetchall()
 
 def get_user_tasks_from_queue(user_id: int) -> list:
     """Возвращает все задачи пользователя из очереди."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, user_data FROM processing_queue WHERE user_id = ? ORDER BY id", (user_id,))
-        return cursor.fetchall()
+    return _queue_index.user_tasks(user_id)
 
 def remove_task_from_queue(task_id: int):
     """Удаляет задачу из очереди по ее ID."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM processing_queue WHERE id = ?", (task_id,))
+        removed = cursor.rowcount
+        cursor.execute("DELETE FROM task_clip_progress WHERE task_id = ?", (task_id,))
+        version = _bump_queue_version(conn) if removed else None
+    if version is not None:
+        _queue_index.apply(version, removed=task_id)
+
+
+def lease_next_task(worker_id: str, lease_seconds: float = TASK_LEASE_SECONDS, accept=None, scan_limit: int = 50):
+    """
+    Атомарно берёт следующую задачу: новую или ту, чья аренда истекла (воркер упал).
+    Задачи, исчерпавшие TASK_MAX_ATTEMPTS, помечаются failed.
+    accept(user_data: dict, queued_for: float) -> bool позволяет планировщику пропустить
+    задачи, которые сейчас не помещаются по ресурсам (смотрятся первые scan_limit в порядке очереди).
+    Возвращает (id, user_id, chat_id, user_data, status_message_id) или None.
+    """
+    now = time.time()
+    version = None
+    with _transaction(immediate=True) as conn:
+        expired = conn.execute(
+            "UPDATE processing_queue SET status = ?, error = 'lease expired too many times', updated_at = ? "
+            "WHERE status = ? AND lease_expires_at < ? AND attempts >= ?",
+            (TASK_FAILED, now, TASK_LEASED, now, TASK_MAX_ATTEMPTS)
+        ).rowcount
+        candidates = conn.execute(
+            "SELECT id, user_id, chat_id, user_data, status_message_id, created_at FROM processing_queue "
+            "WHERE status = ? OR (status = ? AND lease_expires_at < ?) ORDER BY id LIMIT ?",
+            (TASK_QUEUED, TASK_LEASED, now, 1 if accept is None else scan_limit)
+        ).fetchall()
+        row = None
+        for candidate in candidates:
+            if accept is None or accept(json.loads(candidate[3]), now - (candidate[5] or now)):
+                row = candidate[:5]
+                break
+        if row is not None:
+            conn.execute(
+                "UPDATE processing_queue SET status = ?, lease_owner = ?, lease_expires_at = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (TASK_LEASED, worker_id, now + lease_seconds, now, row[0])
+            )
+        if expired or row is not None:
+            # Индексы очередей видят, что задача ушла в работу (или упала по истечении аренды)
+            version = _bump_queue_version(conn)
+    if row is not None and not expired:
+        _queue_index.apply(version, leased=row[0])
+    return row
+
+
+def heartbeat_task(task_id: int, worker_id: str, lease_seconds: float = TASK_LEASE_SECONDS) -> bool:
+    """Продлевает аренду задачи. False - аренда потеряна (истекла и задачу забрал другой воркер)."""
+    now = time.time()
+    with _transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE processing_queue SET lease_expires_at = ?, updated_at = ? "
+            "WHERE id = ? AND status = ? AND lease_owner = ?",
+            (now + lease_seconds, now, task_id, TASK_LEASED, worker_id)
+        )
+        return cursor.rowcount == 1
+
+
+def complete_task(task_id: int, worker_id: Optional[str] = None):
+    """Помечает задачу выполненной; прогресс по клипам больше не нужен."""
+    _finish_task(task_id, TASK_DONE, worker_id)
+
+
+def fail_task(task_id: int, error: str, worker_id: Optional[str] = None):
+    """Помечает задачу упавшей, чтобы она не запускалась повторно."""
+    _finish_task(task_id, TASK_FAILED, worker_id, error)
+
+
+def _finish_task(task_id: int, status: str, worker_id: Optional[str], error: Optional[str] = None):
+    with _transaction() as conn:
+        query = "UPDATE processing_queue SET status = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL, updated_at = ? WHERE id = ?"
+        params = [status, error, time.time(), task_id]
+        if worker_id is not None:
+            query += " AND lease_owner = ?"
+            params.append(worker_id)
+        version = None
+        if conn.execute(query, params).rowcount:
+            conn.execute("DELETE FROM task_clip_progress WHERE task_id = ?", (task_id,))
+            version = _bump_queue_version(conn)
+    if version is not None:
+        _queue_index.apply(version, removed=task_id)
+
+
+def purge_finished_tasks(older_than_seconds: float):
+    """Удаляет завершённые и упавшие задачи старше указанного возраста."""
+    with _transaction() as conn:
+        conn.execute(
+            "DELETE FROM processing_queue WHERE status IN (?, ?) AND updated_at < ?",
+            (TASK_DONE, TASK_FAILED, time.time() - older_than_seconds)
+        )
+        conn.execute(
+            "DELETE FROM task_events WHERE delivered_at IS NOT NULL AND delivered_at < ?",
+            (time.time() - older_than_seconds,)
+        )
         conn.commit()
 
 
+def add_task_event(task_id: int, chat_id: int, kind: str, payload: dict, clip_id: Optional[str] = None) -> int:
+    """
+    Кладёт событие воркера в outbox. Клип (clip_id) отмечается отправленным только после
+    доставки (mark_task_clip_sent); пока событие ждёт доставки, TaskCheckpoint его не перерендерит.
+    """
+    with _transaction() as conn:
+        cursor = conn.execute(
+            "INSERT INTO task_events (task_id, chat_id, kind, payload, created_at, clip_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (task_id, chat_id, kind, json.dumps(payload, ensure_ascii=False), time.time(), clip_id)
+        )
+        return cursor.lastrowid
+
+
+def mark_task_clip_sent(task_id: int, clip_id: str):
+    """Отмечает клип доставленным, пока задача ещё активна (у завершённой прогресс уже удалён)."""
+    with _transaction() as conn:
+        conn.execute(
+            "INSERT OR IGNORE INTO task_clip_progress (task_id, clip_id, sent_at) "
+            "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM processing_queue WHERE id = ? AND status IN (?, ?))",
+            (task_id, clip_id, time.time(), task_id) + ACTIVE_TASK_STATUSES
+        )
+
+
+def get_pending_task_events(limit: int = 100, exclude_task_ids=()) -> list:
+    """
+    Возвращает недоставленные события в порядке появления: (id, task_id, chat_id, kind, payload, attempts).
+    События задач из exclude_task_ids (их уже доставляют) пропускаются.
+    """
+    exclude_task_ids = list(exclude_task_ids)
+    query = "SELECT id, task_id, chat_id, kind, payload, attempts FROM task_events WHERE delivered_at IS NULL"
+    if exclude_task_ids:
+        query += f" AND task_id NOT IN ({', '.join('?' * len(exclude_task_ids))})"
+    query += " ORDER BY id LIMIT ?"
+    with _transaction() as conn:
+        rows = conn.execute(query, exclude_task_ids + [limit]).fetchall()
+    return [
+        (event_id, task_id, chat_id, kind, json.loads(payload), attempts or 0)
+        for event_id, task_id, chat_id, kind, payload, attempts in rows
+    ]
+
+
+def mark_task_event_delivered(event_id: int):
+    with _transaction() as conn:
+        conn.execute("UPDATE task_events SET delivered_at = ? WHERE id = ?", (time.time(), event_id))
+        conn.commit()
+
+
+def record_task_event_failure(event_id: int):
+    """Засчитывает неудачную попытку доставки; событие остаётся в очереди на повтор."""
+    with _transaction() as conn:
+        conn.execute("UPDATE task_events SET attempts = COALESCE(attempts, 0) + 1 WHERE id = ?", (event_id,))
+
+
+def charge_task_once(task_id: int, user_id: int) -> bool:
+    """
+    Списывает одну генерацию за задачу, если за неё ещё не списывали (флаг charged в checkpoint).
+    Флаг и баланс меняются в одной транзакции. Возвращает True, если списание произошло сейчас.
+    """
+    with _transaction(immediate=True) as conn:
+        charged = conn.execute(
+            "UPDATE processing_queue SET checkpoint = json_set(COALESCE(checkpoint, '{}'), '$.charged', json('true')) "
+            "WHERE id = ? AND COALESCE(json_extract(checkpoint, '$.charged'), 0) = 0",
+            (task_id,)
+        ).rowcount
+        if charged:
+            conn.execute(
+                "UPDATE users SET balance = balance - 1, generated_count = generated_count + 1 WHERE user_id = ?",
+                (user_id,)
+            )
+    if charged:
+        invalidate_user_cache(user_id)
+    return bool(charged)
+
+
+def is_task_charged(task_id: int) -> bool:
+    with _transaction() as conn:
+        row = conn.execute(
+            "SELECT COALESCE(json_extract(checkpoint, '$.charged'), 0) FROM processing_queue WHERE id = ?",
+            (task_id,)
+        ).fetchone()
+    return bool(row and row[0])
+
+
+class TaskCheckpoint:
+    """
+    Прогресс задачи, переживающий рестарт: выбранные таймкоды и уже отправленные клипы.
+    Задача, снова взятая из очереди, продолжает с первого неотправленного клипа.
+    cancelled выставляется при потере аренды: обработка останавливается до следующего клипа.
+    """
+
+    def __init__(self, task_id: int, cancelled: Optional[threading.Event] = None):
+        self.task_id = task_id
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+        with _transaction() as conn:
+            row = conn.execute("SELECT checkpoint FROM processing_queue WHERE id = ?", (task_id,)).fetchone()
+            sent_rows = conn.execute("SELECT clip_id FROM task_clip_progress WHERE task_id = ?", (task_id,)).fetchall()
+            # Клипы, уже лежащие в outbox, будут доставлены - повторно их не рендерим
+            sent_rows += conn.execute(
+                "SELECT clip_id FROM task_events WHERE task_id = ? AND clip_id IS NOT NULL AND delivered_at IS NULL",
+                (task_id,)
+            ).fetchall()
+        data = json.loads(row[0]) if row and row[0] else {}
+        self.shorts_timecodes = data.get('shorts_timecodes')
+        self.charged = data.get('charged', False)
+        self._sent = {clip_id for (clip_id,) in sent_rows}
+
+    @staticmethod
+    def clip_id(start, end) -> str:
+        return f"{start}|{end}"
+
+    def _save(self, key: str, value):
+        # Меняем только своё поле: флаг charged может выставить Telegram-процесс (charge_task_once)
+        with _transaction() as conn:
+            conn.execute(
+                "UPDATE processing_queue SET checkpoint = json_set(COALESCE(checkpoint, '{}'), ?, json(?)), "
+                "updated_at = ? WHERE id = ?",
+                (f"$.{key}", json.dumps(value, ensure_ascii=False), time.time(), self.task_id)
+            )
+            conn.commit()
+
+    def save_timecodes(self, shorts_timecodes: list):
+        self.shorts_timecodes = shorts_timecodes
+        self._save('shorts_timecodes', shorts_timecodes)
+
+    def mark_charged(self):
+        self.charged = True
+        self._save('charged', True)
+
+    def is_sent(self, short_info: dict) -> bool:
+        return self.clip_id(short_info['start'], short_info['end']) in self._sent
+
+    def mark_sent(self, start, end):
+        clip_id = self.clip_id(start, end)
+        mark_task_clip_sent(self.task_id, clip_id)
+        self._sent.add(clip_id)
+
+
+# Кэш профилей: user_id -> (expires_at, profile). Версия растёт при каждой записи,
+# чтобы чтение, начатое до записи, не положило в кэш устаревший профиль.
+_user_cache = OrderedDict()
+_user_cache_lock = threading.Lock()
+_user_cache_version = 0
+
+
+def invalidate_user_cache(user_id: Optional[int] = None):
+    """Сбрасывает кэш профиля пользователя (или весь кэш, если user_id не указан)."""
+    global _user_cache_version
+    with _user_cache_lock:
+        _user_cache_version += 1
+        if user_id is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(user_id, None)
+
+
+def _get_user_profile(user_id: int) -> Optional[dict]:
+    """Профиль пользователя из кэша или из БД; None, если пользователя нет."""
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        if entry is not None:
+            expires_at, profile = entry
+            if expires_at >= time.monotonic():
+                _user_cache.move_to_end(user_id)
+                return profile
+            del _user_cache[user_id]
+        version = _user_cache_version
+
+    with _transaction() as conn:
+        row = conn.execute(
+            "SELECT user_id, balance, generated_count, language, referred_by, has_referral_discount, has_subscribed_for_reward, "
+            "is_blocked FROM users WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    profile = {
+        'user_id': row[0], 'balance': row[1], 'generated_count': row[2], 'language': row[3],
+        'referred_by': row[4], 'has_referral_discount': row[5] == 1, 'has_subscribed_for_reward': row[6] == 1,
+        'is_blocked': row[7] == 1,
+    }
+    with _user_cache_lock:
+        if version == _user_cache_version:
+            _user_cache[user_id] = (time.monotonic() + USER_CACHE_TTL, profile)
+            while len(_user_cache) > USER_CACHE_SIZE:
+                _user_cache.popitem(last=False)
+    return profile
+
+
 def get_user(user_id: int, referrer_id: Optional[int] = None, source: Optional[str] = None) -> Optional[Tuple[int, int, int, str, bool]]:
     """
-    Получает данные пользователя по user_id.
+    Получает данные пользователя по user_id (через кэш профилей).
     Если пользователь не найден, создает его с балансом по умолчанию.
     Возвращает кортеж (user_id, balance, generated_count, language, is_new).
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    profile = _get_user_profile(user_id)
+    if profile is not None:
+        return profile['user_id'], profile['balance'], profile['generated_count'], profile['language'], False
+    with _transaction() as conn:
         cursor = conn.cursor()
-        cursor.execute("SELECT user_id, balance, generated_count, language FROM users WHERE user_id = ?", (user_id,))
-        user = cursor.fetchone()
-        if user is None:
-            # Пользователь не найден, создаем нового
-            cursor.execute("INSERT INTO users (user_id, balance, referred_by, source, language) VALUES (?, ?, ?, ?, ?)", (user_id, START_BALANCE, referrer_id, source, 'ru'))
-            conn.commit()
-            # Возвращаем данные нового пользователя
-            return user_id, START_BALANCE, 0, 'ru', True
-        return user + (False,)
+        # Пользователь не найден, создаем нового
+        cursor.execute("INSERT INTO users (user_id, balance, referred_by, source, language) VALUES (?, ?, ?, ?, ?)", (user_id, START_BALANCE, referrer_id, source, 'ru'))
+        conn.commit()
+    invalidate_user_cache(user_id)
+    # Возвращаем данные нового пользователя
+    return user_id, START_BALANCE, 0, 'ru', True
 
 def set_user_language(user_id: int, language_code: str):
     """
     Устанавливает язык для пользователя.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET language = ? WHERE user_id = ?",
             (language_code, user_id)
         )
         conn.commit()
+    invalidate_user_cache(user_id)
 
 def deduct_generation_from_balance(user_id: int):
     """
     Обновляет баланс пользователя и количество сгенерированных видео.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         # Уменьшаем баланс и увеличиваем счетчик
         cursor.execute(
@@ -181,48 +732,52 @@ def deduct_generation_from_balance(user_id: int):
             (user_id,)
         )
         conn.commit()
+    invalidate_user_cache(user_id)
 
 def add_to_user_balance(user_id: int, amount: int):
     """
     Добавляет указанное количество к балансу пользователя.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET balance = balance + ? WHERE user_id = ?",
             (amount, user_id)
         )
         conn.commit()
+    invalidate_user_cache(user_id)
 
 def set_user_balance(user_id: int, amount: int):
     """
     Устанавливает баланс пользователя в указанное значение.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET balance = ? WHERE user_id = ?",
             (amount, user_id)
         )
         conn.commit()
+    invalidate_user_cache(user_id)
 
 def get_all_user_ids():
     """Возвращает список всех user_id в базе данных."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT user_id FROM users")
         return [row[0] for row in cursor.fetchall()]
 
 def delete_user(user_id: int):
     """Удаляет пользователя из базы данных."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
         conn.commit()
+    invalidate_user_cache(user_id)
 
 def get_all_users_data():
     """Возвращает все данные из таблицы users."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT user_id, balance, generated_count, referred_by, source, language FROM users")
         return cursor.fetchall()
@@ -231,55 +786,157 @@ def get_all_users_data():
 
 def set_referral_discount(user_id: int, status: bool):
     """Sets the referral discount status for a user."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET has_referral_discount = ? WHERE user_id = ?",
             (status, user_id)
         )
         conn.commit()
+    invalidate_user_cache(user_id)
 
 def has_referral_discount(user_id: int) -> bool:
     """Checks if a user has a referral discount."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT has_referral_discount FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-        return result[0] == 1 if result else False
+    profile = _get_user_profile(user_id)
+    return profile['has_referral_discount'] if profile else False
 
 def get_user_referrer(user_id: int) -> Optional[int]:
     """Gets the referrer of a user."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT referred_by FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-        return result[0] if result and result[0] else None
+    profile = _get_user_profile(user_id)
+    return profile['referred_by'] if profile and profile['referred_by'] else None
 
 def set_has_subscribed_for_reward(user_id: int, status: bool):
     """Sets the subscription reward status for a user."""
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute(
             "UPDATE users SET has_subscribed_for_reward = ? WHERE user_id = ?",
             (status, user_id)
         )
         conn.commit()
+    invalidate_user_cache(user_id)
 
 def get_has_subscribed_for_reward(user_id: int) -> bool:
     """Checks if a user has already received the subscription reward."""
-    with sqlite3.connect(DB_FILE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT has_subscribed_for_reward FROM users WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-        return result[0] == 1 if result else False
+    profile = _get_user_profile(user_id)
+    return profile['has_subscribed_for_reward'] if profile else False
+
+# Статусы рассылок и их получателей
+BROADCAST_RUNNING = 'running'
+BROADCAST_DONE = 'done'
+RECIPIENT_PENDING = 'pending'
+RECIPIENT_SENT = 'sent'
+RECIPIENT_FAILED = 'failed'
+RECIPIENT_BLOCKED = 'blocked'
+
+
+def create_broadcast(admin_chat_id: int, label: str, payload: dict, user_ids: Optional[list] = None) -> int:
+    """
+    Создаёт рассылку и список её получателей. Без user_ids - все пользователи,
+    кроме заблокировавших бота. Возвращает ID рассылки.
+    """
+    with _transaction() as conn:
+        broadcast_id = conn.execute(
+            "INSERT INTO broadcasts (admin_chat_id, label, payload, status, created_at) VALUES (?, ?, ?, ?, ?)",
+            (admin_chat_id, label, json.dumps(payload, ensure_ascii=False), BROADCAST_RUNNING, time.time())
+        ).lastrowid
+        if user_ids is None:
+            conn.execute(
+                "INSERT INTO broadcast_recipients (broadcast_id, user_id, status) "
+                "SELECT ?, user_id, ? FROM users WHERE is_blocked = 0",
+                (broadcast_id, RECIPIENT_PENDING)
+            )
+        else:
+            conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id, status) VALUES (?, ?, ?)",
+                [(broadcast_id, user_id, RECIPIENT_PENDING) for user_id in user_ids]
+            )
+        return broadcast_id
+
+
+def get_broadcast(broadcast_id: int) -> Optional[Tuple[int, str, dict, str]]:
+    """Возвращает (admin_chat_id, label, payload, status) или None."""
+    with _transaction() as conn:
+        row = conn.execute(
+            "SELECT admin_chat_id, label, payload, status FROM broadcasts WHERE id = ?", (broadcast_id,)
+        ).fetchone()
+    if row is None:
+        return None
+    return row[0], row[1], json.loads(row[2]), row[3]
+
+
+def get_running_broadcast_ids() -> list:
+    """ID рассылок, прерванных рестартом."""
+    with _transaction() as conn:
+        rows = conn.execute("SELECT id FROM broadcasts WHERE status = ? ORDER BY id", (BROADCAST_RUNNING,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def get_pending_broadcast_recipients(broadcast_id: int) -> list:
+    """user_id получателей, которым сообщение ещё не отправлено."""
+    with _transaction() as conn:
+        rows = conn.execute(
+            "SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = ? ORDER BY user_id",
+            (broadcast_id, RECIPIENT_PENDING)
+        ).fetchall()
+    return [row[0] for row in rows]
+
+
+def record_broadcast_results(broadcast_id: int, results: list):
+    """
+    Сохраняет пачку результатов [(user_id, status), ...] одной транзакцией;
+    заблокировавшие бота пользователи помечаются в users одним executemany.
+    """
+    if not results:
+        return
+    with _transaction() as conn:
+        conn.executemany(
+            "UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND user_id = ?",
+            [(status, broadcast_id, user_id) for user_id, status in results]
+        )
+        blocked = [(user_id,) for user_id, status in results if status == RECIPIENT_BLOCKED]
+        if blocked:
+            conn.executemany("UPDATE users SET is_blocked = 1 WHERE user_id = ?", blocked)
+    for (user_id,) in blocked:
+        invalidate_user_cache(user_id)
+
+
+def get_broadcast_stats(broadcast_id: int) -> dict:
+    """Количество получателей рассылки по статусам."""
+    with _transaction() as conn:
+        rows = conn.execute(
+            "SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status",
+            (broadcast_id,)
+        ).fetchall()
+    return dict(rows)
+
+
+def finish_broadcast(broadcast_id: int):
+    with _transaction() as conn:
+        conn.execute(
+            "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?",
+            (BROADCAST_DONE, time.time(), broadcast_id)
+        )
+
+
+def unmark_user_blocked(user_id: int):
+    """Пользователь снова написал боту - рассылки опять до него доходят."""
+    profile = _get_user_profile(user_id)
+    if profile is None or not profile['is_blocked']:
+        return
+    with _transaction() as conn:
+        conn.execute("UPDATE users SET is_blocked = 0 WHERE user_id = ?", (user_id,))
+    invalidate_user_cache(user_id)
+
 
 def clear_database():
     """
     Удаляет все записи из таблицы users.
     """
-    with sqlite3.connect(DB_FILE) as conn:
+    with _transaction() as conn:
         cursor = conn.cursor()
         cursor.execute("DELETE FROM processing_queue")
+        _bump_queue_version(conn)
         conn.commit()
 
 # Убедимся, что база данных инициализируется при запуске
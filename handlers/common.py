@@ -1,7 +1,7 @@
 import logging
 from telegram import Update
 from telegram.ext import ContextTypes
-from database import get_user
+from database import run_db, get_user
 from analytics import log_event
 from localization import get_translation
 from states import GET_URL
@@ -13,7 +13,7 @@ async def cancel_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     generation_id = context.user_data.get('generation_id')
     log_event(query.from_user.id, 'config_cancelled', {'generation_id': generation_id})
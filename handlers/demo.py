@@ -5,7 +5,7 @@ import json
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from telegram.error import BadRequest
-from database import get_user
+from database import run_db, get_user
 from pricing import DEMO_CONFIG
 from analytics import log_event
 from states import CONFIRM_CONFIG
@@ -20,7 +20,7 @@ async def start_demo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     context.user_data['lang'] = lang
 
     # Clear any previous config and set up demo data
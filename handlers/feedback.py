@@ -2,7 +2,7 @@ import logging
 import uuid
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from database import get_user, add_to_user_balance
+from database import run_db, get_user, add_to_user_balance
 from analytics import log_event
 from localization import get_translation
 from config import MODERATORS_GROUP_ID, MODERATORS_USER_TAGS, FEEDBACK_GROUP_ID, REWARD_FOR_FEEDBACK
@@ -18,7 +18,7 @@ async def handle_dislike_button(update: Update, context: ContextTypes.DEFAULT_TY
     message_id = query.message.message_id
     chat_id = query.message.chat.id
 
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     await query.answer(get_translation(lang, "dislike_received"))
 
@@ -57,10 +57,10 @@ async def handle_moderation_button(update: Update, context: ContextTypes.DEFAULT
     action = data[1]
     user_id = int(data[2])
 
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     if action == 'bad':
-        add_to_user_balance(user_id, 1)
+        await run_db(add_to_user_balance, user_id, 1)
         await context.bot.send_message(
             chat_id=user_id,
             text=get_translation(lang, "moderation_refund")
@@ -124,7 +124,7 @@ async def handle_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_user_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the user's text feedback and forwards it with approval buttons."""
     user_id = update.message.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     feedback_text = update.message.text
 
     if FEEDBACK_GROUP_ID:
@@ -160,10 +160,10 @@ async def handle_feedback_approval(update: Update, context: ContextTypes.DEFAULT
 
     original_message = query.message.text
     
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     if action == 'approve_feedback':
-        add_to_user_balance(user_id, REWARD_FOR_FEEDBACK)
+        await run_db(add_to_user_balance, user_id, REWARD_FOR_FEEDBACK)
         await query.edit_message_text(
             f"{original_message}\n\n---\nApproved by {admin_user.full_name} (@{admin_user.username})\n+ {REWARD_FOR_FEEDBACK} generations for user {user_id}"
         )
@@ -1,11 +1,12 @@
 import logging
+import asyncio
 import uuid
 import json
 import re
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 
-from database import get_user, get_user_tasks_from_queue, add_task_to_queue, get_total_queue_length, get_has_subscribed_for_reward, set_has_subscribed_for_reward, add_to_user_balance
+from database import run_db, get_user, get_user_tasks_from_queue, add_task_to_queue, get_queue_position, get_has_subscribed_for_reward, set_has_subscribed_for_reward, add_to_user_balance
 from analytics import log_event
 from states import (
     GET_URL, GET_SHORTS_NUMBER, GET_LAYOUT, GET_SUBTITLES_TYPE, GET_SUBTITLE_STYLE, 
@@ -28,7 +29,7 @@ async def url_entrypoint(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     # Manually set up the user's language if it's not already there
     user_id = update.effective_user.id
-    _, _, _, lang, is_new = get_user(user_id)
+    _, _, _, lang, is_new = await run_db(get_user, user_id)
     if is_new:
         # This is a fallback, as the user might not have used /start yet
         lang = 'ru' 
@@ -41,7 +42,7 @@ async def url_entrypoint(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def get_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Saves the URL and prompts for the number of shorts."""
     user_id = update.effective_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     context.user_data['lang'] = lang
 
     url_match = re.search(r'https?:\/\/(www\.)?(youtube\.com|youtu\.be|twitch\.tv)\S+', update.message.text)
@@ -65,8 +66,8 @@ async def get_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     # Send a "checking" message
     checking_message = await update.message.reply_text(get_translation(lang, "checking_video_availability"))
 
-    # Check video availability
-    is_available, message, err = check_video_availability(url, lang)
+    # Check video availability (yt-dlp, off the event loop); the duration comes from the same lookup
+    is_available, message, err, video_duration = await asyncio.to_thread(check_video_availability, url, lang)
 
     # Delete the "checking" message
     await checking_message.delete()
@@ -87,6 +88,8 @@ async def get_url(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         return GET_URL
 
     context.user_data['url'] = url
+    # Длительность нужна планировщику для оценки ресурсов задачи
+    context.user_data['video_duration'] = video_duration
     logger.info(f"User {update.effective_user.id} provided URL: {url} (platform: {platform})")
 
     keyboard = [
@@ -416,7 +419,7 @@ async def ask_for_banner(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     """Asks admin users if they want to add a banner."""
     query = update.callback_query
     user_id = query.from_user.id
-    _, balance, _, lang, _ = get_user(user_id)
+    _, balance, _, lang, _ = await run_db(get_user, user_id)
     context.user_data['lang'] = lang
 
     if str(user_id) in ADMIN_USER_IDS:
@@ -462,7 +465,7 @@ async def get_banner_choice(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, balance, _, lang, _ = get_user(user_id)
+    _, balance, _, lang, _ = await run_db(get_user, user_id)
     context.user_data['lang'] = lang
     
     choice = query.data
@@ -502,12 +505,12 @@ async def handle_check_subscription_reward(update: Update, context: ContextTypes
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     is_subscribed = await check_subscription_status(context.bot, user_id)
     if is_subscribed:
-        set_has_subscribed_for_reward(user_id, True)
-        add_to_user_balance(user_id, REWARD_FOR_SUBSCRIPTION)
+        await run_db(set_has_subscribed_for_reward, user_id, True)
+        await run_db(add_to_user_balance, user_id, REWARD_FOR_SUBSCRIPTION)
         await query.edit_message_text(get_translation(lang, "subscription_reward_granted_try_again").format(reward=REWARD_FOR_SUBSCRIPTION))
     else:
         channels_list = "\n".join([f"• {channel}" for channel in REQUIRED_CHANNELS])
@@ -528,11 +531,11 @@ async def confirm_config(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, balance, _, lang, _ = get_user(user_id)
+    _, balance, _, lang, _ = await run_db(get_user, user_id)
 
     # First, check for zero balance
     if balance <= 0:
-        if REWARD_FOR_SUBSCRIPTION > 0 and REQUIRED_CHANNELS and not get_has_subscribed_for_reward(user_id):
+        if REWARD_FOR_SUBSCRIPTION > 0 and REQUIRED_CHANNELS and not await run_db(get_has_subscribed_for_reward, user_id):
             channels_list = "\n".join([f"• {channel}" for channel in REQUIRED_CHANNELS])
             keyboard = [
                 [InlineKeyboardButton(get_translation(lang, "check_subscription_button"), callback_data='check_subscription_reward')],
@@ -555,7 +558,7 @@ async def confirm_config(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return CONFIRM_CONFIG
 
     # Then, check if the user has enough balance to queue another task
-    queued_tasks_count = len(get_user_tasks_from_queue(user_id))
+    queued_tasks_count = len(await run_db(get_user_tasks_from_queue, user_id))
     if (queued_tasks_count + 1) > balance:
         await query.edit_message_text(
             get_translation(lang, "insufficient_balance_for_queue").format(
@@ -571,25 +574,19 @@ async def confirm_config(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     serializable_user_data = json.dumps(context.user_data.copy())
 
     # Add task to the database queue
-    task_id = add_task_to_queue(
+    task_id = await run_db(
+        add_task_to_queue,
         user_id=user_id,
         chat_id=query.message.chat.id,
         status_message_id=query.message.message_id,
         user_data=serializable_user_data
     )
     
-    # Put the task into the in-memory queue for the worker
-    processing_queue = context.bot_data['processing_queue']
-    task_tuple = (task_id, user_id, query.message.chat.id, serializable_user_data, query.message.message_id)
-    await processing_queue.put(task_tuple)
+    # Wake up an idle worker; the task itself is leased from the database queue
+    context.bot_data['task_wakeup'].set()
     
-    async with context.bot_data['busy_workers_lock']:
-        busy_workers = context.bot_data['busy_workers']
-    
-    total_queue_length = get_total_queue_length()
-    
-    # Your position in the waiting line
-    queue_position = total_queue_length - busy_workers
+    # Your position in the waiting line (tasks already being processed are not counted)
+    queue_position = await run_db(get_queue_position, task_id)
 
     event_data = {
         'url': context.user_data['url'],
@@ -599,7 +596,7 @@ async def confirm_config(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     }
     log_event(user_id, 'generation_queued', event_data)
     
-    logger.info(f"Task {task_id} for user {user_id} added to the DB and in-memory queue at position {queue_position}")
+    logger.info(f"Task {task_id} for user {user_id} added to the DB queue at position {queue_position}")
 
     settings_text = format_config(context.user_data['config'], balance, lang=lang)
     url = context.user_data['url']
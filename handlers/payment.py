@@ -9,7 +9,7 @@ from datetime import datetime, timezone
 from aiocryptopay import AioCryptoPay, Networks
 
 from commands import topup_start
-from database import get_user, add_to_user_balance, get_user_referrer, has_referral_discount, set_referral_discount
+from database import run_db, get_user, add_to_user_balance, get_user_referrer, has_referral_discount, set_referral_discount
 from pricing import get_package_prices
 from analytics import log_event
 from states import GET_TOPUP_METHOD, GET_YOOKASSA_EMAIL, YOOKASSA_PAYMENT, CRYPTO_PAYMENT
@@ -26,7 +26,7 @@ async def broadcast_topup_package_selection(update: Update, context: ContextType
     await query.answer()
     
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     context.user_data['lang'] = lang
 
     package_data = query.data.split('_')
@@ -71,7 +71,7 @@ async def select_topup_package(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.answer()
     
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     package_data = query.data.split('_')
     generations = int(package_data[2])
@@ -81,7 +81,7 @@ async def select_topup_package(update: Update, context: ContextTypes.DEFAULT_TYP
     discount_end_time = context.bot_data.get('discount_end_time')
     is_discount_time = discount_active and discount_end_time and datetime.now(timezone.utc) < discount_end_time
 
-    referral_discount_active = has_referral_discount(user_id)
+    referral_discount_active = await run_db(has_referral_discount, user_id)
 
     packages = get_package_prices(discount_active=is_discount_time, referral_discount_active=referral_discount_active)
 
@@ -114,7 +114,7 @@ async def topup_yookassa(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     log_event(user_id, 'topup_method_selected', {'method': 'yookassa'})
 
     package = context.user_data.get('topup_package')
@@ -128,7 +128,7 @@ async def topup_yookassa(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def get_yookassa_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receives the user's email and creates the YooKassa payment."""
     user_id = update.effective_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     email = update.message.text
     # Basic email validation (can be expanded)
@@ -219,7 +219,7 @@ async def check_yookassa_payment(update: Update, context: ContextTypes.DEFAULT_T
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     try:
         identifier, user_id_str, amount_str = query.data.split(':')
@@ -243,13 +243,13 @@ async def check_yookassa_payment(update: Update, context: ContextTypes.DEFAULT_T
                         logger.warning(f"Could not delete message {message_id}: {e}")
                 del context.user_data['payment_not_found_messages']
 
-            add_to_user_balance(user_id_from_payload, amount)
-            if has_referral_discount(user_id_from_payload):
-                set_referral_discount(user_id_from_payload, False) # Consume the discount
-                referrer_id = get_user_referrer(user_id_from_payload)
+            await run_db(add_to_user_balance, user_id_from_payload, amount)
+            if await run_db(has_referral_discount, user_id_from_payload):
+                await run_db(set_referral_discount, user_id_from_payload, False) # Consume the discount
+                referrer_id = await run_db(get_user_referrer, user_id_from_payload)
                 if referrer_id:
-                    add_to_user_balance(referrer_id, REFERRER_REWARD)
-                    _, _, _, referrer_lang, _ = get_user(referrer_id)
+                    await run_db(add_to_user_balance, referrer_id, REFERRER_REWARD)
+                    _, _, _, referrer_lang, _ = await run_db(get_user, referrer_id)
                     try:
                         referred_user_chat = await context.bot.get_chat(user_id_from_payload)
                         await context.bot.send_message(
@@ -262,7 +262,7 @@ async def check_yookassa_payment(update: Update, context: ContextTypes.DEFAULT_T
                         )
                     except Exception as e:
                         logger.error(f"Failed to send referral reward notification to {referrer_id}: {e}")
-            _, new_balance, _, _, _ = get_user(user_id_from_payload)
+            _, new_balance, _, _, _ = await run_db(get_user, user_id_from_payload)
             log_event(user_id_from_payload, 'payment_success', {'provider': 'yookassa', 'generations_amount': amount, 'total_amount': float(payment.amount.value), 'currency': payment.amount.currency})
 
             await query.edit_message_text(
@@ -297,7 +297,7 @@ async def topup_stars(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     await query.answer()
     
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     log_event(user_id, 'topup_method_selected', {'method': 'telegram_stars'})
 
     await query.delete_message()
@@ -333,7 +333,7 @@ async def topup_crypto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     log_event(user_id, 'topup_method_selected', {'method': 'cryptobot'})
 
     package = context.user_data.get('topup_package')
@@ -372,7 +372,7 @@ async def precheckout_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     """Answers the PreCheckoutQuery."""
     query = update.pre_checkout_query
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
     if query.invoice_payload.startswith('topup-'):
         await query.answer(ok=True)
     else:
@@ -385,13 +385,13 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
     user_id = int(payload_parts[1])
     generations_amount = int(payload_parts[2])
 
-    add_to_user_balance(user_id, generations_amount)
-    if has_referral_discount(user_id):
-        set_referral_discount(user_id, False) # Consume the discount
-        referrer_id = get_user_referrer(user_id)
+    await run_db(add_to_user_balance, user_id, generations_amount)
+    if await run_db(has_referral_discount, user_id):
+        await run_db(set_referral_discount, user_id, False) # Consume the discount
+        referrer_id = await run_db(get_user_referrer, user_id)
         if referrer_id:
-            add_to_user_balance(referrer_id, REFERRER_REWARD)
-            _, _, _, referrer_lang, _ = get_user(referrer_id)
+            await run_db(add_to_user_balance, referrer_id, REFERRER_REWARD)
+            _, _, _, referrer_lang, _ = await run_db(get_user, referrer_id)
             try:
                 referred_user_chat = await context.bot.get_chat(user_id)
                 await context.bot.send_message(
@@ -404,7 +404,7 @@ async def successful_payment_callback(update: Update, context: ContextTypes.DEFA
                 )
             except Exception as e:
                 logger.error(f"Failed to send referral reward notification to {referrer_id}: {e}")
-    _, new_balance, _, lang, _ = get_user(user_id)
+    _, new_balance, _, lang, _ = await run_db(get_user, user_id)
 
     log_event(user_id, 'payment_success', {'provider': 'telegram_stars', 'generations_amount': generations_amount, 'total_amount': payment_info.total_amount, 'currency': payment_info.currency})
 
@@ -419,7 +419,7 @@ async def check_crypto_payment(update: Update, context: ContextTypes.DEFAULT_TYP
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
-    _, _, _, lang, _ = get_user(user_id)
+    _, _, _, lang, _ = await run_db(get_user, user_id)
 
     try:
         identifier, user_id_str, amount_str, invoice_id = query.data.split(':')
@@ -440,13 +440,13 @@ async def check_crypto_payment(update: Update, context: ContextTypes.DEFAULT_TYP
                             logger.warning(f"Could not delete message {message_id}: {e}")
                     del context.user_data['payment_not_found_messages']
 
-                add_to_user_balance(user_id_from_payload, amount)
-                if has_referral_discount(user_id_from_payload):
-                    set_referral_discount(user_id_from_payload, False) # Consume the discount
-                    referrer_id = get_user_referrer(user_id_from_payload)
+                await run_db(add_to_user_balance, user_id_from_payload, amount)
+                if await run_db(has_referral_discount, user_id_from_payload):
+                    await run_db(set_referral_discount, user_id_from_payload, False) # Consume the discount
+                    referrer_id = await run_db(get_user_referrer, user_id_from_payload)
                     if referrer_id:
-                        add_to_user_balance(referrer_id, REFERRER_REWARD)
-                        _, _, _, referrer_lang, _ = get_user(referrer_id)
+                        await run_db(add_to_user_balance, referrer_id, REFERRER_REWARD)
+                        _, _, _, referrer_lang, _ = await run_db(get_user, referrer_id)
                         try:
                             referred_user_chat = await context.bot.get_chat(user_id_from_payload)
                             await context.bot.send_message(
@@ -460,7 +460,7 @@ async def check_crypto_payment(update: Update, context: ContextTypes.DEFAULT_TYP
                             )
                         except Exception as e:
                             logger.error(f"Failed to send referral reward notification to {referrer_id}: {e}")
-                _, new_balance, _, _, _ = get_user(user_id_from_payload)
+                _, new_balance, _, _, _ = await run_db(get_user, user_id_from_payload)
                 log_event(user_id_from_payload, 'payment_success', {'provider': 'cryptobot', 'generations_amount': amount, 'total_amount': invoices[0].amount, 'currency': invoices[0].asset})
 
                 await query.edit_message_text(
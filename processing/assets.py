@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import atexit
+import logging
+import threading
+import subprocess
+import contextlib
+from collections import OrderedDict
+
+from moviepy.editor import VideoFileClip, ImageClip
+
+from config import ASSET_MAX_OPEN_READERS, ASSET_READER_MAX_USES, ASSET_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def _close_quietly(clip):
+    try:
+        clip.close()
+    except Exception as e:
+        logger.debug(f"Error while closing clip: {e}")
+
+
+class AssetManager:
+    """
+    Per-process cache of render assets.
+    ffmpeg engine: banners are scaled to their overlay width once into ASSET_CACHE_DIR,
+    and durations of static videos (keeper backgrounds) are probed once.
+    moviepy engine: banner images are decoded and resized once per target width. Long-lived
+    videos (keeper backgrounds, the banner video) keep their reader open between clips in an
+    LRU of ASSET_MAX_OPEN_READERS and are reopened after ASSET_READER_MAX_USES clips.
+    Per-clip readers are opened inside clip_scope() and closed when it exits.
+    """
+
+    def __init__(self, max_open_readers=ASSET_MAX_OPEN_READERS, max_uses=ASSET_READER_MAX_USES):
+        self.max_open_readers = max(1, max_open_readers)
+        self.max_uses = max(1, max_uses)
+        self._readers = OrderedDict()  # (path, audio) -> [clip, uses]
+        self._images = {}              # (path, width) -> (rgb, mask)
+        self._durations = {}           # (path, mtime) -> длительность, сек
+        self._prepared = {}            # (path, mtime, width) -> путь к уменьшенному баннеру
+        self._scope = None
+        self._lock = threading.RLock()
+
+    def shared_video(self, path, audio=False):
+        """Returns an open VideoFileClip for path that stays alive across clips."""
+        key = (str(path), audio)
+        with self._lock:
+            entry = self._readers.get(key)
+            if entry is not None and entry[1] >= self.max_uses:
+                # Ограниченное переиспользование: периодически пересоздаём ридер
+                del self._readers[key]
+                _close_quietly(entry[0])
+                entry = None
+            if entry is None:
+                entry = [VideoFileClip(str(path), audio=audio), 0]
+                self._readers[key] = entry
+                while len(self._readers) > self.max_open_readers:
+                    _, (old_clip, _) = self._readers.popitem(last=False)
+                    _close_quietly(old_clip)
+            else:
+                self._readers.move_to_end(key)
+            entry[1] += 1
+            return entry[0]
+
+    def clip_video(self, path, audio=True):
+        """Opens a VideoFileClip that is closed when the current clip_scope() exits."""
+        clip = VideoFileClip(str(path), audio=audio)
+        if self._scope is not None:
+            self._scope.append(clip)
+        return clip
+
+    def banner_image(self, path, width):
+        """Returns an ImageClip of path resized to width; decoding and resizing happen once."""
+        key = (str(path), int(width))
+        with self._lock:
+            cached = self._images.get(key)
+            if cached is None:
+                source = ImageClip(str(path)).resize(width=width)
+                mask = source.mask.get_frame(0) if source.mask is not None else None
+                cached = (source.get_frame(0), mask)
+                self._images[key] = cached
+        rgb, mask = cached
+        image = ImageClip(rgb)
+        if mask is not None:
+            image = image.set_mask(ImageClip(mask, ismask=True))
+        return image
+
+    def media_duration(self, path) -> float:
+        """Duration of a static media file; ffprobe runs once per file version."""
+        path = str(path)
+        key = (path, os.path.getmtime(path))
+        with self._lock:
+            duration = self._durations.get(key)
+        if duration is None:
+            cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json", path]
+            result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=60)
+            duration = float(json.loads(result.stdout).get("format", {}).get("duration") or 0.0)
+            with self._lock:
+                self._durations[key] = duration
+        return duration
+
+    def prepared_banner(self, path, width) -> str:
+        """
+        Returns a copy of the banner (image or video) already scaled to `width`, so ffmpeg
+        loops a small file instead of decoding and scaling the original for every frame.
+        The copy is made once and shared by all render workers; on failure the original is used.
+        """
+        path = str(path)
+        width = int(width)
+        mtime = os.path.getmtime(path)
+        key = (path, mtime, width)
+        with self._lock:
+            prepared = self._prepared.get(key)
+            if prepared is not None:
+                return prepared
+            stem, ext = os.path.splitext(os.path.basename(path))
+            prepared = os.path.join(ASSET_CACHE_DIR, f"{stem}_{width}w_{int(mtime)}{ext}")
+            if not os.path.exists(prepared):
+                # Пишем во временный файл: параллельные процессы рендера не увидят недописанный баннер
+                tmp_path = f"{prepared}.{os.getpid()}.tmp{ext}"
+                cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", path, "-vf", f"scale={width}:-2"]
+                if ext.lower() != '.png':
+                    cmd += ["-c:v", "libx264", "-preset", "medium", "-crf", "18", "-an"]
+                cmd.append(tmp_path)
+                try:
+                    os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+                    subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=300)
+                    os.replace(tmp_path, prepared)
+                except (OSError, subprocess.SubprocessError) as e:
+                    logger.warning(f"Could not prepare banner {path} at {width}px, using the original: {e}")
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    return path
+            self._prepared[key] = prepared
+            return prepared
+
+    @contextlib.contextmanager
+    def clip_scope(self):
+        """Closes every reader opened with clip_video() while rendering one clip."""
+        previous, self._scope = self._scope, []
+        try:
+            yield self
+        finally:
+            opened, self._scope = self._scope, previous
+            for clip in reversed(opened):
+                _close_quietly(clip)
+
+    def close(self):
+        """Closes all shared readers and drops cached images and probes."""
+        with self._lock:
+            while self._readers:
+                _, (clip, _) = self._readers.popitem(last=False)
+                _close_quietly(clip)
+            self._images.clear()
+            self._durations.clear()
+            self._prepared.clear()
+
+
+_asset_manager = None
+_asset_manager_lock = threading.Lock()
+
+
+def get_asset_manager() -> AssetManager:
+    """Returns the asset manager of the current (render worker) process."""
+    global _asset_manager
+    with _asset_manager_lock:
+        if _asset_manager is None:
+            _asset_manager = AssetManager()
+            atexit.register(_asset_manager.close)
+        return _asset_manager
+
+
+def close_assets():
+    """Closes every open asset of the current process."""
+    with _asset_manager_lock:
+        if _asset_manager is not None:
+            _asset_manager.close()
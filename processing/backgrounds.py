@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Library of pre-rendered brainrot backgrounds.
+
+Each keeper video from VIDEO_MAP is transcoded once per layout size into short
+keyframe-aligned chunks plus an index.json. At render time a random run of chunks
+is concatenated (concat demuxer / moviepy concatenate), so the hot path never
+decodes or resizes the full-resolution source.
+
+Prepare the library offline:
+    python -m processing.backgrounds [name ...]
+"""
+
+import os
+import sys
+import json
+import random
+import logging
+import subprocess
+from pathlib import Path
+from functools import lru_cache
+from typing import Optional, List, Dict, Any, Tuple
+
+from config import VIDEO_MAP, BACKGROUNDS_DIR, BACKGROUND_CHUNK_SECONDS
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FPS = 24
+BACKGROUND_INDEX_VERSION = 1
+
+# Размеры нижней части по лейаутам (720x1280): см. compute_layout_geometry
+BACKGROUND_SIZES = {
+    'square_top_brainrot_bottom': (720, 1280 - int(1280 * 0.6)),
+    'full_top_brainrot_bottom': (720, 1280 // 2),
+}
+
+
+def _size_dir(name: str, width: int, height: int) -> Path:
+    return Path(BACKGROUNDS_DIR) / name / f"{width}x{height}"
+
+
+def prepare_background(name: str, source_path: str, width: int, height: int,
+                       chunk_seconds: float = BACKGROUND_CHUNK_SECONDS, force: bool = False) -> Optional[Path]:
+    """
+    Scales/center-crops source_path to width x height and cuts it into chunks starting
+    on keyframes. Skips the work if an index for the same source file already exists.
+    Returns the index path.
+    """
+    out_dir = _size_dir(name, width, height)
+    index_path = out_dir / "index.json"
+    source_mtime = os.path.getmtime(source_path)
+
+    if not force and index_path.exists():
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('source_mtime') == source_mtime and index.get('version') == BACKGROUND_INDEX_VERSION:
+                logger.info(f"Background {name} {width}x{height} is up to date.")
+                return index_path
+        except (OSError, ValueError):
+            pass
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for old_chunk in out_dir.glob("chunk_*.mp4"):
+        old_chunk.unlink()
+
+    cmd = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-i", str(source_path), "-an",
+        "-vf", f"scale=-2:{height},crop='min(iw,{width})':{height},pad={width}:{height}:(ow-iw)/2:0,setsar=1,fps={OUTPUT_FPS}",
+        "-c:v", "libx264", "-preset", "medium", "-crf", "20", "-pix_fmt", "yuv420p",
+        # Ключевой кадр на границе каждого чанка, чтобы чанки склеивались без перекодирования
+        "-force_key_frames", f"expr:gte(t,n_forced*{chunk_seconds})",
+        "-f", "segment", "-segment_time", str(chunk_seconds), "-reset_timestamps", "1",
+        str(out_dir / "chunk_%05d.mp4"),
+    ]
+    logger.info(f"Preparing background {name} at {width}x{height}...")
+    subprocess.run(cmd, check=True, capture_output=True, text=True)
+
+    chunks = []
+    for chunk_path in sorted(out_dir.glob("chunk_*.mp4")):
+        duration = _probe_duration(chunk_path)
+        if duration > 0:
+            chunks.append({'file': chunk_path.name, 'duration': duration})
+
+    index = {
+        'version': BACKGROUND_INDEX_VERSION,
+        'name': name,
+        'source': str(source_path),
+        'source_mtime': source_mtime,
+        'width': width,
+        'height': height,
+        'fps': OUTPUT_FPS,
+        'chunks': chunks,
+    }
+    tmp_path = index_path.with_suffix(".json.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, index_path)
+    logger.info(f"Background {name} {width}x{height}: {len(chunks)} chunks.")
+    return index_path
+
+
+def _probe_duration(path) -> float:
+    cmd = ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "json", str(path)]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=60)
+    return float(json.loads(result.stdout).get("format", {}).get("duration") or 0.0)
+
+
+@lru_cache(maxsize=32)
+def _load_index_cached(index_path: str, mtime: float) -> Optional[Dict[str, Any]]:
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_background_index(name: Optional[str], width: int, height: int) -> Optional[Dict[str, Any]]:
+    """Returns the chunk index for a background at a given size, or None if it was not prepared."""
+    if not name:
+        return None
+    index_path = _size_dir(name, width, height) / "index.json"
+    try:
+        index = _load_index_cached(str(index_path), os.path.getmtime(index_path))
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != BACKGROUND_INDEX_VERSION or not index.get('chunks'):
+        return None
+    return index
+
+
+def pick_background_chunks(name: Optional[str], width: int, height: int, duration: float) -> Optional[List[str]]:
+    """
+    Picks a random run of consecutive chunks (wrapping around) that covers `duration`.
+    Returns chunk paths, or None if the library has no such background.
+    """
+    index = load_background_index(name, width, height)
+    if index is None:
+        return None
+    chunks = index['chunks']
+    size_dir = _size_dir(name, width, height)
+
+    i = random.randrange(len(chunks))
+    picked, covered = [], 0.0
+    while covered < duration and len(picked) < 10000:
+        chunk = chunks[i % len(chunks)]
+        picked.append(str((size_dir / chunk['file']).resolve()))
+        covered += chunk['duration']
+        i += 1
+    return picked
+
+
+def write_concat_list(chunk_paths: List[str], list_path) -> str:
+    """Writes an ffconcat list for the concat demuxer."""
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.write("ffconcat version 1.0\n")
+        for path in chunk_paths:
+            escaped = path.replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return str(list_path)
+
+
+def prepare_all(names: Optional[List[str]] = None, sizes: Optional[List[Tuple[int, int]]] = None, force: bool = False):
+    """Prepares every VIDEO_MAP background (or only `names`) at every layout size."""
+    names = names or list(VIDEO_MAP.keys())
+    sizes = sizes or sorted(set(BACKGROUND_SIZES.values()))
+    for name in names:
+        source_path = VIDEO_MAP.get(name)
+        if not source_path or not os.path.exists(source_path):
+            logger.warning(f"Background {name} not found at {source_path}, skipping.")
+            continue
+        for width, height in sizes:
+            try:
+                prepare_background(name, source_path, width, height, force=force)
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Failed to prepare background {name} {width}x{height}: {e.stderr}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = [a for a in sys.argv[1:] if a != "--force"]
+    prepare_all(args or None, force="--force" in sys.argv[1:])
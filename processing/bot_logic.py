@@ -2,8 +2,12 @@
 
 import os
 import shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from queue import Queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait
+from concurrent.futures.process import BrokenProcessPool
+from queue import Queue, Empty
+from collections import deque
 
 
 from pathlib import Path
@@ -13,19 +17,24 @@ import contextlib
 
 import subprocess
 from moviepy.editor import (
-    VideoFileClip,
-    CompositeVideoClip, ImageClip,
+    CompositeVideoClip,
     vfx, concatenate_videoclips
 )
 import json
 from faster_whisper import WhisperModel
-from processing.transcription import get_transcript_segments_and_file, get_audio_duration
-from processing.subtitles import create_ass_subtitles, get_subtitle_items
-from config import VIDEO_MAP, MAX_SHORTS_PER_VIDEO, MIN_SHORT_DURATION, MAX_SHORT_DURATION
-from .download import download_video_segment, get_video_duration, get_video_heatmap
+from processing.transcription import get_transcript_segments_and_file, get_audio_duration, get_whisper_slots, init_whisper_slots, reset_whisper_slots
+from processing.subtitles import create_ass_subtitles, get_subtitle_items, WordTimestampStore
+from config import VIDEO_MAP, MAX_SHORTS_PER_VIDEO, MIN_SHORT_DURATION, MAX_SHORT_DURATION, RENDER_ENGINE
+from config import RENDER_POOL_SIZE, RENDER_WORKERS_PER_JOB, DOWNLOAD_WORKERS, SEGMENT_BUFFER_SIZE
+from .download import download_video_segment_with_retry, get_video_duration, get_video_heatmap
 from .layouts import _build_video_canvas
+from .assets import get_asset_manager
+from .ffmpeg_render import probe_video, compute_layout_geometry, render_clip_ffmpeg, prepare_face_crop
 from .gpt import get_highlights_from_gpt, get_random_highlights
-from utils import to_seconds, format_seconds_to_hhmmss
+from .heatmap import select_heatmap_segments
+from .highlight_cache import get_cached_highlights, store_highlights, current_strategy
+from .clip_cache import clip_cache_key, get_cached_clip, store_clip
+from utils import to_seconds, format_seconds_to_hhmmss, get_video_id
 from localization import get_translation
 
 
@@ -33,6 +42,19 @@ from localization import get_translation
 logger = logging.getLogger(__name__)
 
 
+class TaskCancelled(Exception):
+    """The task's lease was lost: another worker owns it now, so this one must stop."""
+
+
+def _cancel_event(checkpoint):
+    return checkpoint.cancelled if checkpoint is not None else None
+
+
+def _raise_if_cancelled(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise TaskCancelled("Task lease lost, stopping.")
+
+
 def get_unique_output_dir(base="output"):
     n = 1
     while True:
@@ -73,65 +95,10 @@ def transcribe_audio(url: str, out_dir: Path, lang: str):
         return None, None, None
 
 
-def _refine_heatmap_segment(start, end, heatmap, min_dur):
+def get_highlights(url: str, out_dir: Path, audio_path: Path, shorts_number: any, video_duration: float):
     """
-    Refines a segment by finding the sub-segment with the highest heatmap density.
+    Returns (shorts_timecodes, source) where source is 'heatmap', 'gpt' or 'random'.
     """
-    duration = end - start
-    if duration <= min_dur:
-        # Calculate density for the whole segment
-        total_val = 0.0
-        for point in heatmap:
-             p_start = point.get('start_time', 0)
-             p_end = point.get('end_time', 0)
-             val = point.get('value', 0)
-             overlap = max(0, min(end, p_end) - max(start, p_start))
-             total_val += overlap * val
-        return start, end, (total_val / duration if duration > 0 else 0)
-    
-    resolution = 1.0
-    num_bins = int(duration / resolution)
-    bins = [0.0] * num_bins
-    
-    for point in heatmap:
-        p_start = point.get('start_time', 0)
-        p_end = point.get('end_time', 0)
-        val = point.get('value', 0)
-        
-        s_inter = max(start, p_start)
-        e_inter = min(end, p_end)
-        
-        if s_inter < e_inter:
-            b_s = int((s_inter - start) / resolution)
-            b_e = int((e_inter - start) / resolution)
-            for i in range(b_s, min(b_e + 1, num_bins)):
-                bin_start = start + i * resolution
-                bin_end = start + (i + 1) * resolution
-                ov_s = max(bin_start, s_inter)
-                ov_e = min(bin_end, e_inter)
-                if ov_s < ov_e:
-                    bins[i] += (ov_e - ov_s) * val
-
-    best_s = start
-    best_e = end
-    max_density = -1.0
-    
-    for i in range(num_bins):
-        current_sum = 0.0
-        for j in range(i, num_bins):
-            current_sum += bins[j]
-            current_dur = (j - i + 1) * resolution
-            
-            if current_dur >= min_dur:
-                density = current_sum / current_dur
-                if density > max_density:
-                    max_density = density
-                    best_s = start + i * resolution
-                    best_e = start + (j + 1) * resolution
-                    
-    return best_s, best_e, max_density
-
-def get_highlights(url: str, out_dir: Path, audio_path: Path, shorts_number: any, video_duration: float):
     print("Ищем виральные моменты...")
     # Используем get_audio_duration только если аудиофайл реально существует
     duration = video_duration if video_duration else (get_audio_duration(audio_path) if audio_path and audio_path.exists() else 0)
@@ -158,31 +125,8 @@ def get_highlights(url: str, out_dir: Path, audio_path: Path, shorts_number: any
             
             count = min(count, MAX_SHORTS_PER_VIDEO)
             
-            window_size = float(MAX_SHORT_DURATION)
-            step = 5.0
-            candidates = []
-            curr = 0.0
-            
-            while curr + window_size <= duration:
-                w_start = curr
-                w_end = curr + window_size
-                score = 0.0
-                for point in heatmap:
-                    p_start = point.get('start_time', 0)
-                    p_end = point.get('end_time', 0)
-                    val = point.get('value', 0)
-                    overlap = max(0, min(w_end, p_end) - max(w_start, p_start))
-                    score += overlap * val
-                candidates.append({'start': w_start, 'end': w_end, 'score': score})
-                curr += step
-            
-            candidates.sort(key=lambda x: x['score'], reverse=True)
-            selected = []
-            for cand in candidates:
-                if len(selected) >= count: break
-                if not any(not (cand['end'] <= s['start'] or cand['start'] >= s['end']) for s in selected):
-                    r_start, r_end, r_density = _refine_heatmap_segment(cand['start'], cand['end'], heatmap, float(MIN_SHORT_DURATION))
-                    selected.append({'start': r_start, 'end': r_end, 'score': cand['score'], 'density': r_density})
+            selected = select_heatmap_segments(
+                heatmap, duration, count, float(MIN_SHORT_DURATION), float(MAX_SHORT_DURATION))
             
             if selected:
                 for s in selected:
@@ -195,7 +139,7 @@ def get_highlights(url: str, out_dir: Path, audio_path: Path, shorts_number: any
                         "virality_score": v_score
                     })
                 print(f"Heatmap вернул {len(shorts_timecodes)} отрезков.")
-                return shorts_timecodes
+                return shorts_timecodes, 'heatmap'
     except Exception as e:
         logger.warning(f"Heatmap processing failed: {e}")
 
@@ -203,7 +147,6 @@ def get_highlights(url: str, out_dir: Path, audio_path: Path, shorts_number: any
     print("Ищем смысловые куски через GPT...")
     captions_file = out_dir / "captions.txt"
     try:
-        shorts_timecodes = get_highlights_from_gpt(out_dir / "captions.txt", duration, shorts_number=shorts_number)
         if not captions_file.exists():
             raise FileNotFoundError("Файл субтитров не найден, пропускаем GPT.")
             
@@ -211,7 +154,7 @@ def get_highlights(url: str, out_dir: Path, audio_path: Path, shorts_number: any
         if not shorts_timecodes:
             # Вызываем ошибку, чтобы перейти в блок except и использовать fallback
             raise ValueError("GPT не вернул таймкоды")
-        return shorts_timecodes
+        return shorts_timecodes, 'gpt'
     except Exception as e:
         logger.warning("Не удалось получить хайлайты от GPT (%s), переход к случайной генерации.", e)
         logger.warning(f"Не удалось получить хайлайты от GPT ({e}), переход к случайной генерации.")
@@ -221,7 +164,7 @@ def get_highlights(url: str, out_dir: Path, audio_path: Path, shorts_number: any
             shorts_timecodes_raw = get_random_highlights(shorts_number, duration)
             if not shorts_timecodes_raw:
                 print("Не удалось сгенерировать случайные отрезки.")
-                return None
+                return None, None
             
             # Конвертируем секунды в формат HH:MM:SS
             for it in shorts_timecodes_raw:
@@ -231,16 +174,16 @@ def get_highlights(url: str, out_dir: Path, audio_path: Path, shorts_number: any
                     "hook":  it["hook"],
                     "virality_score": it.get("virality_score", 5)
                 })
-            return shorts_timecodes
+            return shorts_timecodes, 'random'
         except Exception as fallback_e:
             print(f"Ошибка при генерации случайных отрезков: {fallback_e}")
             logger.error("Не удалось сгенерировать случайные отрезки в качестве фолбэка: %s", fallback_e)
-            return None
+            return None, None
 
-    return None
+    return None, None
 
-def create_clips(config, url, audio_only, shorts_to_process, transcript_segments, out_dir, send_video_callback):
-    render_futures = process_video_clips(config, url, audio_only, shorts_to_process, transcript_segments, out_dir, send_video_callback)
+def create_clips(config, url, audio_only, shorts_to_process, transcript_segments, out_dir, send_video_callback, cancelled=None):
+    render_futures = process_video_clips(config, url, audio_only, shorts_to_process, transcript_segments, out_dir, send_video_callback, cancelled)
     
     successful_sends = 0
     if render_futures:
@@ -262,32 +205,72 @@ def create_clips(config, url, audio_only, shorts_to_process, transcript_segments
 
     return successful_sends
 
-def main(url, config, status_callback=None, send_video_callback=None, deleteOutputAfterSending=False):
+def _skip_sent_clips(checkpoint, shorts_timecodes):
+    """Returns (clips still to send, number already sent before a restart)."""
+    if checkpoint is None:
+        return shorts_timecodes, 0
+    pending = [short for short in shorts_timecodes if not checkpoint.is_sent(short)]
+    already_sent = len(shorts_timecodes) - len(pending)
+    if already_sent:
+        logger.info(f"Resuming task {checkpoint.task_id}: {already_sent} clip(s) already sent, {len(pending)} left.")
+    return pending, already_sent
+
+
+def main(url, config, status_callback=None, send_video_callback=None, deleteOutputAfterSending=False, checkpoint=None):
+    """
+    checkpoint (database.TaskCheckpoint) makes the job resumable: the chosen timecodes are
+    saved once, and clips that were already sent are skipped after a restart.
+    When checkpoint.cancelled is set (the lease was lost), the job raises TaskCancelled
+    before the next clip instead of sending anything else.
+    """
     config['bottom_video_path'] = VIDEO_MAP.get(config['bottom_video'])
     lang = config.get('lang', 'ru')
     platform = config.get('platform', 'youtube')
     shorts_number = config.get('shorts_number', 'auto')
 
+    video_id = get_video_id(url)
+    config['video_id'] = video_id
+
     with temporary_directory(delete=deleteOutputAfterSending) as out_dir:
         if platform == 'twitch':
-            return main_twitch(url, config, out_dir, status_callback, send_video_callback)
+            return main_twitch(url, config, out_dir, status_callback, send_video_callback, checkpoint)
         
         # YouTube workflow
         if status_callback:
             status_callback(get_translation(lang, "analyzing_video"))
         
-        # 1. Получаем длительность (Критично для всего)
-        video_duration = get_video_duration(url)
-        if not video_duration:
-            logger.error(f"Failed to get video duration for {url}")
-            return 0, 0
-
-        # 2. Пробуем транскрибировать (Опционально: нужно для GPT и субтитров)
-        # Если не получится - вернет None, и мы просто не будем использовать GPT/субтитры
-        transcript_segments, _, audio_only = transcribe_audio(url, out_dir, lang)
-
-        # 3. Определяем хайлайты (Heatmap -> GPT -> Random)
-        shorts_timecodes = get_highlights(url, out_dir, audio_only, shorts_number, video_duration)
+        strategy = current_strategy()
+        audio_only = None
+
+        # 0. Этот ролик уже разбирали с теми же настройками - сразу к нарезке
+        cached = get_cached_highlights(video_id, shorts_number, strategy)
+        resumed_timecodes = checkpoint.shorts_timecodes if checkpoint is not None else None
+        if resumed_timecodes and not cached:
+            # Рестарт задачи: таймкоды уже выбраны и часть клипов могла уйти пользователю, транскрипт нужен для субтитров
+            logger.info(f"Task {checkpoint.task_id} resumed with saved timecodes.")
+            shorts_timecodes = resumed_timecodes
+            transcript_segments, _, audio_only = transcribe_audio(url, out_dir, lang)
+        elif cached:
+            logger.info(f"Highlight cache hit for {video_id} ({cached['source']}).")
+            shorts_timecodes = resumed_timecodes or cached['shorts_timecodes']
+            transcript_segments = cached['transcript_segments']
+        else:
+            # 1. Получаем длительность (Критично для всего)
+            video_duration = get_video_duration(url)
+            if not video_duration:
+                logger.error(f"Failed to get video duration for {url}")
+                return 0, 0
+
+            # 2. Пробуем транскрибировать (Опционально: нужно для GPT и субтитров)
+            # Если не получится - вернет None, и мы просто не будем использовать GPT/субтитры
+            transcript_segments, _, audio_only = transcribe_audio(url, out_dir, lang)
+
+            # 3. Определяем хайлайты (Heatmap -> GPT -> Random)
+            shorts_timecodes, source = get_highlights(url, out_dir, audio_only, shorts_number, video_duration)
+            # Случайные отрезки не кэшируем: следующая попытка может получить субтитры/heatmap
+            if shorts_timecodes and source != 'random':
+                store_highlights(video_id, shorts_number, strategy, source,
+                                 shorts_timecodes, transcript_segments, video_duration)
         
         if not shorts_timecodes:
             logger.error("Не удалось получить таймкоды ни одним из методов.")
@@ -296,9 +279,11 @@ def main(url, config, status_callback=None, send_video_callback=None, deleteOutp
             return 0, 0
             
         shorts_timecodes.sort(key=lambda x: x.get('virality_score', 0), reverse=True)
+        if checkpoint is not None and not resumed_timecodes:
+            checkpoint.save_timecodes(shorts_timecodes)
 
         num_to_process = len(shorts_timecodes)
-        shorts_to_process = shorts_timecodes[:num_to_process]
+        shorts_to_process, already_sent = _skip_sent_clips(checkpoint, shorts_timecodes[:num_to_process])
         extra_found = 0
 
         if status_callback:
@@ -306,7 +291,11 @@ def main(url, config, status_callback=None, send_video_callback=None, deleteOutp
         print(f"Найденные отрезки для шортсов ({len(shorts_timecodes)}):", shorts_timecodes)
 
         # 4. Создаем клипы
-        successful_sends = create_clips(config, url, audio_only, shorts_to_process, transcript_segments, out_dir, send_video_callback)
+        successful_sends = already_sent
+        if shorts_to_process:
+            _raise_if_cancelled(_cancel_event(checkpoint))
+            successful_sends += create_clips(config, url, audio_only, shorts_to_process, transcript_segments, out_dir,
+                                             send_video_callback, _cancel_event(checkpoint))
 
         if audio_only and os.path.exists(audio_only):
             try: os.remove(audio_only)
@@ -315,7 +304,7 @@ def main(url, config, status_callback=None, send_video_callback=None, deleteOutp
         return successful_sends, extra_found
 
 
-def handle_random_clips_workflow(url, config, out_dir, status_callback, send_video_callback):
+def handle_random_clips_workflow(url, config, out_dir, status_callback, send_video_callback, checkpoint=None):
     """
     A workflow for generating clips based on random timestamps.
     Used for Twitch or as a fallback for YouTube.
@@ -332,23 +321,28 @@ def handle_random_clips_workflow(url, config, out_dir, status_callback, send_vid
         return 0, 0
         
     shorts_number = config.get('shorts_number', 'auto')
+    resumed_timecodes = checkpoint.shorts_timecodes if checkpoint is not None else None
     try:
-        shorts_timecodes_raw = get_random_highlights(shorts_number, duration)
-        if not shorts_timecodes_raw:
-            raise ValueError("GPT returned no timecodes.")
-            
-        # Convert seconds to HH:MM:SS format
-        shorts_timecodes = []
-        for it in shorts_timecodes_raw:
-            shorts_timecodes.append({
-                "start": format_seconds_to_hhmmss(float(it["start"])),
-                "end":   format_seconds_to_hhmmss(float(it["end"])),
-                "hook":  it["hook"],
-                "virality_score": it.get("virality_score", 5)
-            })
-
-        # Sort by virality score
-        shorts_timecodes.sort(key=lambda x: x.get('virality_score', 0), reverse=True)
+        if resumed_timecodes:
+            # Случайные отрезки после рестарта должны быть теми же, что уже начали отправлять
+            shorts_timecodes = resumed_timecodes
+        else:
+            shorts_timecodes_raw = get_random_highlights(shorts_number, duration)
+            if not shorts_timecodes_raw:
+                raise ValueError("GPT returned no timecodes.")
+                
+            # Convert seconds to HH:MM:SS format
+            shorts_timecodes = []
+            for it in shorts_timecodes_raw:
+                shorts_timecodes.append({
+                    "start": format_seconds_to_hhmmss(float(it["start"])),
+                    "end":   format_seconds_to_hhmmss(float(it["end"])),
+                    "hook":  it["hook"],
+                    "virality_score": it.get("virality_score", 5)
+                })
+
+            # Sort by virality score
+            shorts_timecodes.sort(key=lambda x: x.get('virality_score', 0), reverse=True)
 
     except Exception as e:
         logger.error(f"Не удалось получить случайные хайлайты от GPT: {e}")
@@ -361,23 +355,30 @@ def handle_random_clips_workflow(url, config, out_dir, status_callback, send_vid
             status_callback(get_translation(lang, "gpt_highlights_error"))
         return 0, 0
 
+    if checkpoint is not None and not resumed_timecodes:
+        checkpoint.save_timecodes(shorts_timecodes)
+
     num_to_process = len(shorts_timecodes)
     if status_callback:
         status_callback(get_translation(lang, "clips_found").format(shorts_timecodes_len=len(shorts_timecodes), num_to_process=num_to_process))
 
+    shorts_to_process, successful_sends = _skip_sent_clips(checkpoint, shorts_timecodes)
+    if not shorts_to_process:
+        return successful_sends, 0
+
     # The new orchestrator function handles the rest
     futures = orchestrate_clip_creation(
         config=config,
         url=url,
-        shorts_timecodes=shorts_timecodes,
+        shorts_timecodes=shorts_to_process,
         out_dir=out_dir,
         send_video_callback=send_video_callback,
         audio_path=None,
         full_transcript_segments=None,
-        status_callback=status_callback
+        status_callback=status_callback,
+        cancelled=_cancel_event(checkpoint)
     )
 
-    successful_sends = 0
     for render_future in futures:
         try:
             # .result() on the render_future waits for _render_clip_from_segment to complete
@@ -394,76 +395,116 @@ def handle_random_clips_workflow(url, config, out_dir, status_callback, send_vid
 
     return successful_sends, 0
 
-def main_twitch(url, config, out_dir, status_callback, send_video_callback):
+def main_twitch(url, config, out_dir, status_callback, send_video_callback, checkpoint=None):
     """Entry point for the Twitch workflow."""
-    return handle_random_clips_workflow(url, config, out_dir, status_callback, send_video_callback)
+    return handle_random_clips_workflow(url, config, out_dir, status_callback, send_video_callback, checkpoint)
 
 
-def _render_clip_from_segment(config, segment_video_path, short_info, clip_num, out_dir, audio_path, full_transcript_segments, send_video_callback):
+def _prepare_subtitle_items(config, segment_video_path, start_cut, end_cut, out_dir, audio_path, full_transcript_segments, segment_in_point=0.0, word_items=None):
     """
-    Handles the rendering of a single video clip from an already downloaded segment.
+    Builds the subtitle items for a clip (relative timings) or returns None when subtitles are off.
+    segment_in_point is where start_cut lies inside the segment file (stream-copied segments
+    start at the preceding keyframe). word_items are the clip's words from the job's WordTimestampStore.
     """
-    final_width = 720
-    final_height = 1280
-    start_cut = to_seconds(short_info["start"])
-    end_cut = to_seconds(short_info["end"])
-
-    main_clip_raw = VideoFileClip(str(segment_video_path))
-    
     subtitles_type = config.get('subtitles_type', 'word-by-word')
-    
+    if subtitles_type == 'no_subtitles':
+        return None
+
     current_transcript_segments = full_transcript_segments
-    
-    ass_path = None
-    if subtitles_type != 'no_subtitles':
-        if current_transcript_segments is None:
-            segments, _ = get_transcript_segments_and_file(
-                url=None, 
-                out_dir=out_dir,
-                audio_path=segment_video_path,
-                force_whisper=True,
-                is_twitch_clip=True
-            )
-            current_transcript_segments = segments
-
-        if not config.get('capitalize_sentences', True):
-            for seg in current_transcript_segments:
-                if seg['start'] >= start_cut:
-                    text = seg['text']
-                    lstripped_text = text.lstrip()
-                    if lstripped_text:
-                        new_text = lstripped_text[0].lower() + lstripped_text[1:]
-                        seg['text'] = new_text
-                if seg['start'] > end_cut:
-                    break
-        
-        audio_for_subtitles = segment_video_path if audio_path is None else audio_path
-        subtitle_items = get_subtitle_items(
-            subtitles_type, current_transcript_segments, audio_for_subtitles, start_cut, end_cut)
-        
-        ass_path = out_dir / f"short{clip_num}.ass"
-        
-        video_canvas, subtitle_y_pos, subtitle_width = _build_video_canvas(
-            config, main_clip_raw, final_width, final_height
+    if current_transcript_segments is None and subtitles_type == 'word-by-word' and word_items is not None:
+        # Референс для snap строился бы тем же Whisper по тем же словам — пропускаем
+        current_transcript_segments = []
+    elif current_transcript_segments is None:
+        segments, _ = get_transcript_segments_and_file(
+            url=None, 
+            out_dir=out_dir,
+            audio_path=segment_video_path,
+            force_whisper=True,
+            is_twitch_clip=True
         )
-        final_clip = video_canvas
+        # Тайминги Whisper считаются от начала файла, а не от начала клипа
+        current_transcript_segments = [
+            {**seg, 'start': max(0.0, seg['start'] - segment_in_point), 'end': seg['end'] - segment_in_point}
+            for seg in segments if seg['end'] > segment_in_point
+        ]
 
-        create_ass_subtitles(
-            subtitle_items, str(ass_path), final_width, final_height,
-            subtitle_y_pos, subtitle_width, config.get('subtitle_style', 'white'), subtitles_type
-        )
+    if not config.get('capitalize_sentences', True):
+        for seg in current_transcript_segments:
+            if seg['start'] >= start_cut:
+                text = seg['text']
+                lstripped_text = text.lstrip()
+                if lstripped_text:
+                    new_text = lstripped_text[0].lower() + lstripped_text[1:]
+                    seg['text'] = new_text
+            if seg['start'] > end_cut:
+                break
+
+    if audio_path is None:
+        audio_for_subtitles = segment_video_path
+        audio_offset = start_cut - segment_in_point
     else:
-        video_canvas, _, _ = _build_video_canvas(config, main_clip_raw, final_width, final_height)
-        final_clip = video_canvas
+        audio_for_subtitles = audio_path
+        audio_offset = None
+    return get_subtitle_items(
+        subtitles_type, current_transcript_segments, audio_for_subtitles, start_cut, end_cut,
+        audio_offset=audio_offset, word_items=word_items)
+
+
+def _write_ass_file(config, subtitle_items, ass_path, final_width, final_height, subtitle_y_pos, subtitle_width):
+    create_ass_subtitles(
+        subtitle_items, str(ass_path), final_width, final_height,
+        subtitle_y_pos, subtitle_width, config.get('subtitle_style', 'white'), config.get('subtitles_type', 'word-by-word')
+    )
+    return ass_path
+
+
+def _render_with_ffmpeg(config, segment_video_path, subtitle_items, output_sub, ass_path, final_width, final_height, in_point, clip_duration,
+                        crop_cmd_path=None, track_key=None):
+    src_width, src_height, segment_duration = probe_video(segment_video_path)
+    duration = min(clip_duration, segment_duration - in_point) if segment_duration > in_point else clip_duration
+    geometry = compute_layout_geometry(config, src_width, src_height, final_width, final_height)
+    if crop_cmd_path is not None:
+        prepare_face_crop(config, geometry, segment_video_path, src_width, src_height, final_width, final_height,
+                          duration, crop_cmd_path, in_point=in_point, track_key=track_key)
+
+    if subtitle_items is not None:
+        _write_ass_file(config, subtitle_items, ass_path, final_width, final_height,
+                        geometry['subtitle_y_pos'], geometry['subtitle_width'])
+    else:
+        ass_path = None
+
+    render_clip_ffmpeg(config, segment_video_path, output_sub, geometry,
+                       final_width, final_height, duration, ass_path=ass_path, in_point=in_point)
+
+
+def _render_with_moviepy(config, segment_video_path, subtitle_items, output_sub, ass_path, final_width, final_height, in_point, clip_duration, track_key=None):
+    with get_asset_manager().clip_scope() as assets:
+        _compose_and_write_moviepy(assets, config, segment_video_path, subtitle_items, output_sub, ass_path,
+                                   final_width, final_height, in_point, clip_duration, track_key)
+
+
+def _compose_and_write_moviepy(assets, config, segment_video_path, subtitle_items, output_sub, ass_path, final_width, final_height, in_point, clip_duration, track_key=None):
+    segment_clip = assets.clip_video(segment_video_path)
+    main_clip_raw = segment_clip
+    if in_point > 0:
+        main_clip_raw = segment_clip.subclip(in_point, min(in_point + clip_duration, segment_clip.duration))
+
+    video_canvas, subtitle_y_pos, subtitle_width = _build_video_canvas(
+        config, main_clip_raw, final_width, final_height,
+        source_path=segment_video_path, source_offset=in_point, track_key=track_key
+    )
+    final_clip = video_canvas
+
+    if subtitle_items is not None:
+        _write_ass_file(config, subtitle_items, ass_path, final_width, final_height, subtitle_y_pos, subtitle_width)
 
     if config.get('add_banner'):
         banner_type = config.get('add_banner')
         if banner_type == 'shorts_factory_banner':
             banner_path = 'banner.png'
             if os.path.exists(banner_path):
-                banner_clip = (ImageClip(banner_path)
+                banner_clip = (assets.banner_image(banner_path, final_clip.w * 0.4)
                                .set_duration(final_clip.duration)
-                               .resize(width=final_clip.w * 0.4)
                                .set_position(('center', final_clip.h * 0.1)))
                 final_clip = CompositeVideoClip([final_clip, banner_clip])
             else:
@@ -471,7 +512,7 @@ def _render_clip_from_segment(config, segment_video_path, short_info, clip_num,
         elif banner_type == 'getcourse_banner':
             banner_path = 'getcourse_banner_encoded.mp4'
             if os.path.exists(banner_path):
-                banner_video = VideoFileClip(banner_path).without_audio()
+                banner_video = assets.shared_video(banner_path)
                 banner_video = banner_video.loop(duration=final_clip.duration)
                 banner_clip = (banner_video
                                .resize(width=final_clip.w * 0.5) # Half width
@@ -481,91 +522,207 @@ def _render_clip_from_segment(config, segment_video_path, short_info, clip_num,
                 logger.warning(f"Banner file not found at {banner_path}")
 
     final_clip = final_clip.set_duration(main_clip_raw.duration)
+    final_clip = final_clip.set_audio(main_clip_raw.audio)
+
+    # Субтитры прожигаются в том же проходе кодирования, без промежуточного temp_short.mp4
+    ffmpeg_params = None
+    if subtitle_items is not None and os.path.exists(ass_path):
+        ffmpeg_params = ["-vf", f"subtitles={str(ass_path)}:fontsdir=fonts"]
+
+    final_clip.write_videofile(str(output_sub), fps=24, codec="libx264", audio_codec="aac",
+                               preset="medium", ffmpeg_params=ffmpeg_params)
+
+
+def _render_clip_to_file(config, segment_video_path, short_info, clip_num, out_dir, audio_path, full_transcript_segments, segment_in_point=0.0, word_items=None):
+    """
+    Handles the rendering of a single video clip from an already downloaded segment.
+    The clip is encoded exactly once: either by a single ffmpeg filter graph or,
+    for face-tracked layouts, by moviepy with subtitles burned in the same pass.
+    Runs inside the render process pool, so it only returns the output path.
+    segment_in_point is the offset of the clip start inside the segment file.
+    """
+    final_width = 720
+    final_height = 1280
+    start_cut = to_seconds(short_info["start"])
+    end_cut = to_seconds(short_info["end"])
+
+    clip_duration = end_cut - start_cut
+    # Траектория лица зависит только от отрезка видео, поэтому кэшируется по нему
+    video_id = config.get('video_id')
+    track_key = f"{video_id}|{start_cut:.3f}|{end_cut:.3f}" if video_id else None
+
+    subtitle_items = _prepare_subtitle_items(
+        config, segment_video_path, start_cut, end_cut, out_dir, audio_path, full_transcript_segments, segment_in_point, word_items)
+
+    ass_path = out_dir / f"short{clip_num}.ass"
+    crop_cmd_path = out_dir / f"short{clip_num}_crop.cmd"
     output_sub = out_dir / f"short{clip_num}.mp4"
 
-    if ass_path and os.path.exists(ass_path):
-        final_clip = final_clip.set_audio(None)
-        temp_video_path = out_dir / f"temp_short{clip_num}.mp4"
-        final_clip.write_videofile(str(temp_video_path), fps=24, codec="libx264", audio=False)
-        
-        fonts_dir = "fonts"
-        ffmpeg_vf = f"subtitles={str(ass_path)}:fontsdir={fonts_dir}"
-        cmd = [
-            "ffmpeg", "-i", str(temp_video_path), "-i", str(segment_video_path),
-            "-vf", ffmpeg_vf, "-c:v", "libx264", "-preset", "medium", "-crf", "23",
-            "-c:a", "aac", "-map", "0:v:0", "-map", "1:a:0", "-y", str(output_sub)
-        ]
+    rendered = False
+    if RENDER_ENGINE == 'ffmpeg':
         try:
-            subprocess.run(cmd, check=True, capture_output=True, text=True)
+            _render_with_ffmpeg(config, segment_video_path, subtitle_items, output_sub, ass_path, final_width, final_height,
+                                segment_in_point, clip_duration, crop_cmd_path, track_key)
+            rendered = True
         except subprocess.CalledProcessError as e:
-            print(f"Error burning subtitles with ffmpeg: {e.stderr}")
-            shutil.copy(temp_video_path, output_sub)
-        finally:
-            if os.path.exists(temp_video_path): os.remove(temp_video_path)
-            if os.path.exists(ass_path): os.remove(ass_path)
-    else:
-        final_clip = final_clip.set_audio(main_clip_raw.audio)
-        final_clip.write_videofile(str(output_sub), fps=24, codec="libx264", audio_codec="aac")
-    
+            logger.warning(f"Single-pass ffmpeg render failed for clip #{clip_num}, falling back to moviepy: {e.stderr}")
+        except Exception as e:
+            logger.warning(f"Single-pass ffmpeg render failed for clip #{clip_num}, falling back to moviepy: {e}")
+
+    try:
+        if not rendered:
+            _render_with_moviepy(config, segment_video_path, subtitle_items, output_sub, ass_path, final_width, final_height,
+                                 segment_in_point, clip_duration, track_key)
+    finally:
+        if os.path.exists(ass_path): os.remove(ass_path)
+        if os.path.exists(crop_cmd_path): os.remove(crop_cmd_path)
+
     if os.path.exists(segment_video_path):
         os.remove(segment_video_path)
 
     print(f"✅ Создан файл {output_sub}")
-    
+    return output_sub
+
+
+def _send_rendered_clip(send_video_callback, output_sub, short_info, clip_key=None):
     if send_video_callback:
         virality_score = short_info.get("virality_score", None) # Get score, default to None
-        return send_video_callback(file_path=output_sub, hook=short_info["hook"], start=short_info["start"], end=short_info["end"], virality_score=virality_score)
+        return send_video_callback(file_path=output_sub, hook=short_info["hook"], start=short_info["start"], end=short_info["end"], virality_score=virality_score, clip_key=clip_key)
     return None
 
-def orchestrate_clip_creation(config, url, shorts_timecodes, out_dir, send_video_callback, audio_path=None, full_transcript_segments=None, status_callback=None):
+
+def _render_clip_from_segment(config, segment_video_path, short_info, clip_num, out_dir, audio_path, full_transcript_segments, send_video_callback, segment_in_point=0.0, word_items=None):
+    """
+    Renders a clip in the current process and hands it to send_video_callback.
+    """
+    output_sub = _render_clip_to_file(config, segment_video_path, short_info, clip_num, out_dir, audio_path, full_transcript_segments, segment_in_point, word_items)
+    return _send_rendered_clip(send_video_callback, output_sub, short_info)
+
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+def get_render_pool():
+    """
+    Returns the process pool shared by all processing workers.
+    Its size is the global cap on clips rendered at the same time.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            logger.info(f"Starting render process pool with {RENDER_POOL_SIZE} worker(s)...")
+            # spawn: the parent runs asyncio and worker threads, forking it is unsafe.
+            # Workers share the parent's Whisper slots, so fallback transcriptions count against one budget.
+            _render_pool = ProcessPoolExecutor(
+                max_workers=max(1, RENDER_POOL_SIZE),
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_whisper_slots,
+                initargs=(get_whisper_slots(),)
+            )
+        return _render_pool
+
+def _reset_render_pool(broken_pool):
+    """Drops a pool whose worker process died so the next clip gets a fresh one."""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is broken_pool:
+            _render_pool = None
+            # Умерший процесс мог держать слот Whisper - новый пул получит новые слоты
+            reset_whisper_slots()
+    broken_pool.shutdown(wait=False)
+
+
+def orchestrate_clip_creation(config, url, shorts_timecodes, out_dir, send_video_callback, audio_path=None, full_transcript_segments=None, status_callback=None, cancelled=None):
     """
     Orchestrates the creation of video clips using a producer-consumer pattern.
-    Downloads segments sequentially while rendering them sequentially, but overlapping the two phases.
+    Segments are fetched by DOWNLOAD_WORKERS parallel downloaders (at most
+    SEGMENT_BUFFER_SIZE segments on disk) and rendered in parallel in the shared
+    render process pool (at most RENDER_WORKERS_PER_JOB clips per job).
+    Downloaders and render callbacks only post events; this thread submits renders
+    and hands finished clips to send_video_callback in clip order: a clip is sent
+    as soon as it and every clip before it have been rendered (or skipped).
+    For word-by-word subtitles, word timestamps are collected once per video in a
+    WordTimestampStore: with a full audio track, the windows of all clips go through
+    one Whisper pass in the background; otherwise each downloaded segment is transcribed
+    by its downloader. Renders only slice their words.
+    Clips already in the clip cache (same video, cut and render options) are neither
+    downloaded nor rendered.
+    If `cancelled` (threading.Event) is set, no further clip is sent: pending downloads
+    and renders are cancelled and TaskCancelled is raised.
     """
-    render_futures = []       # Futures for the rendering tasks
-    
-    # 1. Define the downloader worker function
-    def _download_worker_task(clip_num, short_info):
-        start_cut = to_seconds(short_info["start"])
-        end_cut = to_seconds(short_info["end"])
-        segment_video_path = out_dir / f"segment_{clip_num}.mp4"
+    render_limit = max(1, RENDER_WORKERS_PER_JOB)
+
+    total_clips = len(shorts_timecodes)
+    render_states = {}        # clip_num -> (short_info, render future) или None, если клип пропущен
+    result_futures = {}       # clip_num -> Future с результатом send_video_callback
+    render_pools = {}         # clip_num -> пул, в который отправлен рендер
+    render_args = {}          # clip_num -> аргументы _submit_render (для повтора после падения пула)
+    next_clip_to_send = 1
+    video_id = config.get('video_id')
+    clip_keys = {}            # clip_num -> ключ в кэше готовых клипов
+    # События для этого потока: ('segment', clip_num, path, in_point, word_items, short_info)
+    # от загрузчиков и ('rendered', clip_num, future) от пула рендера
+    events = Queue()
+
+    word_store = None
+    if config.get('subtitles_type', 'word-by-word') == 'word-by-word':
+        word_store = WordTimestampStore()
+
+    def _collect_word_items(segment_video_path, start_cut, end_cut, in_point):
+        if word_store is None:
+            return None
+        if audio_path is not None:
+            source, audio_offset = audio_path, 0.0
+        else:
+            source, audio_offset = segment_video_path, start_cut - in_point
         try:
-            print(f"Downloading segment {clip_num} ({short_info['start']}-{short_info['end']})...")
-            download_video_segment(url, segment_video_path, start_cut, end_cut)
-            return clip_num, segment_video_path, short_info
+            word_store.ensure_range(source, start_cut, end_cut, audio_offset)
+            return word_store.words_for_window(start_cut, end_cut)
         except Exception as e:
-            logger.error(f"Failed to download segment {clip_num} ({start_cut}-{end_cut}): {e}", exc_info=True)
-            return clip_num, None, short_info
-
-    # 2. Start the downloader in a single-worker executor
-    download_executor = ThreadPoolExecutor(max_workers=1)
-    # Submit all download tasks to the downloader executor.
-    # They will be executed sequentially by this executor.
-    download_submission_futures = [
-        download_executor.submit(_download_worker_task, i + 1, short)
-        for i, short in enumerate(shorts_timecodes)
-    ]
+            # Рендер сам распознает сегмент, как раньше
+            logger.warning(f"Word timestamps for {start_cut}-{end_cut} failed, the render will transcribe the clip: {e}")
+            return None
 
-    # 3. Start the renderer in a single-worker executor
-    render_executor = ThreadPoolExecutor(max_workers=1)
+    def _is_cancelled():
+        return cancelled is not None and cancelled.is_set()
 
-    download_count = 0
-    total_downloads = len(shorts_timecodes)
-
-    # 4. As downloads complete, feed them to the renderer
-    for future in as_completed(download_submission_futures):
-        clip_num, segment_path, short_info = future.result()
-        if segment_path:
-            download_count += 1
-            print(f"Finished downloading segment {clip_num}. {download_count}/{total_downloads} downloaded.")
-            # if status_callback:
-            #     lang = config.get('lang', 'ru')
-            #     status_callback(get_translation(lang, "downloading_clips").format(current=download_count, total=total_downloads))
-            
-            # Submit rendering task for this downloaded segment
-            print(f"Submitting clip #{clip_num} for rendering...")
-            render_future = render_executor.submit(
-                _render_clip_from_segment,
+    def _prefetch_words(ranges):
+        try:
+            word_store.ensure_ranges(audio_path, ranges, 0.0)
+        except Exception as e:
+            # Загрузчики распознают свои окна сами
+            logger.warning(f"Word timestamp prefetch for {len(ranges)} clip(s) failed: {e}")
+
+    def _release_ready_clips():
+        # Вызывается только из этого потока, поэтому отправка идёт без блокировок
+        nonlocal next_clip_to_send
+        while not _is_cancelled() and next_clip_to_send <= total_clips and next_clip_to_send in render_states:
+            state = render_states[next_clip_to_send]
+            if state is not None:
+                short_info, render_future = state
+                if not render_future.done():
+                    break
+                result_future = result_futures[next_clip_to_send]
+                try:
+                    output_sub = render_future.result()
+                    result_future.set_result(_send_rendered_clip(
+                        send_video_callback, output_sub, short_info, clip_keys.get(next_clip_to_send)))
+                except Exception as e:
+                    result_future.set_exception(e)
+            next_clip_to_send += 1
+
+    def _on_render_done(render_future, clip_num):
+        # Поток управления пулом только сообщает о готовности; кэш и отправка - в потоке оркестратора
+        events.put(('rendered', clip_num, render_future))
+
+    def _submit_render(clip_num, segment_path, in_point, word_items, short_info):
+        # Пул берётся заново: после BrokenProcessPool get_render_pool() создаёт новый
+        render_pool = get_render_pool()
+        render_args[clip_num] = (clip_num, segment_path, in_point, word_items, short_info)
+        print(f"Submitting clip #{clip_num} for rendering...")
+        try:
+            render_future = render_pool.submit(
+                _render_clip_to_file,
                 config=config,
                 segment_video_path=segment_path,
                 short_info=short_info,
@@ -573,22 +730,133 @@ def orchestrate_clip_creation(config, url, shorts_timecodes, out_dir, send_video
                 out_dir=out_dir,
                 audio_path=audio_path,
                 full_transcript_segments=full_transcript_segments,
-                send_video_callback=send_video_callback
+                segment_in_point=in_point,
+                word_items=word_items
             )
-            render_futures.append(render_future)
-        else:
-            print(f"Skipping rendering for clip #{clip_num} due to failed download.")
-            logger.warning(f"Clip #{clip_num} download failed, skipping rendering.")
+        except Exception as e:
+            # The pool is broken or shut down: count the clip as failed
+            render_future = Future()
+            render_future.set_exception(e)
+        render_pools[clip_num] = render_pool
+        render_states[clip_num] = (short_info, render_future)
+        render_future.add_done_callback(lambda f, num=clip_num: _on_render_done(f, num))
 
-    # Shut down executors
+    # 1. Define the downloader worker function
+    def _download_worker_task(clip_num, short_info):
+        start_cut = to_seconds(short_info["start"])
+        end_cut = to_seconds(short_info["end"])
+        segment_video_path = out_dir / f"segment_{clip_num}.mp4"
+        # Ограничиваем число сегментов на диске: слот освобождается после рендера клипа
+        while not segment_slots.acquire(timeout=1):
+            if _is_cancelled():
+                return
+        if _is_cancelled():
+            segment_slots.release()
+            return
+        try:
+            print(f"Downloading segment {clip_num} ({short_info['start']}-{short_info['end']})...")
+            _, in_point = download_video_segment_with_retry(url, segment_video_path, start_cut, end_cut)
+            word_items = _collect_word_items(segment_video_path, start_cut, end_cut, in_point)
+            events.put(('segment', clip_num, segment_video_path, in_point, word_items, short_info))
+        except Exception as e:
+            logger.error(f"Failed to download segment {clip_num} ({start_cut}-{end_cut}): {e}", exc_info=True)
+            segment_slots.release()
+            events.put(('segment', clip_num, None, 0.0, None, short_info))
+
+    # 2. Start the downloaders: N parallel fetches, at most buffer_size segments on disk
+    buffer_size = max(1, SEGMENT_BUFFER_SIZE)
+    segment_slots = threading.BoundedSemaphore(buffer_size)
+    download_executor = ThreadPoolExecutor(max_workers=max(1, DOWNLOAD_WORKERS))
+    # Tasks are submitted in clip order, so earlier clips are fetched first
+    total_downloads = 0
+    prefetch_ranges = []
+    for i, short in enumerate(shorts_timecodes):
+        clip_num = i + 1
+        clip_keys[clip_num] = clip_cache_key(video_id, short["start"], short["end"], config)
+        cached_clip = get_cached_clip(clip_keys[clip_num])
+        if cached_clip:
+            print(f"Clip #{clip_num} found in the clip cache, skipping download and rendering.")
+            cached_future = Future()
+            cached_future.set_result(cached_clip['file_path'])
+            result_futures[clip_num] = Future()
+            render_states[clip_num] = (short, cached_future)
+            continue
+        download_executor.submit(_download_worker_task, clip_num, short)
+        total_downloads += 1
+        prefetch_ranges.append((to_seconds(short["start"]), to_seconds(short["end"])))
+    if word_store is not None and audio_path is not None and prefetch_ranges:
+        # Полная аудиодорожка есть: окна всех клипов - одним проходом Whisper, загрузчики только ждут свои слова
+        threading.Thread(target=_prefetch_words, args=(prefetch_ranges,), daemon=True).start()
+    _release_ready_clips()
+
+    # 3. Feed downloaded segments to the render pool and dispatch finished clips
+    download_count = 0
+    remaining_downloads = total_downloads
+    waiting_segments = deque()   # скачанные сегменты, ждущие слота рендера этой задачи
+    renders_in_flight = 0
+    retried_clips = set()
+    while remaining_downloads or waiting_segments or renders_in_flight:
+        if _is_cancelled():
+            break
+        # Per-job cap: at most render_limit clips of this job in the pool
+        while waiting_segments and renders_in_flight < render_limit:
+            _submit_render(*waiting_segments.popleft())
+            renders_in_flight += 1
+
+        try:
+            # Таймаут - чтобы заметить отмену, пока идут долгие загрузки и рендеры
+            event = events.get(timeout=1)
+        except Empty:
+            continue
+        if event[0] == 'segment':
+            _, clip_num, segment_path, in_point, word_items, short_info = event
+            remaining_downloads -= 1
+            if segment_path:
+                download_count += 1
+                print(f"Finished downloading segment {clip_num}. {download_count}/{total_downloads} downloaded.")
+                result_futures[clip_num] = Future()
+                waiting_segments.append((clip_num, segment_path, in_point, word_items, short_info))
+            else:
+                print(f"Skipping rendering for clip #{clip_num} due to failed download.")
+                logger.warning(f"Clip #{clip_num} download failed, skipping rendering.")
+                render_states[clip_num] = None
+        else:
+            _, clip_num, render_future = event
+            renders_in_flight -= 1
+            error = render_future.exception()
+            if isinstance(error, BrokenProcessPool):
+                _reset_render_pool(render_pools[clip_num])
+                if clip_num not in retried_clips:
+                    # Упал процесс пула, а не сам клип: один раз повторяем на новом пуле
+                    logger.warning(f"Render pool broke while rendering clip #{clip_num}, retrying on a new pool.")
+                    retried_clips.add(clip_num)
+                    del render_states[clip_num]
+                    waiting_segments.appendleft(render_args[clip_num])
+                    continue
+            elif error is None:
+                store_clip(clip_keys.get(clip_num), video_id, render_future.result())
+            segment_slots.release()
+        _release_ready_clips()
+
+    if _is_cancelled():
+        # Аренду забрал другой воркер: бросаем оставшиеся загрузки и рендеры этой задачи
+        logger.warning(f"Clip creation for {video_id} cancelled, {total_clips - next_clip_to_send + 1} clip(s) not sent.")
+        download_executor.shutdown(wait=False, cancel_futures=True)
+        for state in render_states.values():
+            if state is not None:
+                state[1].cancel()
+        raise TaskCancelled("Task lease lost, stopping.")
+
+    # Shut down the downloader; every clip has been dispatched by now
     download_executor.shutdown(wait=True)
-    render_executor.shutdown(wait=True)
+    ordered_futures = [result_futures[num] for num in sorted(result_futures)]
+    wait(ordered_futures)
     
-    # Return futures for the send_video_callback results
-    return render_futures
+    # Return futures for the send_video_callback results, in clip order
+    return ordered_futures
 
 
-def process_video_clips(config, url, audio_path, shorts_timecodes, transcript_segments, out_dir, send_video_callback=None):
+def process_video_clips(config, url, audio_path, shorts_timecodes, transcript_segments, out_dir, send_video_callback=None, cancelled=None):
     return orchestrate_clip_creation(
         config=config,
         url=url,
@@ -596,7 +864,8 @@ def process_video_clips(config, url, audio_path, shorts_timecodes, transcript_se
         out_dir=out_dir,
         send_video_callback=send_video_callback,
         audio_path=audio_path,
-        full_transcript_segments=transcript_segments
+        full_transcript_segments=transcript_segments,
+        cancelled=cancelled
     )
 
 if __name__ == "__main__":
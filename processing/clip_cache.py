@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+import contextlib
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+from config import CLIP_CACHE_DIR, CLIP_CACHE_DB, CLIP_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Поднять при изменении рендера, чтобы не отдавать клипы, собранные по-старому
+CLIP_RENDER_VERSION = 1
+
+# Ключи конфига, которые влияют на картинку клипа
+_RENDER_CONFIG_KEYS = (
+    'layout', 'bottom_video', 'subtitles_type', 'subtitle_style',
+    'add_banner', 'capitalize_sentences', 'use_face_tracking',
+)
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_evict_lock = threading.Lock()
+
+
+def _connect():
+    global _schema_ready
+    conn = sqlite3.connect(CLIP_CACHE_DB, timeout=30)
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                Path(CLIP_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS clip_cache (
+                        clip_key TEXT PRIMARY KEY,
+                        video_id TEXT NOT NULL,
+                        file_path TEXT,
+                        size_bytes INTEGER NOT NULL DEFAULT 0,
+                        telegram_file_id TEXT,
+                        created_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_clip_cache_last_used ON clip_cache (last_used)")
+                conn.commit()
+                _schema_ready = True
+    return conn
+
+
+def clip_cache_key(video_id: Optional[str], start, end, config: Dict[str, Any]) -> Optional[str]:
+    """
+    Content address of a finished clip: video, cut and a canonical hash of the render options.
+    Returns None when the video id is unknown.
+    """
+    if not video_id:
+        return None
+    options = {k: config.get(k) for k in _RENDER_CONFIG_KEYS}
+    payload = json.dumps(
+        {'video_id': video_id, 'start': str(start), 'end': str(end),
+         'options': options, 'render_version': CLIP_RENDER_VERSION},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_cached_clip(clip_key: Optional[str]) -> Optional[Dict[str, Any]]:
+    """
+    Returns {'file_path', 'telegram_file_id'} when the clip can be sent without rendering.
+    file_path is None if the mp4 was evicted but Telegram still has the upload.
+    """
+    if not clip_key:
+        return None
+    try:
+        with contextlib.closing(_connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT file_path, telegram_file_id FROM clip_cache WHERE clip_key = ?", (clip_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            file_path, file_id = row
+            if file_path and not os.path.exists(file_path):
+                file_path = None
+                conn.execute("UPDATE clip_cache SET file_path = NULL, size_bytes = 0 WHERE clip_key = ?", (clip_key,))
+            if not file_path and not file_id:
+                conn.execute("DELETE FROM clip_cache WHERE clip_key = ?", (clip_key,))
+                return None
+            conn.execute("UPDATE clip_cache SET last_used = ? WHERE clip_key = ?", (time.time(), clip_key))
+    except sqlite3.Error as e:
+        logger.warning(f"Clip cache read failed: {e}")
+        return None
+    return {'file_path': file_path, 'telegram_file_id': file_id}
+
+
+def store_clip(clip_key: Optional[str], video_id: str, source_path) -> Optional[str]:
+    """Puts a rendered clip into the cache (hard link when possible) and evicts by total size."""
+    if not clip_key or not source_path or not os.path.exists(source_path):
+        return None
+    Path(CLIP_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    cached_path = os.path.join(CLIP_CACHE_DIR, f"{clip_key}.mp4")
+    try:
+        if not os.path.exists(cached_path):
+            tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+            try:
+                os.link(source_path, tmp_path)
+            except OSError:
+                shutil.copy2(source_path, tmp_path)
+            os.replace(tmp_path, cached_path)
+        size = os.path.getsize(cached_path)
+        now = time.time()
+        with contextlib.closing(_connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO clip_cache (clip_key, video_id, file_path, size_bytes, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(clip_key) DO UPDATE SET file_path = excluded.file_path, "
+                "size_bytes = excluded.size_bytes, last_used = excluded.last_used",
+                (clip_key, video_id, cached_path, size, now, now)
+            )
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Could not cache clip {source_path}: {e}")
+        return None
+    _evict_to_size()
+    return cached_path
+
+
+def set_clip_file_id(clip_key: Optional[str], file_id: Optional[str]):
+    """Remembers the Telegram file_id of an uploaded clip so repeats are re-sent without upload."""
+    if not clip_key or not file_id:
+        return
+    try:
+        with contextlib.closing(_connect()) as conn, conn:
+            conn.execute("UPDATE clip_cache SET telegram_file_id = ? WHERE clip_key = ?", (file_id, clip_key))
+    except sqlite3.Error as e:
+        logger.warning(f"Clip cache file_id update failed: {e}")
+
+
+def _evict_to_size():
+    """Deletes least recently used mp4 files until the cache fits CLIP_CACHE_MAX_BYTES."""
+    with _evict_lock:
+        try:
+            with contextlib.closing(_connect()) as conn, conn:
+                total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM clip_cache").fetchone()[0]
+                if total <= CLIP_CACHE_MAX_BYTES:
+                    return
+                rows = conn.execute(
+                    "SELECT clip_key, file_path, size_bytes, telegram_file_id FROM clip_cache "
+                    "WHERE file_path IS NOT NULL ORDER BY last_used ASC"
+                ).fetchall()
+                for clip_key, file_path, size_bytes, file_id in rows:
+                    if total <= CLIP_CACHE_MAX_BYTES:
+                        break
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+                    except OSError as e:
+                        logger.warning(f"Could not evict cached clip {file_path}: {e}")
+                        continue
+                    total -= size_bytes
+                    if file_id:
+                        # Telegram всё ещё хранит загруженный файл - оставляем file_id
+                        conn.execute("UPDATE clip_cache SET file_path = NULL, size_bytes = 0 WHERE clip_key = ?", (clip_key,))
+                    else:
+                        conn.execute("DELETE FROM clip_cache WHERE clip_key = ?", (clip_key,))
+                logger.info(f"Clip cache trimmed to {total / (1024 * 1024):.1f} MB.")
+        except sqlite3.Error as e:
+            logger.warning(f"Clip cache eviction failed: {e}")
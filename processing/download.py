@@ -3,108 +3,177 @@ import os
 import subprocess
 import re
 import json
+import time
+import random
+import threading
 import yt_dlp
 from pathlib import Path
+from collections import OrderedDict
+from urllib.parse import urlparse
 from config import YOUTUBE_COOKIES_FILE, FREESPACE_LIMIT_MB
+from config import DOWNLOAD_RETRIES, DOWNLOAD_RETRY_BACKOFF, DOWNLOAD_HOST_MIN_INTERVAL
+from config import VIDEO_INFO_CACHE_TTL, VIDEO_INFO_CACHE_SIZE
+from config import SEGMENT_EXTRACTION_MODE, SEGMENT_MAX_PREROLL
 from typing import Optional, List, Dict, Tuple, Set
-from utils import get_video_platform
+from utils import get_video_platform, get_video_id
 from localization import get_translation
 
 import logging
 
 logger = logging.getLogger(__name__)
 
+# =========================
+# КЭШ МЕТАДАННЫХ ВИДЕО
+# =========================
+_video_info_cache = OrderedDict()   # video_id -> (expires_at, info_dict)
+_video_info_lock = threading.Lock()
+_video_info_fetch_locks = {}       # video_id -> [lock, число потоков, которые его ждут или держат]
+
+def _video_info_ydl_opts(url: str) -> dict:
+    ydl_opts = {
+        'quiet': True,
+        'skip_download': True,
+        'noplaylist': True,
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
+        }
+    }
+    if get_video_platform(url) == 'youtube' and YOUTUBE_COOKIES_FILE and os.path.exists(YOUTUBE_COOKIES_FILE):
+        ydl_opts['cookiefile'] = YOUTUBE_COOKIES_FILE
+    return ydl_opts
+
+def _get_cached_video_info(video_id: str) -> Optional[dict]:
+    with _video_info_lock:
+        entry = _video_info_cache.get(video_id)
+        if entry is None:
+            return None
+        expires_at, info_dict = entry
+        if expires_at < time.monotonic():
+            del _video_info_cache[video_id]
+            return None
+        _video_info_cache.move_to_end(video_id)
+        return info_dict
+
+def get_video_info(url: str) -> dict:
+    """
+    Returns the yt-dlp info dict (duration, heatmap, subtitles, formats) for a URL.
+    Results are cached per normalized video ID with a TTL and LRU eviction, so the
+    availability check, duration, heatmap and captions lookups share one extraction.
+    Errors from yt-dlp are propagated and never cached.
+    """
+    video_id = get_video_id(url)
+    info_dict = _get_cached_video_info(video_id)
+    if info_dict is not None:
+        return info_dict
+
+    # Один запрос к YouTube на видео, даже если его запрашивают несколько потоков
+    # Замок живёт, пока им кто-то пользуется, - неудачные URL не копятся в словаре
+    with _video_info_lock:
+        fetch_entry = _video_info_fetch_locks.setdefault(video_id, [threading.Lock(), 0])
+        fetch_entry[1] += 1
+    try:
+        with fetch_entry[0]:
+            info_dict = _get_cached_video_info(video_id)
+            if info_dict is not None:
+                return info_dict
+
+            with yt_dlp.YoutubeDL(_video_info_ydl_opts(url)) as ydl:
+                info_dict = ydl.extract_info(url, download=False)
+
+            with _video_info_lock:
+                _video_info_cache[video_id] = (time.monotonic() + VIDEO_INFO_CACHE_TTL, info_dict)
+                _video_info_cache.move_to_end(video_id)
+                while len(_video_info_cache) > VIDEO_INFO_CACHE_SIZE:
+                    _video_info_cache.popitem(last=False)
+            return info_dict
+    finally:
+        with _video_info_lock:
+            fetch_entry[1] -= 1
+            if fetch_entry[1] == 0:
+                _video_info_fetch_locks.pop(video_id, None)
+
+
+def _duration_from_info(url: str, info_dict: dict) -> Optional[float]:
+    """Extracts the duration from a yt-dlp info dict, with an ffprobe fallback."""
+    duration = info_dict.get('duration')
+    
+    # Fallback for Twitch VODs where duration is in the last chapter's end_time
+    if duration is None:
+        chapters = info_dict.get('chapters')
+        if chapters and isinstance(chapters, list):
+            try:
+                last_chapter = chapters[-1]
+                if last_chapter and isinstance(last_chapter, dict):
+                    duration = last_chapter.get('end_time')
+                    if duration:
+                        logger.info(f"Found duration for Twitch VOD in 'chapters' list: {duration}")
+            except (IndexError, TypeError):
+                pass
+    
+    if duration is None:
+        entries = info_dict.get('entries')
+        if entries and isinstance(entries, list):
+            try:
+                first_entry = entries[0]
+                if first_entry and isinstance(first_entry, dict):
+                    duration = first_entry.get('duration')
+                    if duration:
+                        logger.info(f"Found duration for Twitch VOD in 'entries' list: {duration}")
+            except (IndexError, TypeError):
+                pass
+
+    # If duration is still not found, try ffprobe
+    if duration is None:
+        logger.info("yt-dlp failed to find duration, trying ffprobe as a fallback.")
+        stream_url = info_dict.get('url') # Get top-level url first
+        if not stream_url and 'formats' in info_dict and info_dict['formats']:
+            stream_url = info_dict['formats'][-1].get('url') # Fallback to last format's url
+
+        if stream_url:
+            try:
+                cmd = [
+                    "ffprobe",
+                    "-v", "error",
+                    "-show_entries", "format=duration",
+                    "-of", "default=noprint_wrappers=1:nokey=1",
+                    stream_url
+                ]
+                result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=60)
+                duration_str = result.stdout.strip()
+                if duration_str and duration_str != 'N/A':
+                    duration = float(duration_str)
+                    logger.info(f"ffprobe successfully found duration: {duration}")
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
+                logger.error(f"ffprobe failed to get duration: {e}")
+            except Exception as e:
+                logger.error(f"An unexpected error occurred with ffprobe: {e}")
+
+    if duration is None:
+        logger.warning(f"Could not find 'duration' in any known location for {url}.")
+
+    return duration
+
 def get_video_duration(url: str) -> Optional[float]:
     """
     Retrieves the duration of a video in seconds using yt-dlp, with an ffprobe fallback.
     """
     try:
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'simulate': True,
-            'noplaylist': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
-            }
-        }
-        if get_video_platform(url) == 'youtube' and YOUTUBE_COOKIES_FILE and os.path.exists(YOUTUBE_COOKIES_FILE):
-            ydl_opts['cookiefile'] = YOUTUBE_COOKIES_FILE
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=False)
-            
-            duration = info_dict.get('duration')
-            
-            # Fallback for Twitch VODs where duration is in the last chapter's end_time
-            if duration is None:
-                chapters = info_dict.get('chapters')
-                if chapters and isinstance(chapters, list):
-                    try:
-                        last_chapter = chapters[-1]
-                        if last_chapter and isinstance(last_chapter, dict):
-                            duration = last_chapter.get('end_time')
-                            if duration:
-                                logger.info(f"Found duration for Twitch VOD in 'chapters' list: {duration}")
-                    except (IndexError, TypeError):
-                        pass
-            
-            if duration is None:
-                entries = info_dict.get('entries')
-                if entries and isinstance(entries, list):
-                    try:
-                        first_entry = entries[0]
-                        if first_entry and isinstance(first_entry, dict):
-                            duration = first_entry.get('duration')
-                            if duration:
-                                logger.info(f"Found duration for Twitch VOD in 'entries' list: {duration}")
-                    except (IndexError, TypeError):
-                        pass
-
-            # If duration is still not found, try ffprobe
-            if duration is None:
-                logger.info("yt-dlp failed to find duration, trying ffprobe as a fallback.")
-                stream_url = info_dict.get('url') # Get top-level url first
-                if not stream_url and 'formats' in info_dict and info_dict['formats']:
-                    stream_url = info_dict['formats'][-1].get('url') # Fallback to last format's url
-
-                if stream_url:
-                    try:
-                        cmd = [
-                            "ffprobe",
-                            "-v", "error",
-                            "-show_entries", "format=duration",
-                            "-of", "default=noprint_wrappers=1:nokey=1",
-                            stream_url
-                        ]
-                        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=60)
-                        duration_str = result.stdout.strip()
-                        if duration_str and duration_str != 'N/A':
-                            duration = float(duration_str)
-                            logger.info(f"ffprobe successfully found duration: {duration}")
-                    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError) as e:
-                        logger.error(f"ffprobe failed to get duration: {e}")
-                    except Exception as e:
-                        logger.error(f"An unexpected error occurred with ffprobe: {e}")
-
-            if duration is None:
-                logger.warning(f"Could not find 'duration' in any known location for {url}.")
-
-            return duration
+        return _duration_from_info(url, get_video_info(url))
     except Exception as e:
         logger.error(f"Exception in get_video_duration for {url} with yt-dlp: {e}")
         raise e
 
-def check_video_availability(url: str, lang: str = 'ru') -> (bool, str, str):
+def check_video_availability(url: str, lang: str = 'ru') -> (bool, str, str, Optional[float]):
     """
     Checks if a video is available and if there is enough disk space.
     For YouTube, it also checks for subtitles.
-    Returns a tuple (is_available, message, error_log).
+    Returns a tuple (is_available, message, error_log, duration); the duration comes
+    from the same info dict, so callers need no second lookup.
     """
     # 0. Check for disk space
     free_space_mb = shutil.disk_usage('.').free / (1024 * 1024)
     if free_space_mb < FREESPACE_LIMIT_MB:
-        return False, get_translation(lang, "not_enough_disk_space"), "not enough disk space"
+        return False, get_translation(lang, "not_enough_disk_space"), "not enough disk space", None
 
     platform = get_video_platform(url)
 
@@ -113,21 +182,11 @@ def check_video_availability(url: str, lang: str = 'ru') -> (bool, str, str):
         info_dict, message, err = _get_video_info_yt_dlp(url, lang)
         
         if not info_dict:
-            return False, message, err
+            return False, message, err, None
     
     elif platform == 'twitch':
         try:
-            ydl_opts = {
-                'quiet': True,
-                'skip_download': True,
-                'simulate': True,
-                'noplaylist': True,
-                'http_headers': {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
-                }
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info_dict = ydl.extract_info(url, download=False)
+            info_dict = get_video_info(url)
 
             title = info_dict.get('title')
             if not title:
@@ -136,51 +195,42 @@ def check_video_availability(url: str, lang: str = 'ru') -> (bool, str, str):
                     title = entries[0].get('title')
             
             if not title:
-                return False, get_translation(lang, "unavailable_video_error"), "yt-dlp found no title"
+                return False, get_translation(lang, "unavailable_video_error"), "yt-dlp found no title", None
 
         except yt_dlp.utils.DownloadError as e:
             error_message = str(e).lower()
             if "age restricted" in error_message:
-                return False, get_translation(lang, "age_restricted_error"), "age restricted"
+                return False, get_translation(lang, "age_restricted_error"), "age restricted", None
             if "private" in error_message:
-                return False, get_translation(lang, "private_video_error"), "private"
+                return False, get_translation(lang, "private_video_error"), "private", None
             if "unavailable" in error_message:
-                return False, get_translation(lang, "unavailable_video_error"), error_message[:400]
-            return False, get_translation(lang, "video_unavailable_check_link"), error_message
+                return False, get_translation(lang, "unavailable_video_error"), error_message[:400], None
+            return False, get_translation(lang, "video_unavailable_check_link"), error_message, None
         except Exception as e:
             logger.error(f"Error checking twitch video availability {url}: {e}")
-            return False, get_translation(lang, "video_unavailable_check_link"), str(e)
+            return False, get_translation(lang, "video_unavailable_check_link"), str(e), None
 
     else:
-        return False, "Unsupported video platform", "unsupported_platform"
+        return False, "Unsupported video platform", "unsupported_platform", None
 
-    return True, get_translation(lang, "video_available"), "Video is available"
+    try:
+        duration = _duration_from_info(url, info_dict)
+    except Exception as e:
+        logger.warning(f"Could not get video duration for {url}: {e}")
+        duration = None
+    return True, get_translation(lang, "video_available"), "Video is available", duration
 
 def _get_video_info_yt_dlp(url: str, lang: str = 'ru') -> (Optional[dict], str, str):
     """
-    Retrieves video info using the yt-dlp API.
+    Retrieves video info using the yt-dlp API (through the shared metadata cache).
     Returns (info_dict, message, error_log)
     """
     try:
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'simulate': True,
-            'listsubtitles': True,
-            'noplaylist': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
-            }
-        }
-        if get_video_platform(url) == 'youtube' and YOUTUBE_COOKIES_FILE and os.path.exists(YOUTUBE_COOKIES_FILE):
-            ydl_opts['cookiefile'] = YOUTUBE_COOKIES_FILE
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=False)
-            if info_dict.get('title'):
-                return info_dict, get_translation(lang, "video_available"), "Video is available"
-            else:
-                return None, get_translation(lang, "unavailable_video_error"), "yt-dlp found no title"
+        info_dict = get_video_info(url)
+        if info_dict.get('title'):
+            return info_dict, get_translation(lang, "video_available"), "Video is available"
+        else:
+            return None, get_translation(lang, "unavailable_video_error"), "yt-dlp found no title"
     except yt_dlp.utils.DownloadError as e:
         error_message = str(e).lower()
         if "age restricted" in error_message:
@@ -326,34 +376,14 @@ def get_video_heatmap(url: str) -> Optional[List[Dict[str, float]]]:
     Returns a list of dicts: [{'start_time': float, 'end_time': float, 'value': float}, ...]
     """
     try:
-        ydl_opts = {
-            'quiet': True,
-            'skip_download': True,
-            'noplaylist': True,
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
-            }
-        }
-        
-        if get_video_platform(url) == 'youtube' and YOUTUBE_COOKIES_FILE and os.path.exists(YOUTUBE_COOKIES_FILE):
-            ydl_opts['cookiefile'] = YOUTUBE_COOKIES_FILE
-
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            return info.get('heatmap')
+        info = get_video_info(url)
+        return info.get('heatmap')
 
     except Exception as e:
         logger.error(f"Error getting heatmap for {url}: {e}")
         return None
 
-def download_video_segment(url: str, output_path: str, start_time: float, end_time: float):
-    """
-    Downloads a specific segment of a YouTube video using yt-dlp and ffmpeg.
-    -ss is used as an input option for fast seeking.
-    The segment is re-encoded to prevent frozen frames at the beginning.
-    """
-    output_path = str(output_path)
-
+def _segment_ydl_opts(url: str, output_path: str, start_time: float, end_time: float, stream_copy: bool) -> dict:
     def range_func(info_dict, ydl):
         return [{'start_time': start_time, 'end_time': end_time}]
 
@@ -362,7 +392,6 @@ def download_video_segment(url: str, output_path: str, start_time: float, end_ti
         'outtmpl': output_path,
         'noplaylist': True,
         'download_ranges': range_func,
-        'force_keyframes_at_cuts': True,
         'http_headers': {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
         },
@@ -371,7 +400,15 @@ def download_video_segment(url: str, output_path: str, start_time: float, end_ti
                 'player_client': ['android', 'web']
             }
         },
-        'downloader_args': {
+    }
+
+    if stream_copy:
+        # Без перекодирования: ffmpeg копирует потоки начиная с ближайшего ключевого кадра до start_time.
+        # -copyts сохраняет исходные таймстемпы, чтобы потом узнать точную точку входа.
+        ydl_opts['external_downloader_args'] = {'ffmpeg_o': ['-copyts']}
+    else:
+        ydl_opts['force_keyframes_at_cuts'] = True
+        ydl_opts['downloader_args'] = {
             'ffmpeg': [
                 '-c:v', 'libx264',
                 '-preset', 'medium',
@@ -380,18 +417,97 @@ def download_video_segment(url: str, output_path: str, start_time: float, end_ti
                 '-b:a', '192k'
             ]
         }
-    }
 
     if get_video_platform(url) == 'youtube' and YOUTUBE_COOKIES_FILE and os.path.exists(YOUTUBE_COOKIES_FILE):
         ydl_opts['cookiefile'] = YOUTUBE_COOKIES_FILE
+    return ydl_opts
+
+def _probe_start_time(path: str) -> Optional[float]:
+    """Returns the container start time of a media file (seconds) or None."""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=start_time",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        str(path)
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=60)
+        value = result.stdout.strip()
+        return float(value) if value and value != 'N/A' else None
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError) as e:
+        logger.warning(f"ffprobe failed to read start time of {path}: {e}")
+        return None
+
+# Только прогрессивная загрузка по HTTP даёт таймстемпы исходного таймлайна после -copyts;
+# у HLS/DASH база таймстемпов своя, и точку входа по файлу не узнать
+STREAM_COPY_PROTOCOLS = ('http', 'https')
+_copy_unsafe_videos = set()   # video_id, у которых copy-сегмент всё же дал неверную точку входа
+
+def _selected_format_protocol(info_dict: dict) -> str:
+    """Protocol of the format the segment download ('best[height<=1080][ext=mp4]/best[ext=mp4]') will pick."""
+    formats = [
+        f for f in info_dict.get('formats') or []
+        if f.get('ext') == 'mp4' and f.get('vcodec') != 'none' and f.get('acodec') != 'none'
+    ]
+    capped = [f for f in formats if (f.get('height') or 0) <= 1080]
+    # yt-dlp сортирует форматы от худшего к лучшему
+    chosen = (capped or formats or [info_dict])[-1]
+    return chosen.get('protocol') or info_dict.get('protocol') or ''
+
+def _use_stream_copy(url: str) -> bool:
+    """
+    Chooses copy or re-encode before downloading, from the platform and the protocol
+    in the cached info dict, so a segment is never downloaded twice.
+    """
+    if SEGMENT_EXTRACTION_MODE != 'copy' or get_video_platform(url) == 'twitch':
+        return False
+    video_id = get_video_id(url)
+    if video_id in _copy_unsafe_videos:
+        return False
+    try:
+        protocol = _selected_format_protocol(get_video_info(url))
+    except Exception as e:
+        logger.warning(f"Could not read formats of {url}, segments will be re-encoded: {e}")
+        return False
+    if protocol not in STREAM_COPY_PROTOCOLS:
+        logger.info(f"Segments of {video_id} are served over '{protocol}', downloading them with re-encode.")
+        return False
+    return True
+
+def download_video_segment(url: str, output_path: str, start_time: float, end_time: float) -> Tuple[str, float]:
+    """
+    Downloads a specific segment of a YouTube video using yt-dlp and ffmpeg.
+    -ss is used as an input option for fast seeking.
+
+    In 'copy' mode (SEGMENT_EXTRACTION_MODE) progressive HTTP formats are copied
+    without re-encoding, so the file starts at the keyframe before start_time.
+    The offset of start_time inside the file (the in-point) is returned so the
+    render step can trim precisely during its single encode.
+    HLS/DASH formats (Twitch, some YouTube videos) and the 'reencode' mode are
+    re-encoded with keyframes at the cuts, and the in-point is always 0.
+
+    Returns (output_path, in_point).
+    """
+    output_path = str(output_path)
+    stream_copy = _use_stream_copy(url)
 
     try:
         print(f"Downloading segment from {start_time} to {end_time} using yt-dlp download_ranges...")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        with yt_dlp.YoutubeDL(_segment_ydl_opts(url, output_path, start_time, end_time, stream_copy)) as ydl:
             ydl.download([url])
-        
-        print(f"Segment downloaded successfully to {output_path}")
-        return output_path
+
+        in_point = 0.0
+        if stream_copy:
+            keyframe_time = _probe_start_time(output_path)
+            in_point = start_time - keyframe_time if keyframe_time is not None else -1.0
+            if not (0.0 <= in_point <= SEGMENT_MAX_PREROLL):
+                # Формат оказался не таким, как в info dict: дальше это видео качаем с перекодированием,
+                # а этот сегмент перекачает обычный повтор
+                _copy_unsafe_videos.add(get_video_id(url))
+                raise ValueError(f"Unexpected in-point {in_point:.3f}s for stream-copied segment {output_path}.")
+
+        print(f"Segment downloaded successfully to {output_path} (in-point {in_point:.3f}s)")
+        return output_path, in_point
         
     except Exception as e:
         # The original error message from yt-dlp can be verbose, let's log it but raise a cleaner one.
@@ -399,3 +515,43 @@ def download_video_segment(url: str, output_path: str, start_time: float, end_ti
         logger.error(f"yt-dlp/ffmpeg failed to download segment: {error_message}", exc_info=True)
         # Re-raise with a more user-friendly message if needed, or just raise to propagate.
         raise
+
+# =========================
+# ПАРАЛЛЕЛЬНАЯ ЗАГРУЗКА СЕГМЕНТОВ
+# =========================
+_host_last_request = {}
+_host_rate_lock = threading.Lock()
+
+def _wait_for_host_slot(url: str):
+    """
+    Per-host rate limiting: requests to the same host start at least
+    DOWNLOAD_HOST_MIN_INTERVAL seconds apart, whatever the number of download workers.
+    """
+    host = urlparse(url).netloc.lower()
+    with _host_rate_lock:
+        now = time.monotonic()
+        slot = max(now, _host_last_request.get(host, 0.0) + DOWNLOAD_HOST_MIN_INTERVAL)
+        _host_last_request[host] = slot
+    delay = slot - now
+    if delay > 0:
+        time.sleep(delay)
+
+def download_video_segment_with_retry(url: str, output_path: str, start_time: float, end_time: float,
+                                      retries: int = DOWNLOAD_RETRIES, backoff: float = DOWNLOAD_RETRY_BACKOFF):
+    """
+    Downloads a segment with per-host rate limiting and exponential backoff between attempts.
+    Returns (output_path, in_point) like download_video_segment.
+    """
+    attempts = max(1, retries)
+    for attempt in range(1, attempts + 1):
+        _wait_for_host_slot(url)
+        try:
+            return download_video_segment(url, output_path, start_time, end_time)
+        except Exception as e:
+            if os.path.exists(str(output_path)):
+                os.remove(str(output_path))
+            if attempt == attempts:
+                raise
+            delay = backoff * (2 ** (attempt - 1)) + random.uniform(0, backoff)
+            logger.warning(f"Segment download {start_time}-{end_time} failed (attempt {attempt}/{attempts}): {e}. Retrying in {delay:.1f}s.")
+            time.sleep(delay)
@@ -1,7 +1,23 @@
+import os
+import json
+import hashlib
+import logging
 import cv2
 import numpy as np
 from moviepy.editor import vfx
-from config import HAARCASCADE_FRONTALFACE_DEFAULT, HAARCASCADE_PROFILEFACE
+from config import HAARCASCADE_FRONTALFACE_DEFAULT, HAARCASCADE_PROFILEFACE, FACE_DETECTOR_MODEL
+from config import FACE_TRACK_CACHE_DIR, FACE_TRACK_CACHE_MAX_FILES
+
+logger = logging.getLogger(__name__)
+
+PROCESSING_FPS = 15              # частота точек траектории кропа
+ANALYSIS_WIDTH = 640             # ширина кадра для детекции/трекинга
+DETECT_REFRESH_SEC = 2.0         # внутри сцены при живом трекере детектор только подстраховывает
+NO_FACE_RETRY_SEC = 0.5          # пока лица нет, детектор пробуем с этим интервалом
+SCENE_CUT_THRESHOLD = 0.45       # расстояние Бхаттачарьи между HS-гистограммами соседних сэмплов
+TRACK_MIN_SCORE = 0.6            # ниже - трекер потерял лицо, нужен детектор
+MIN_FACE_HEIGHT_FRACTION = 0.1  # минимальный размер лица относительно высоты кадра
+FACE_TRACK_VERSION = 2           # поднять при изменении детекции, чтобы не брать старые треки из кэша
 
 def get_box_center(box):
     x, y, w, h = box
@@ -10,44 +26,188 @@ def get_box_center(box):
 def distance(p1, p2):
     return ((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2)**0.5
 
-def create_face_tracked_clip(main_clip_raw, target_height, target_width):
-    import cv2
-    import numpy as np
-    from moviepy.editor import vfx
-
-    main_clip_resized = main_clip_raw.resize(height=target_height)
-    
-    if main_clip_resized.w <= target_width:
-        return main_clip_resized
-
-    try:
-        face_cascade = cv2.CascadeClassifier(HAARCASCADE_FRONTALFACE_DEFAULT)
-        profile_cascade = cv2.CascadeClassifier(HAARCASCADE_PROFILEFACE)
-    except Exception as e:
-        print(f"Could not load face cascade model(s): {e}. Falling back to center crop.")
-        return main_clip_resized.fx(vfx.crop, x_center=main_clip_resized.w / 2, width=target_width)
-
-    processing_fps = 15
-    timestamps = np.arange(0, main_clip_resized.duration, 1/processing_fps)
-    face_boxes = []
-    tracked_face_box = None
-
-    for t in timestamps:
-        frame = main_clip_resized.get_frame(t)
-        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-
-        faces_frontal = face_cascade.detectMultiScale(gray, 1.1, 8, minSize=(100, 100))
-        faces_profile = profile_cascade.detectMultiScale(gray, 1.1, 8, minSize=(100, 100))
-
-        gray_flipped = cv2.flip(gray, 1)
-        faces_profile_flipped = profile_cascade.detectMultiScale(gray_flipped, 1.1, 8, minSize=(100, 100))
 
+class _FaceDetector:
+    """
+    YuNet (cv2.FaceDetectorYN) when the model file is present, otherwise the Haar cascades.
+    Works on downscaled BGR frames and returns (x, y, w, h) boxes in frame coordinates.
+    """
+
+    def __init__(self, min_face_size):
+        self.min_face_size = max(8, int(min_face_size))
+        self.yunet = None
+        self._yunet_size = None
+        if FACE_DETECTOR_MODEL and os.path.exists(FACE_DETECTOR_MODEL) and hasattr(cv2, "FaceDetectorYN"):
+            try:
+                self.yunet = cv2.FaceDetectorYN.create(FACE_DETECTOR_MODEL, "", (320, 320), 0.6, 0.3, 50)
+            except cv2.error as e:
+                logger.warning(f"Could not load YuNet model {FACE_DETECTOR_MODEL}: {e}. Using Haar cascades.")
+        if self.yunet is None:
+            self.face_cascade = cv2.CascadeClassifier(HAARCASCADE_FRONTALFACE_DEFAULT)
+            self.profile_cascade = cv2.CascadeClassifier(HAARCASCADE_PROFILEFACE)
+            if self.face_cascade.empty() or self.profile_cascade.empty():
+                raise RuntimeError("Haar cascade files could not be loaded")
+
+    def detect(self, frame_bgr, gray):
+        if self.yunet is not None:
+            h, w = frame_bgr.shape[:2]
+            if self._yunet_size != (w, h):
+                self.yunet.setInputSize((w, h))
+                self._yunet_size = (w, h)
+            _, faces = self.yunet.detect(frame_bgr)
+            if faces is None:
+                return []
+            return [tuple(f[:4]) for f in faces if f[2] >= self.min_face_size and f[3] >= self.min_face_size]
+
+        min_size = (self.min_face_size, self.min_face_size)
         all_faces = []
-        if len(faces_frontal) > 0: all_faces.extend(faces_frontal)
-        if len(faces_profile) > 0: all_faces.extend(faces_profile)
-        if len(faces_profile_flipped) > 0:
-            for (x, y, w, h) in faces_profile_flipped:
-                all_faces.append((gray.shape[1] - x - w, y, w, h))
+        all_faces.extend(self.face_cascade.detectMultiScale(gray, 1.1, 8, minSize=min_size))
+        all_faces.extend(self.profile_cascade.detectMultiScale(gray, 1.1, 8, minSize=min_size))
+        gray_flipped = cv2.flip(gray, 1)
+        for (x, y, w, h) in self.profile_cascade.detectMultiScale(gray_flipped, 1.1, 8, minSize=min_size):
+            all_faces.append((gray.shape[1] - x - w, y, w, h))
+        return [tuple(f) for f in all_faces]
+
+
+class _TemplateTracker:
+    """Cheap box propagation between detections: template matching in a window around the last box."""
+
+    def __init__(self, gray, box):
+        self.update_template(gray, box)
+
+    def update_template(self, gray, box):
+        x, y, w, h = [int(round(v)) for v in box]
+        fh, fw = gray.shape[:2]
+        x, y = max(0, x), max(0, y)
+        w, h = max(1, min(w, fw - x)), max(1, min(h, fh - y))
+        self.box = (x, y, w, h)
+        self.template = gray[y:y + h, x:x + w].copy()
+
+    def track(self, gray):
+        """Returns the new box or None when the face was lost."""
+        x, y, w, h = self.box
+        fh, fw = gray.shape[:2]
+        pad_x, pad_y = w, h
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1, y1 = min(fw, x + w + pad_x), min(fh, y + h + pad_y)
+        window = gray[y0:y1, x0:x1]
+        if window.shape[0] < h or window.shape[1] < w or self.template.size == 0:
+            return None
+        result = cv2.matchTemplate(window, self.template, cv2.TM_CCOEFF_NORMED)
+        _, score, _, loc = cv2.minMaxLoc(result)
+        if score < TRACK_MIN_SCORE:
+            return None
+        self.box = (x0 + loc[0], y0 + loc[1], w, h)
+        return self.box
+
+
+def _iter_analysis_frames(main_clip_raw, source_path, source_offset, duration):
+    """
+    Yields (t, frame_bgr) at PROCESSING_FPS for t in [0, duration), downscaled to ANALYSIS_WIDTH.
+    Uses one sequential OpenCV reader over source_path; without a readable source it falls
+    back to moviepy get_frame.
+    """
+    step = 1.0 / PROCESSING_FPS
+    cap = cv2.VideoCapture(str(source_path)) if source_path else None
+    if cap is not None and cap.isOpened():
+        try:
+            next_t = 0.0
+            while next_t < duration:
+                if not cap.grab():
+                    break
+                t = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 - source_offset
+                if t + 1e-3 < next_t:
+                    continue  # пропускаем кадры без декодирования в BGR
+                ok, frame = cap.retrieve()
+                if not ok:
+                    break
+                yield next_t, _downscale(frame)
+                while next_t <= t + 1e-3:
+                    next_t += step
+            return
+        finally:
+            cap.release()
+
+    if source_path:
+        logger.warning(f"OpenCV could not read {source_path}, reading frames through moviepy.")
+    for t in np.arange(0, duration, step):
+        frame = cv2.cvtColor(main_clip_raw.get_frame(t), cv2.COLOR_RGB2BGR)
+        yield t, _downscale(frame)
+
+
+def _downscale(frame):
+    h, w = frame.shape[:2]
+    if w <= ANALYSIS_WIDTH:
+        return frame
+    return cv2.resize(frame, (ANALYSIS_WIDTH, int(round(h * ANALYSIS_WIDTH / w))), interpolation=cv2.INTER_AREA)
+
+
+class _SceneCutDetector:
+    """
+    Scene boundaries from hue/saturation histograms of downscaled frames.
+    Camera switches change the colour distribution at once, while talking,
+    gestures and slow pans barely move it.
+    """
+
+    def __init__(self, threshold=SCENE_CUT_THRESHOLD):
+        self.threshold = threshold
+        self._prev_hist = None
+
+    def is_cut(self, frame_bgr) -> bool:
+        small = cv2.resize(frame_bgr, (64, 36), interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        hist = cv2.calcHist([hsv], [0, 1], None, [16, 16], [0, 180, 0, 256])
+        cv2.normalize(hist, hist, 1.0, 0.0, cv2.NORM_L1)
+        prev, self._prev_hist = self._prev_hist, hist
+        if prev is None:
+            return False
+        return cv2.compareHist(prev, hist, cv2.HISTCMP_BHATTACHARYYA) > self.threshold
+
+
+def compute_face_track(main_clip_raw, source_path, source_offset, duration):
+    """
+    Runs detection and tracking over the clip. Returns the raw track in normalized
+    coordinates: {'timestamps': [...], 'boxes': [[x, y, w, h] as fractions of the frame, or None],
+    'hard_cuts': [...]}. The track does not depend on the layout or the output size.
+    """
+    detector = None
+    frame_w = frame_h = None
+    timestamps = []
+    boxes = []
+    hard_cuts = []
+    tracked_face_box = None
+    tracker = None
+    last_detect_t = None
+    scene_cuts = _SceneCutDetector()
+
+    for t, frame in _iter_analysis_frames(main_clip_raw, source_path, source_offset, duration):
+        if detector is None:
+            frame_h, frame_w = frame.shape[:2]
+            detector = _FaceDetector(MIN_FACE_HEIGHT_FRACTION * frame_h)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+        scene_cut = scene_cuts.is_cut(frame)
+        if scene_cut:
+            # Новая сцена: старый трек и бокс недействительны, путь кропа начинается заново
+            tracker = None
+            tracked_face_box = None
+
+        tracked = tracker.track(gray) if tracker is not None else None
+        # Детектор: на смене сцены, при потере трека, изредка для подстраховки
+        # и чаще, пока в сцене не найдено лицо
+        if last_detect_t is None or scene_cut:
+            need_detection = True
+        elif tracker is not None:
+            need_detection = tracked is None or t - last_detect_t >= DETECT_REFRESH_SEC
+        else:
+            need_detection = t - last_detect_t >= NO_FACE_RETRY_SEC
+        if need_detection:
+            all_faces = detector.detect(frame, gray)
+            last_detect_t = t
+        elif tracked is not None:
+            all_faces = [tracked]
+        else:
+            all_faces = []
 
         faces = np.array(all_faces)
 
@@ -102,7 +262,94 @@ def create_face_tracked_clip(main_clip_raw, target_height, target_width):
             tracked_face_box = sorted(faces, key=lambda f: f[2] * f[3], reverse=True)[0]
             current_face_box = tracked_face_box
 
-        face_boxes.append((current_face_box, is_hard_cut))
+        if current_face_box is not None:
+            if tracker is None:
+                tracker = _TemplateTracker(gray, current_face_box)
+            elif need_detection:
+                tracker.update_template(gray, current_face_box)
+        else:
+            tracker = None
+
+        timestamps.append(float(t))
+        boxes.append(None if current_face_box is None else [
+            float(current_face_box[0]) / frame_w, float(current_face_box[1]) / frame_h,
+            float(current_face_box[2]) / frame_w, float(current_face_box[3]) / frame_h,
+        ])
+        hard_cuts.append(bool(is_hard_cut))
+
+    return {'timestamps': timestamps, 'boxes': boxes, 'hard_cuts': hard_cuts}
+
+
+def _face_track_cache_path(track_key):
+    digest = hashlib.sha256(f"{track_key}|v{FACE_TRACK_VERSION}".encode('utf-8')).hexdigest()
+    return os.path.join(FACE_TRACK_CACHE_DIR, f"{digest}.json")
+
+
+def load_face_track(track_key):
+    """Returns a cached raw track for (video id, start, end) or None."""
+    if not track_key:
+        return None
+    path = _face_track_cache_path(track_key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            track = json.load(f)
+        os.utime(path)  # для LRU-очистки по времени доступа
+        return track
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read face track cache {path}: {e}")
+        return None
+
+
+def store_face_track(track_key, track):
+    """Saves a raw track atomically and drops the oldest files over FACE_TRACK_CACHE_MAX_FILES."""
+    if not track_key:
+        return
+    path = _face_track_cache_path(track_key)
+    try:
+        os.makedirs(FACE_TRACK_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(track, f)
+        os.replace(tmp_path, path)
+
+        entries = [e for e in os.scandir(FACE_TRACK_CACHE_DIR) if e.name.endswith('.json')]
+        if len(entries) > FACE_TRACK_CACHE_MAX_FILES:
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for entry in entries[:len(entries) - FACE_TRACK_CACHE_MAX_FILES]:
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+    except OSError as e:
+        logger.warning(f"Could not write face track cache {path}: {e}")
+
+
+def get_face_track(track_key, source_path=None, source_offset=0.0, duration=None, main_clip_raw=None):
+    """Returns the raw track from the cache, or computes it and caches non-empty results."""
+    track = load_face_track(track_key)
+    if track is not None:
+        logger.info(f"Face track for {track_key} loaded from cache.")
+        return track
+    track = compute_face_track(main_clip_raw, source_path, source_offset, duration)
+    if track['timestamps']:
+        store_face_track(track_key, track)
+    return track
+
+
+def compute_crop_path(track, frame_width, frame_height, target_width):
+    """
+    Turns a raw normalized track into a smoothed crop center per track timestamp, in pixels
+    of a frame_width x frame_height frame. Returns (timestamps, centers) or None if no face was found.
+    """
+    # Нормализованные боксы -> координаты отресайженного клипа
+    timestamps = np.array(track['timestamps'])
+    scale_x, scale_y = frame_width, frame_height
+    face_boxes = [
+        ((None if box is None else (box[0] * scale_x, box[1] * scale_y, box[2] * scale_x, box[3] * scale_y)), hard_cut)
+        for box, hard_cut in zip(track['boxes'], track['hard_cuts'])
+    ]
 
     # -------------------------------
     # Дальше всё как в твоём оригинальном коде
@@ -119,8 +366,7 @@ def create_face_tracked_clip(main_clip_raw, target_height, target_width):
             interp_face_boxes.append((last_known_box, False))
     
     if not any(b[0] is not None for b in interp_face_boxes):
-        print("No faces found in the clip. Falling back to center crop.")
-        return main_clip_resized.fx(vfx.crop, x_center=main_clip_resized.w / 2, width=target_width)
+        return None
     
     first_valid_box_index = -1
     for i, (box, _) in enumerate(interp_face_boxes):
@@ -136,8 +382,8 @@ def create_face_tracked_clip(main_clip_raw, target_height, target_width):
     # Smooth crop path
     crop_path_x = []
     crop_half_width = target_width / 2
-    crop_x_center = main_clip_resized.w / 2
-    target_crop_x_center = main_clip_resized.w / 2
+    crop_x_center = frame_width / 2
+    target_crop_x_center = frame_width / 2
     smoothing_factor = 0.2
 
     for box, is_hard_cut in interp_face_boxes:
@@ -164,8 +410,54 @@ def create_face_tracked_clip(main_clip_raw, target_height, target_width):
         crop_path_x.append(crop_x_center)
 
     min_x = crop_half_width
-    max_x = main_clip_resized.w - crop_half_width
-    final_smoothed_x = np.clip(crop_path_x, min_x, max_x)
+    max_x = frame_width - crop_half_width
+    return timestamps, np.clip(crop_path_x, min_x, max_x)
+
+
+def write_crop_sendcmd(timestamps, centers, frame_width, target_width, duration, fps, cmd_path, target='crop'):
+    """
+    Writes the crop path as an ffmpeg sendcmd script: one `x` command for the `target` crop filter
+    per output frame, interpolated the same way as the moviepy path. Lines are only emitted when
+    x changes. Returns the x of the first frame (the crop filter's initial value).
+    """
+    frame_times = np.arange(0.0, max(duration, 0.0) + 1.0 / fps, 1.0 / fps)
+    xs = np.interp(frame_times, timestamps, centers) - target_width / 2
+    xs = np.clip(np.round(xs), 0, max(0, frame_width - target_width)).astype(int)
+
+    lines = []
+    previous_x = None
+    for t, x in zip(frame_times, xs):
+        if x != previous_x:
+            lines.append(f"{t:.3f} {target} x {x};")
+            previous_x = x
+    with open(cmd_path, 'w', encoding='utf-8') as f:
+        f.write("\n".join(lines) + "\n")
+    return int(xs[0])
+
+
+def create_face_tracked_clip(main_clip_raw, target_height, target_width, source_path=None, source_offset=0.0, track_key=None):
+    """
+    Crops main_clip_raw to target_width following the speaker's face.
+    source_path/source_offset point at the file (and the time in it) main_clip_raw starts at,
+    so frames for analysis are decoded by a single sequential OpenCV reader.
+    track_key ("video_id|start|end") enables the on-disk track cache shared by all layouts.
+    """
+    main_clip_resized = main_clip_raw.resize(height=target_height)
+    
+    if main_clip_resized.w <= target_width:
+        return main_clip_resized
+
+    try:
+        track = get_face_track(track_key, source_path, source_offset, main_clip_resized.duration, main_clip_raw)
+    except Exception as e:
+        logger.warning(f"Face tracking failed: {e}. Falling back to center crop.")
+        return main_clip_resized.fx(vfx.crop, x_center=main_clip_resized.w / 2, width=target_width)
+
+    crop_path = compute_crop_path(track, main_clip_resized.w, main_clip_resized.h, target_width)
+    if crop_path is None:
+        logger.warning("No faces found in the clip. Falling back to center crop.")
+        return main_clip_resized.fx(vfx.crop, x_center=main_clip_resized.w / 2, width=target_width)
+    timestamps, final_smoothed_x = crop_path
 
     def get_crop_x(t):
         return np.interp(t, timestamps, final_smoothed_x)
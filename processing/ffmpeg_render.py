@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import random
+import logging
+import subprocess
+from typing import Dict, Any, List, Tuple
+
+from .backgrounds import pick_background_chunks, write_concat_list
+from .assets import get_asset_manager
+
+logger = logging.getLogger(__name__)
+
+FONTS_DIR = "fonts"
+OUTPUT_FPS = 24
+SHORTS_FACTORY_BANNER_PATH = 'banner.png'
+GETCOURSE_BANNER_PATH = 'getcourse_banner_encoded.mp4'
+
+# Layouts where face tracking replaces the static center crop
+FACE_TRACKING_LAYOUTS = ('square_top_brainrot_bottom', 'face_track_9_16', 'square_center')
+# Имя экземпляра crop, которому sendcmd шлёт новые x
+FACE_CROP_FILTER = 'crop@face'
+
+
+def probe_video(path) -> Tuple[int, int, float]:
+    """
+    Returns (width, height, duration) of the first video stream using ffprobe.
+    """
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "stream=width,height:format=duration",
+        "-of", "json",
+        str(path)
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True, timeout=60)
+    info = json.loads(result.stdout)
+    stream = info["streams"][0]
+    duration = float(info.get("format", {}).get("duration") or 0.0)
+    return int(stream["width"]), int(stream["height"]), duration
+
+
+def _even(value: float) -> int:
+    value = int(round(value))
+    return value - (value % 2)
+
+
+def compute_layout_geometry(config, src_width, src_height, final_width, final_height) -> Dict[str, Any]:
+    """
+    Mirrors the sizes used by layouts._build_video_canvas so that subtitles
+    end up in the same place for both render engines.
+    """
+    layout = config.get('layout', 'square_center')
+
+    if layout == 'square_top_brainrot_bottom':
+        video_height = int(final_height * 0.6)
+        return {
+            'layout': layout,
+            'video_height': video_height,
+            'bottom_height': final_height - video_height,
+            'subtitle_y_pos': video_height - 60,
+            'subtitle_width': final_width - 40,
+        }
+
+    if layout == 'full_top_brainrot_bottom':
+        container_height = final_height // 2
+        main_height = _even(src_height * final_width / src_width)
+        return {
+            'layout': layout,
+            'video_height': main_height,
+            'bottom_height': final_height - container_height,
+            'container_height': container_height,
+            'subtitle_y_pos': container_height - 60,
+            'subtitle_width': final_width - 40,
+        }
+
+    if layout == 'full_center':
+        main_height = _even(src_height * final_width / src_width)
+        return {
+            'layout': layout,
+            'video_height': main_height,
+            'subtitle_y_pos': (final_height + main_height) / 2 + 20,
+            'subtitle_width': final_width - 40,
+        }
+
+    if layout == 'face_track_9_16':
+        return {
+            'layout': layout,
+            'video_height': final_height,
+            'subtitle_y_pos': final_height * 0.75,
+            'subtitle_width': final_width - 40,
+        }
+
+    # square_center
+    video_height = int(final_height * 0.7)
+    scaled_width = _even(src_width * video_height / src_height)
+    return {
+        'layout': 'square_center',
+        'video_height': video_height,
+        'subtitle_y_pos': final_height * 0.75,
+        'subtitle_width': min(scaled_width, final_width) - 40,
+    }
+
+
+def _face_region_height(geometry, final_height) -> int:
+    if geometry['layout'] == 'face_track_9_16':
+        return final_height
+    return geometry['video_height']
+
+
+def prepare_face_crop(config, geometry, segment_video_path, src_width, src_height,
+                      final_width, final_height, duration, cmd_path, in_point=0.0, track_key=None):
+    """
+    Computes (or loads from the track cache) the face crop path and writes it as a sendcmd
+    script, so the dynamic crop runs inside ffmpeg. On success adds geometry['face_crop'];
+    on failure leaves the geometry as is and the layout falls back to the center crop.
+    """
+    layout = geometry['layout']
+    if not config.get('use_face_tracking', False) or layout not in FACE_TRACKING_LAYOUTS:
+        return geometry
+    region_height = _face_region_height(geometry, final_height)
+    scaled_width = _even(src_width * region_height / src_height)
+    if scaled_width <= final_width:
+        return geometry
+
+    # Импорт здесь: OpenCV нужен только для лейаутов с трекингом
+    from .face_tracker import get_face_track, compute_crop_path, write_crop_sendcmd
+    try:
+        track = get_face_track(track_key, segment_video_path, in_point, duration)
+        crop_path = compute_crop_path(track, scaled_width, region_height, final_width)
+    except Exception as e:
+        logger.warning(f"Face tracking failed: {e}. Falling back to center crop.")
+        return geometry
+    if crop_path is None:
+        logger.info("No faces found in the clip. Falling back to center crop.")
+        return geometry
+
+    timestamps, centers = crop_path
+    first_x = write_crop_sendcmd(timestamps, centers, scaled_width, final_width, duration,
+                                 OUTPUT_FPS, cmd_path, target=FACE_CROP_FILTER)
+    geometry['face_crop'] = {'cmd_path': str(cmd_path), 'scaled_width': scaled_width, 'x': first_x}
+    return geometry
+
+
+def _escape_filter_value(value: str) -> str:
+    """Escapes a path for use as an option value inside a filtergraph."""
+    return str(value).replace('\\', '/').replace(':', '\\:').replace("'", "\\'")
+
+
+def _scale_and_center_crop(in_label, out_label, width, height) -> str:
+    return (
+        f"[{in_label}]scale=-2:{height},"
+        f"crop='min(iw,{width})':{height},"
+        f"pad={width}:{height}:(ow-iw)/2:0,setsar=1[{out_label}]"
+    )
+
+
+def _main_video_filter(geometry, out_label, width, height) -> str:
+    """Face-tracked crop driven by a sendcmd script when available, otherwise the center crop."""
+    face_crop = geometry.get('face_crop')
+    if not face_crop:
+        return _scale_and_center_crop("0:v", out_label, width, height)
+    return (
+        f"[0:v]scale={face_crop['scaled_width']}:{height},setsar=1,"
+        f"sendcmd=f='{_escape_filter_value(face_crop['cmd_path'])}',"
+        f"{FACE_CROP_FILTER}={width}:{height}:{face_crop['x']}:0[{out_label}]"
+    )
+
+
+def _bottom_filter(bottom_input, out_label, width, height, duration) -> str:
+    if bottom_input is None:
+        return f"color=c=black:s={width}x{height}:r={OUTPUT_FPS}:d={duration:.3f}[{out_label}]"
+    return _scale_and_center_crop(f"{bottom_input}:v", out_label, width, height)
+
+
+def build_filter_graph(config, geometry, final_width, final_height, duration,
+                       bottom_input=None, banner_input=None, ass_path=None) -> str:
+    """
+    Builds a single filter_complex that produces the final [vout] stream:
+    layout (crop/scale/stack/pad) -> banner overlay -> ASS subtitles.
+    """
+    layout = geometry['layout']
+    filters: List[str] = []
+
+    if layout == 'square_top_brainrot_bottom':
+        filters.append(_main_video_filter(geometry, "top", final_width, geometry['video_height']))
+        filters.append(_bottom_filter(bottom_input, "bottom", final_width, geometry['bottom_height'], duration))
+        filters.append("[top][bottom]vstack=inputs=2[base]")
+
+    elif layout == 'full_top_brainrot_bottom':
+        filters.append(f"color=c=black:s={final_width}x{final_height}:r={OUTPUT_FPS}:d={duration:.3f}[bg]")
+        filters.append(f"[0:v]scale={final_width}:-2,setsar=1[main]")
+        filters.append(f"[bg][main]overlay=x=(W-w)/2:y={geometry['container_height']}-h[top]")
+        filters.append(_bottom_filter(bottom_input, "bottom", final_width, geometry['bottom_height'], duration))
+        filters.append("[top][bottom]overlay=x=(W-w)/2:y=H-h[base]")
+
+    elif layout == 'full_center':
+        filters.append(f"color=c=black:s={final_width}x{final_height}:r={OUTPUT_FPS}:d={duration:.3f}[bg]")
+        filters.append(f"[0:v]scale={final_width}:-2,setsar=1[main]")
+        filters.append("[bg][main]overlay=x=(W-w)/2:y=(H-h)/2[base]")
+
+    elif layout == 'face_track_9_16':
+        filters.append(_main_video_filter(geometry, "base", final_width, final_height))
+
+    else:  # square_center
+        filters.append(_main_video_filter(geometry, "main", final_width, geometry['video_height']))
+        filters.append(f"[main]pad={final_width}:{final_height}:0:(oh-ih)/2:color=black[base]")
+
+    current = "base"
+    if banner_input is not None:
+        # Баннер уже уменьшен AssetManager.prepared_banner, scale тогда ничего не пересчитывает
+        filters.append(f"[{banner_input}:v]scale={_banner_width(config, final_width)}:-2[banner]")
+        filters.append(f"[{current}][banner]overlay=x=(W-w)/2:y={int(final_height * 0.1)}:shortest=1[branded]")
+        current = "branded"
+
+    tail = []
+    if ass_path:
+        tail.append(f"subtitles=filename='{_escape_filter_value(ass_path)}':fontsdir='{_escape_filter_value(FONTS_DIR)}'")
+    tail.append(f"fps={OUTPUT_FPS}")
+    tail.append("format=yuv420p")
+    filters.append(f"[{current}]" + ",".join(tail) + "[vout]")
+
+    return ";".join(filters)
+
+
+def _banner_width(config, final_width) -> int:
+    return _even(final_width * (0.4 if config.get('add_banner') == 'shorts_factory_banner' else 0.5))
+
+
+def _banner_input_args(config, final_width) -> List[str]:
+    banner_type = config.get('add_banner')
+    if banner_type == 'shorts_factory_banner':
+        if os.path.exists(SHORTS_FACTORY_BANNER_PATH):
+            banner_path = get_asset_manager().prepared_banner(SHORTS_FACTORY_BANNER_PATH, _banner_width(config, final_width))
+            return ["-loop", "1", "-i", banner_path]
+        logger.warning(f"Banner file not found at {SHORTS_FACTORY_BANNER_PATH}")
+    elif banner_type == 'getcourse_banner':
+        if os.path.exists(GETCOURSE_BANNER_PATH):
+            banner_path = get_asset_manager().prepared_banner(GETCOURSE_BANNER_PATH, _banner_width(config, final_width))
+            return ["-stream_loop", "-1", "-i", banner_path]
+        logger.warning(f"Banner file not found at {GETCOURSE_BANNER_PATH}")
+    return []
+
+
+def _bottom_input_args(config, width, height, duration, concat_list_path) -> List[str]:
+    """
+    Prefers a random run of pre-sized chunks from the background library (concat demuxer,
+    no full-resolution decode); falls back to seeking in the original keeper video.
+    """
+    chunk_paths = pick_background_chunks(config.get('bottom_video'), width, height, duration)
+    if chunk_paths:
+        write_concat_list(chunk_paths, concat_list_path)
+        return ["-f", "concat", "-safe", "0", "-t", f"{duration:.3f}", "-an", "-i", str(concat_list_path)]
+
+    bottom_video_path = config.get('bottom_video_path')
+    if not bottom_video_path or not os.path.exists(str(bottom_video_path)):
+        if bottom_video_path:
+            logger.warning(f"Background video not found at {bottom_video_path}, using black background.")
+        return []
+    bottom_duration = get_asset_manager().media_duration(bottom_video_path)
+    if bottom_duration > duration:
+        random_start = random.uniform(0, bottom_duration - duration)
+        return ["-ss", f"{random_start:.3f}", "-t", f"{duration:.3f}", "-an", "-i", str(bottom_video_path)]
+    return ["-stream_loop", "-1", "-t", f"{duration:.3f}", "-an", "-i", str(bottom_video_path)]
+
+
+def render_clip_ffmpeg(config, segment_video_path, output_path, geometry,
+                       final_width, final_height, duration, ass_path=None, in_point=0.0):
+    """
+    Renders a finished short with one ffmpeg invocation and a single libx264 encode.
+    in_point trims a stream-copied segment (which starts at a keyframe) to the exact clip start;
+    input seeking decodes from the keyframe and drops frames before in_point.
+    """
+    layout = geometry['layout']
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+    if in_point > 0:
+        cmd += ["-ss", f"{in_point:.3f}"]
+    cmd += ["-t", f"{duration:.3f}", "-i", str(segment_video_path)]
+    next_input = 1
+
+    bottom_input = None
+    concat_list_path = f"{output_path}.bg.txt"
+    if layout in ('square_top_brainrot_bottom', 'full_top_brainrot_bottom'):
+        bottom_args = _bottom_input_args(config, final_width, geometry['bottom_height'], duration, concat_list_path)
+        if bottom_args:
+            cmd += bottom_args
+            bottom_input = next_input
+            next_input += 1
+
+    banner_input = None
+    banner_args = _banner_input_args(config, final_width)
+    if banner_args:
+        cmd += banner_args
+        banner_input = next_input
+        next_input += 1
+
+    filter_graph = build_filter_graph(
+        config, geometry, final_width, final_height, duration,
+        bottom_input=bottom_input, banner_input=banner_input, ass_path=ass_path
+    )
+
+    cmd += [
+        "-filter_complex", filter_graph,
+        "-map", "[vout]", "-map", "0:a?",
+        "-c:v", "libx264", "-preset", "medium", "-crf", "23",
+        "-c:a", "aac", "-b:a", "192k",
+        "-movflags", "+faststart",
+        "-t", f"{duration:.3f}",
+        str(output_path)
+    ]
+
+    logger.info(f"Rendering {output_path} with a single ffmpeg pass ({layout}).")
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+    finally:
+        if os.path.exists(concat_list_path):
+            os.remove(concat_list_path)
+    return output_path
@@ -3,19 +3,39 @@
 import os
 import re
 import json
-import time
 import logging
 import random
 import math
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from config import OPENAI_API_KEY, MAX_SHORTS_PER_VIDEO, MIN_SHORT_DURATION, MAX_SHORT_DURATION
+from config import GPT_HIGHLIGHTS_MODEL, GPT_INLINE_MAX_CHARS, GPT_CHUNK_DURATION, GPT_CHUNK_WORKERS
 from utils import format_seconds_to_hhmmss
 
 client = OpenAI(api_key=OPENAI_API_KEY)
 logger = logging.getLogger(__name__)
 
 
-def gpt_gpt_prompt(shorts_number, video_duration_seconds=None):
+def _openai_complete(prompt: str) -> str:
+    resp = client.responses.create(
+        model=GPT_HIGHLIGHTS_MODEL,
+        input=[{"role": "user", "content": prompt}],
+    )
+    return _response_text(resp)
+
+# Функция prompt -> текст ответа. Подменяется через set_highlights_client (например, локальной заглушкой)
+_complete = _openai_complete
+
+def set_highlights_client(complete_fn=None):
+    """
+    Replaces the model call used for highlight selection: complete_fn(prompt) -> response text.
+    None restores the OpenAI client.
+    """
+    global _complete
+    _complete = complete_fn or _openai_complete
+
+
+def gpt_gpt_prompt(shorts_number, video_duration_seconds=None, transcript_text="", chunk_range=None):
     duration_str = ""
     if video_duration_seconds:
         duration_str = format_seconds_to_hhmmss(video_duration_seconds)
@@ -50,6 +70,9 @@ def gpt_gpt_prompt(shorts_number, video_duration_seconds=None):
 Твоя задача — из транскрипта длинного видео (шоу, интервью, подкаст, стрим) выбрать максимально виральные, эмоциональные и самодостаточные фрагменты, которые могут набрать миллионы просмотров.
 {'Видео длится ' + duration_str if duration_str else ''}
 ''')
+    if chunk_range:
+        prompt += (f"Ниже только часть транскрипта: с {format_seconds_to_hhmmss(chunk_range[0])} "
+                   f"по {format_seconds_to_hhmmss(chunk_range[1])}. Выбирай фрагменты только внутри неё.\n")
     
     if shorts_number != 'auto':
         prompt += f"Найди ровно {shorts_number} самых подходящих фрагментов под эти критерии.\n\n"
@@ -84,7 +107,7 @@ def gpt_gpt_prompt(shorts_number, video_duration_seconds=None):
 Практическая ценность — советы, лайфхаки, правила успеха.
 Сжатость — зритель должен понять суть за первые 3 секунды ролика.
 
-Файл с транскриптом приложен. Формат строк в файле: `ss.s --> ss.s` + реплика.
+Транскрипт приведён в конце сообщения. Формат строк: `ss.s-ss.s реплика` (начало и конец в секундах).
 Для каждого фрагмента определи "оценку виральности" (virality_score) по шкале от 1 до 10, где 10 — это максимальный потенциал стать вирусным.
 
 Ответ — СТРОГО JSON-массив:
@@ -95,8 +118,132 @@ def gpt_gpt_prompt(shorts_number, video_duration_seconds=None):
 Убедись, что каждый клип дольше 20 секунд.
 ВЫВЕДИ ТОЛЬКО JSON.
 ''')
+    if transcript_text:
+        prompt += "\nТРАНСКРИПТ:\n" + transcript_text
     return prompt
 
+
+def gpt_rank_prompt(candidates, shorts_number):
+    """Финальный проход map-reduce: выбрать лучшие из кандидатов, найденных по частям."""
+    lines = []
+    for idx, c in enumerate(candidates):
+        lines.append(f"{idx}. {c['start']:.1f}-{c['end']:.1f} | virality {c.get('virality_score', 5)} | "
+                     f"{c.get('hook', '')} | {c.get('excerpt', '')}")
+    return (f'''
+ТЫ РАБОТАЕШЬ В РЕЖИМЕ STRICT-JSON. ВЫВЕДИ ТОЛЬКО JSON-МАССИВ.
+
+Ты — редактор коротких видео. Ниже кандидаты в клипы, найденные в разных частях одного длинного видео
+(номер, начало-конец в секундах, оценка виральности, заголовок, начало реплики).
+Выбери {shorts_number} самых виральных и самодостаточных, не пересекающихся по времени.
+Можешь поправить virality_score, чтобы оценки были сравнимы между частями.
+
+Ответ — СТРОГО JSON-массив:
+[{{"id":0,"virality_score":9}}]
+
+КАНДИДАТЫ:
+''' + "\n".join(lines))
+
+
+def _compact_transcript(segments) -> str:
+    """Транскрипт одной строкой на реплику: `ss.s-ss.s текст`."""
+    return "\n".join(f"{seg['start']:.1f}-{seg['end']:.1f} {seg['text']}" for seg in segments)
+
+
+def _auto_shorts_count(duration: float) -> int:
+    """То же правило, что в промпте для режима 'auto'."""
+    minutes = duration / 60.0
+    if minutes < 10: return 3
+    if minutes < 20: return 5
+    if minutes < 40: return 8
+    if minutes < 70: return 10
+    return MAX_SHORTS_PER_VIDEO - 1
+
+
+def _chunk_segments(segments, chunk_duration: float):
+    """Режет транскрипт на окна по времени (реплика целиком попадает в окно своего начала)."""
+    chunks = []
+    current = []
+    chunk_start = None
+    for seg in segments:
+        if chunk_start is None:
+            chunk_start = seg['start']
+        if current and seg['start'] - chunk_start >= chunk_duration:
+            chunks.append(current)
+            current = []
+            chunk_start = seg['start']
+        current.append(seg)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _ask_for_highlights(prompt: str):
+    raw = _complete(prompt)
+    data = json.loads(_extract_json_array(raw))
+    if not data:
+        raise ValueError("GPT вернул пустой JSON-массив.")
+    return data
+
+
+def _select_highlights_chunked(caption_segments, audio_duration: float, shorts_number):
+    """
+    Map: каждое окно транскрипта оценивается отдельно и параллельно.
+    Reduce: финальный проход ранжирует кандидатов всех окон.
+    """
+    target = _auto_shorts_count(audio_duration) if shorts_number == 'auto' else int(shorts_number)
+    chunks = _chunk_segments(caption_segments, GPT_CHUNK_DURATION)
+    per_chunk = max(2, math.ceil(target / len(chunks)) + 1)
+    logger.info(f"Транскрипт длинный: {len(chunks)} частей по {GPT_CHUNK_DURATION:.0f} с, по {per_chunk} кандидатов из каждой.")
+
+    def _map_chunk(chunk):
+        chunk_range = (chunk[0]['start'], chunk[-1]['end'])
+        prompt = gpt_gpt_prompt(per_chunk, audio_duration, _compact_transcript(chunk), chunk_range)
+        try:
+            return _ask_for_highlights(prompt)
+        except Exception as e:
+            logger.warning(f"Часть {format_seconds_to_hhmmss(chunk_range[0])} не дала кандидатов: {e}")
+            return []
+
+    with ThreadPoolExecutor(max_workers=max(1, GPT_CHUNK_WORKERS)) as executor:
+        chunk_results = list(executor.map(_map_chunk, chunks))
+
+    candidates = []
+    for items in chunk_results:
+        for it in items:
+            try:
+                start, end = float(it["start"]), float(it["end"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            excerpt = " ".join(seg['text'] for seg in caption_segments if start <= seg['start'] < end)[:200]
+            candidates.append({**it, "start": start, "end": end, "excerpt": excerpt})
+    if not candidates:
+        raise ValueError("Ни одна часть транскрипта не дала кандидатов.")
+    if len(candidates) <= target:
+        return candidates
+
+    try:
+        ranked = _ask_for_highlights(gpt_rank_prompt(candidates, target))
+        selected = []
+        seen = set()
+        for r in ranked:
+            idx = int(r["id"])
+            if 0 <= idx < len(candidates) and idx not in seen:
+                seen.add(idx)
+                selected.append({**candidates[idx], "virality_score": r.get("virality_score", candidates[idx].get("virality_score", 5))})
+        if selected:
+            return selected[:target]
+        raise ValueError("Финальный проход не выбрал ни одного кандидата.")
+    except Exception as e:
+        # Без финального прохода берём лучших по оценкам частей, без пересечений
+        logger.warning(f"Финальное ранжирование не удалось ({e}), сортирую кандидатов по virality_score.")
+        selected = []
+        for c in sorted(candidates, key=lambda x: x.get("virality_score", 5), reverse=True):
+            if len(selected) >= target:
+                break
+            if all(c['end'] <= s['start'] or c['start'] >= s['end'] for s in selected):
+                selected.append(c)
+        return selected
+
 def _parse_captions(captions_path: str):
     """Парсит файл субтитров в список сегментов."""
     with open(captions_path, 'r', encoding='utf-8') as f:
@@ -196,54 +343,26 @@ def get_random_highlights(shorts_number, audio_duration):
 
 def get_highlights_from_gpt(captions_path: str = "captions.txt", audio_duration: float = 600.0, shorts_number: any = 'auto'):
     """
-    Creates a temporary vector store for each request to ensure isolation.
+    Sends the compacted transcript inline. Long transcripts are split into time windows,
+    scored concurrently and merged with a final ranking pass.
     """
-    prompt = gpt_gpt_prompt(shorts_number, audio_duration)
     data = None
     is_fallback = False
-    vs = None
-    uploaded_file = None
+    caption_segments = _parse_captions(captions_path)
 
     try:
-        # 1) Создаем временное векторное хранилище для изоляции
-        logger.info("Создаю временное векторное хранилище...")
-        vs = client.vector_stores.create(name=f"Temp Store - {time.time()}")
+        if not caption_segments:
+            raise ValueError("Транскрипт пуст.")
 
-        # 2) Загружаем файл и прикрепляем к временному хранилищу
-        with open(captions_path, "rb") as f:
-            uploaded_file = client.files.create(file=f, purpose="assistants")
-        
-        client.vector_stores.files.create(
-            vector_store_id=vs.id,
-            file_id=uploaded_file.id
-        )
-
-        # 3) Ждём, пока файл будет готов к использованию
-        _wait_for_file_indexing(vs.id, uploaded_file.id)
-
-        # 4) Вызываем ассистента с этим временным хранилищем
-        logger.info(f"Вызываю ассистента с временным хранилищем {vs.id}...")
-        resp = client.responses.create(
-            model="gpt-5-nano",
-            input=[{"role": "user", "content": prompt}],
-            tools=[
-                {
-                    "type": "file_search",
-                    "vector_store_ids": [vs.id],
-                }
-            ],
-        )
-
-        raw = _response_text(resp)
-        json_str = _extract_json_array(raw)
-        data = json.loads(json_str)
-
-        if not data or len(data) == 0:
-            raise ValueError("GPT вернул пустой JSON-массив. Запускаю фолбэк.")
+        transcript_text = _compact_transcript(caption_segments)
+        if len(transcript_text) <= GPT_INLINE_MAX_CHARS:
+            logger.info(f"Отправляю транскрипт ({len(transcript_text)} символов) одним запросом...")
+            data = _ask_for_highlights(gpt_gpt_prompt(shorts_number, audio_duration, transcript_text))
+        else:
+            data = _select_highlights_chunked(caption_segments, audio_duration, shorts_number)
 
     except (ValueError, TimeoutError) as e:
         logger.warning(f"Основной метод выбора хайлайтов не удался ({e.__class__.__name__}: {e}). Переключаюсь на фолбэк.")
-        caption_segments = _parse_captions(captions_path)
         if not caption_segments:
             raise ValueError("Не удалось спарсить субтитры для фолбэка.")
 
@@ -252,27 +371,11 @@ def get_highlights_from_gpt(captions_path: str = "captions.txt", audio_duration:
         if data is None:
             raise ValueError("Фолбэк-механизм также не смог сгенерировать таймкоды.")
         is_fallback = True
-    
-    finally:
-        # Очистка: удаляем временное хранилище и файл
-        if uploaded_file:
-            try:
-                client.files.delete(file_id=uploaded_file.id)
-                logger.info(f"Временный файл {uploaded_file.id} удален.")
-            except Exception as delete_e:
-                logger.error(f"Ошибка при удалении временного файла {uploaded_file.id}: {delete_e}")
-        if vs:
-            try:
-                client.vector_stores.delete(vector_store_id=vs.id)
-                logger.info(f"Временное хранилище {vs.id} удалено.")
-            except Exception as delete_e:
-                logger.error(f"Ошибка при удалении временного хранилища {vs.id}: {delete_e}")
 
     if data is None:
         raise ValueError("Не удалось получить данные от GPT ни одним из способов.")
 
     # --- Post-processing --- 
-    caption_segments = _parse_captions(captions_path)
     processed_data = []
 
     for it in data:
@@ -282,7 +385,7 @@ def get_highlights_from_gpt(captions_path: str = "captions.txt", audio_duration:
         if not is_fallback:
             if end_time - start_time > 60.0:
                 end_time = start_time + 60.0
-                logger.info(f"обрезаю клип до 60 секунд: {it['hook']}")
+                logger.info(f"обрезаю клип до 60 секунд: {it.get('hook', '')}")
 
             end_segment_index = -1
             for i, seg in enumerate(caption_segments):
@@ -300,49 +403,19 @@ def get_highlights_from_gpt(captions_path: str = "captions.txt", audio_duration:
                         new_end_time = segment['end']
                         if new_end_time - end_time < 5.0:
                             end_time = new_end_time
-                            logger.info(f"корректирую окончание клипа по предложению: {it['hook']}")
+                            logger.info(f"корректирую окончание клипа по предложению: {it.get('hook', '')}")
                             break
 
     
         processed_data.append({
             "start": format_seconds_to_hhmmss(start_time),
             "end":   format_seconds_to_hhmmss(end_time),
-            "hook":  it["hook"],
+            "hook":  it.get("hook", ""),
             "virality_score": it.get("virality_score", 5) # Извлекаем оценку, по умолчанию 5
         })
 
     return processed_data
 
-def _wait_for_file_indexing(vector_store_id: str, file_id: str, timeout_s: int = 600):
-    """
-    Ожидает завершения индексации файла в векторном хранилище.
-    """
-    start_time = time.time()
-    logger.info(f"Ожидание индексации файла {file_id} в хранилище {vector_store_id}...")
-    
-    while time.time() - start_time < timeout_s:
-        try:
-            file_status = client.vector_stores.files.retrieve(
-                vector_store_id=vector_store_id,
-                file_id=file_id
-            )
-            
-            logger.info(f"Текущий статус файла {file_id}: {file_status.status}")
-
-            if file_status.status == 'completed':
-                logger.info(f"Файл {file_id} успешно проиндексирован.")
-                return
-            elif file_status.status in ['failed', 'cancelled']:
-                logger.error(f"Индексация файла {file_id} не удалась со статусом: {file_status.status}.")
-                raise ValueError(f"Индексация файла {file_id} не удалась.")
-            
-        except Exception as e:
-            logger.warning(f"Не удалось получить статус индексации файла: {e}")
-        
-        time.sleep(5)
-        
-    raise TimeoutError(f"Тайм-аут ожидания индексации файла {file_id}.")
-
 # ===== вспомогательные функции =====
 
 def _response_text(resp) -> str:
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from typing import List, Dict, Any, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+HEATMAP_RESOLUTION = 1.0  # шаг сетки, сек
+
+
+def _heatmap_prefix_sums(heatmap: List[Dict[str, Any]], duration: float,
+                         resolution: float = HEATMAP_RESOLUTION) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Rasterizes the heatmap once and returns (grid, prefix), where prefix[i] is the
+    integral of value*time over [0, grid[i]]. The integral of a piecewise-constant
+    heatmap is piecewise linear, so sampling it on the grid is exact.
+    """
+    starts = np.array([float(p.get('start_time', 0)) for p in heatmap])
+    ends = np.array([float(p.get('end_time', 0)) for p in heatmap])
+    values = np.array([float(p.get('value', 0)) for p in heatmap])
+    valid = ends > starts
+    starts, ends, values = starts[valid], ends[valid], values[valid]
+
+    grid = np.arange(0.0, duration + resolution, resolution)
+    grid[-1] = min(grid[-1], duration)
+    if starts.size == 0:
+        return grid, np.zeros_like(grid)
+
+    # Плотность как сумма ступенек: +value в начале точки, -value в конце
+    breakpoints, inverse = np.unique(np.concatenate([starts, ends]), return_inverse=True)
+    deltas = np.zeros(breakpoints.size)
+    np.add.at(deltas, inverse[:starts.size], values)
+    np.add.at(deltas, inverse[starts.size:], -values)
+    density = np.cumsum(deltas)[:-1]
+    integral = np.concatenate([[0.0], np.cumsum(density * np.diff(breakpoints))])
+
+    prefix = np.interp(grid, breakpoints, integral, left=0.0, right=integral[-1])
+    return grid, prefix
+
+
+def _best_subwindow(prefix: np.ndarray, lo: int, hi: int, min_bins: int, max_bins: int) -> Tuple[int, int, float]:
+    """
+    Densest sub-window [i, j) of bins lo..hi with min_bins <= j - i <= max_bins.
+    One vectorized pass per allowed length.
+    """
+    best = (lo, hi, -1.0)
+    for length in range(min_bins, min(max_bins, hi - lo) + 1):
+        sums = prefix[lo + length:hi + 1] - prefix[lo:hi + 1 - length]
+        i = int(np.argmax(sums))
+        density = float(sums[i]) / length
+        if density > best[2]:
+            best = (lo + i, lo + i + length, density)
+    return best
+
+
+def select_heatmap_segments(heatmap: List[Dict[str, Any]], duration: float, count: int,
+                            min_duration: float, max_duration: float,
+                            resolution: float = HEATMAP_RESOLUTION) -> List[Dict[str, Any]]:
+    """
+    Picks up to `count` non-overlapping segments from the "most replayed" heatmap.
+    Windows of max_duration are ranked by total heat (prefix sums, every grid step),
+    then each winner is narrowed to its densest sub-window between min_duration and
+    max_duration. Returns dicts with start, end, score (window heat) and density.
+    """
+    if not heatmap or duration < min_duration:
+        return []
+
+    grid, prefix = _heatmap_prefix_sums(heatmap, duration, resolution)
+    bins_total = grid.size - 1
+    window_bins = min(int(round(max_duration / resolution)), bins_total)
+    min_bins = max(1, min(int(round(min_duration / resolution)), window_bins))
+
+    window_scores = prefix[window_bins:] - prefix[:bins_total - window_bins + 1]
+    available = np.ones(window_scores.size, dtype=bool)
+    selected = []
+
+    while len(selected) < count and available.any():
+        masked = np.where(available, window_scores, -np.inf)
+        w = int(np.argmax(masked))
+        i, j, density_per_bin = _best_subwindow(prefix, w, w + window_bins, min_bins, window_bins)
+        start, end = float(grid[i]), float(grid[j])
+        selected.append({
+            'start': start,
+            'end': end,
+            'score': float(window_scores[w]),
+            'density': density_per_bin / resolution,
+        })
+        # Окна, пересекающиеся с выбранным отрезком, больше не кандидаты
+        available[max(0, i - window_bins + 1):j] = False
+
+    return selected
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import sqlite3
+import contextlib
+import logging
+import threading
+from typing import Optional, Dict, Any, List
+
+from config import HIGHLIGHT_CACHE_DB, HIGHLIGHT_CACHE_TTL, HIGHLIGHT_CACHE_MAX_ENTRIES, GPT_HIGHLIGHTS_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Поднять при изменении логики выбора хайлайтов, чтобы старые записи не использовались
+HIGHLIGHT_STRATEGY_VERSION = 1
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def current_strategy() -> str:
+    """Identifies the selection pipeline that produced a cached result."""
+    return f"heatmap>gpt:{GPT_HIGHLIGHTS_MODEL}:v{HIGHLIGHT_STRATEGY_VERSION}"
+
+
+def _connect():
+    global _schema_ready
+    conn = sqlite3.connect(HIGHLIGHT_CACHE_DB, timeout=30)
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS highlight_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        video_id TEXT NOT NULL,
+                        source TEXT,
+                        shorts_timecodes TEXT NOT NULL,
+                        transcript_segments TEXT,
+                        video_duration REAL,
+                        created_at REAL NOT NULL,
+                        last_used REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_highlight_cache_last_used ON highlight_cache (last_used)")
+                conn.commit()
+                _schema_ready = True
+    return conn
+
+
+def _cache_key(video_id: str, shorts_number, strategy: str) -> str:
+    return f"{video_id}|{shorts_number}|{strategy}"
+
+
+def get_cached_highlights(video_id: str, shorts_number, strategy: str) -> Optional[Dict[str, Any]]:
+    """
+    Returns {'shorts_timecodes', 'transcript_segments', 'video_duration', 'source'} for a fresh
+    entry, or None. Expired entries are dropped on read.
+    """
+    if not video_id:
+        return None
+    key = _cache_key(video_id, shorts_number, strategy)
+    now = time.time()
+    try:
+        with contextlib.closing(_connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT source, shorts_timecodes, transcript_segments, video_duration, created_at "
+                "FROM highlight_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            source, timecodes_json, transcript_json, video_duration, created_at = row
+            if now - created_at > HIGHLIGHT_CACHE_TTL:
+                conn.execute("DELETE FROM highlight_cache WHERE cache_key = ?", (key,))
+                return None
+            conn.execute("UPDATE highlight_cache SET last_used = ? WHERE cache_key = ?", (now, key))
+    except sqlite3.Error as e:
+        logger.warning(f"Highlight cache read failed for {video_id}: {e}")
+        return None
+
+    return {
+        'source': source,
+        'shorts_timecodes': json.loads(timecodes_json),
+        'transcript_segments': json.loads(transcript_json) if transcript_json else None,
+        'video_duration': video_duration,
+    }
+
+
+def store_highlights(video_id: str, shorts_number, strategy: str, source: str,
+                     shorts_timecodes: List[Dict[str, Any]],
+                     transcript_segments: Optional[List[Dict[str, Any]]],
+                     video_duration: Optional[float]):
+    """Saves a selection result and evicts expired and least recently used entries."""
+    if not video_id or not shorts_timecodes:
+        return
+    key = _cache_key(video_id, shorts_number, strategy)
+    now = time.time()
+    try:
+        with contextlib.closing(_connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO highlight_cache "
+                "(cache_key, video_id, source, shorts_timecodes, transcript_segments, video_duration, created_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, video_id, source, json.dumps(shorts_timecodes, ensure_ascii=False),
+                 json.dumps(transcript_segments, ensure_ascii=False) if transcript_segments else None,
+                 video_duration, now, now)
+            )
+            conn.execute("DELETE FROM highlight_cache WHERE created_at < ?", (now - HIGHLIGHT_CACHE_TTL,))
+            conn.execute(
+                "DELETE FROM highlight_cache WHERE cache_key IN ("
+                "SELECT cache_key FROM highlight_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (max(1, HIGHLIGHT_CACHE_MAX_ENTRIES),)
+            )
+        logger.info(f"Highlights for {video_id} ({source}, shorts_number={shorts_number}) saved to cache.")
+    except sqlite3.Error as e:
+        logger.warning(f"Highlight cache write failed for {video_id}: {e}")
@@ -2,17 +2,47 @@
 
 import random
 from moviepy.editor import (
-    VideoFileClip,
     CompositeVideoClip,
     ColorClip,
     clips_array,
+    concatenate_videoclips,
     vfx,
 )
 from .face_tracker import create_face_tracked_clip
+from .backgrounds import pick_background_chunks
+from .assets import get_asset_manager
+
+
+def _load_bottom_clip(config, final_width, bottom_height, duration):
+    """
+    Background for the bottom part. Pre-sized chunks from the background library are
+    concatenated as is; without the library the keeper video is seeked and resized.
+    """
+    assets = get_asset_manager()
+    chunk_paths = pick_background_chunks(config.get('bottom_video'), final_width, bottom_height, duration)
+    if chunk_paths:
+        bottom_clip = concatenate_videoclips([assets.clip_video(path, audio=False) for path in chunk_paths])
+        return bottom_clip.subclip(0, min(duration, bottom_clip.duration)).set_duration(duration)
 
-def _build_video_canvas(config, main_clip_raw, final_width, final_height):
-    layout = config.get('layout', 'square_center')
     bottom_video_path = config.get('bottom_video_path')
+    if not bottom_video_path:
+        return ColorClip(size=(final_width, bottom_height), color=(0,0,0), duration=duration)
+
+    # Ридер исходника переиспользуется между клипами этого процесса
+    full_bottom_clip = assets.shared_video(bottom_video_path)
+    if full_bottom_clip.duration > duration:
+        random_start = random.uniform(0, full_bottom_clip.duration - duration)
+        bottom_clip = full_bottom_clip.subclip(random_start, random_start + duration)
+    else:
+        bottom_clip = full_bottom_clip
+    bottom_clip = bottom_clip.resize(height=bottom_height)
+    if bottom_clip.w > final_width:
+        bottom_clip = bottom_clip.fx(vfx.crop, x_center=bottom_clip.w / 2, width=final_width)
+    return bottom_clip.set_duration(duration)
+
+
+def _build_video_canvas(config, main_clip_raw, final_width, final_height, source_path=None, source_offset=0.0, track_key=None):
+    layout = config.get('layout', 'square_center')
     use_face_tracking = config.get('use_face_tracking', False)
 
     if layout == 'square_top_brainrot_bottom':
@@ -20,24 +50,12 @@ def _build_video_canvas(config, main_clip_raw, final_width, final_height):
         bottom_height = final_height - video_height
 
         if use_face_tracking:
-            main_clip = create_face_tracked_clip(main_clip_raw, video_height, final_width)
+            main_clip = create_face_tracked_clip(main_clip_raw, video_height, final_width, source_path, source_offset, track_key)
         else:
             main_clip_resized = main_clip_raw.resize(height=video_height)
             main_clip = main_clip_resized.fx(vfx.crop, x_center=main_clip_resized.w / 2, width=final_width)
 
-        if bottom_video_path:
-            full_bottom_clip = VideoFileClip(str(bottom_video_path))
-            if full_bottom_clip.duration > main_clip.duration:
-                random_start = random.uniform(0, full_bottom_clip.duration - main_clip.duration)
-                bottom_clip = full_bottom_clip.subclip(random_start, random_start + main_clip.duration)
-            else:
-                bottom_clip = full_bottom_clip
-            bottom_clip = bottom_clip.resize(height=bottom_height)
-            if bottom_clip.w > final_width:
-                bottom_clip = bottom_clip.fx(vfx.crop, x_center=bottom_clip.w / 2, width=final_width)
-            bottom_clip = bottom_clip.set_duration(main_clip.duration)
-        else:
-            bottom_clip = ColorClip(size=(final_width, bottom_height), color=(0,0,0), duration=main_clip.duration)
+        bottom_clip = _load_bottom_clip(config, final_width, int(bottom_height), main_clip.duration)
 
         video_canvas = clips_array([[main_clip], [bottom_clip]])
         subtitle_y_pos = video_height - 60 # Сдвигаем субтитры вверх
@@ -56,20 +74,7 @@ def _build_video_canvas(config, main_clip_raw, final_width, final_height):
         main_clip = main_clip.set_position(('center', main_clip_y_pos))
 
         # Bottom clip preparation
-        if bottom_video_path:
-            full_bottom_clip = VideoFileClip(str(bottom_video_path))
-            if full_bottom_clip.duration > main_clip.duration:
-                random_start = random.uniform(0, full_bottom_clip.duration - main_clip.duration)
-                bottom_clip = full_bottom_clip.subclip(random_start, random_start + main_clip.duration)
-            else:
-                bottom_clip = full_bottom_clip
-
-            bottom_clip = bottom_clip.resize(height=bottom_height)
-            if bottom_clip.w > final_width:
-                bottom_clip = bottom_clip.fx(vfx.crop, x_center=bottom_clip.w / 2, width=final_width)
-            bottom_clip = bottom_clip.set_duration(main_clip.duration)
-        else:
-            bottom_clip = ColorClip(size=(final_width, bottom_height), color=(0,0,0), duration=main_clip.duration)
+        bottom_clip = _load_bottom_clip(config, final_width, int(bottom_height), main_clip.duration)
 
         bottom_clip = bottom_clip.set_position(('center', 'bottom'))
 
@@ -90,7 +95,7 @@ def _build_video_canvas(config, main_clip_raw, final_width, final_height):
 
     elif layout == 'face_track_9_16':
         if use_face_tracking:
-            main_clip = create_face_tracked_clip(main_clip_raw, final_height, final_width)
+            main_clip = create_face_tracked_clip(main_clip_raw, final_height, final_width, source_path, source_offset, track_key)
         else:
             main_clip_resized = main_clip_raw.resize(height=final_height)
             main_clip = main_clip_resized.fx(vfx.crop, x_center=main_clip_resized.w / 2, width=final_width)
@@ -102,7 +107,7 @@ def _build_video_canvas(config, main_clip_raw, final_width, final_height):
         video_height = int(final_height * 0.7)
         
         if use_face_tracking:
-            main_clip = create_face_tracked_clip(main_clip_raw, video_height, final_width)
+            main_clip = create_face_tracked_clip(main_clip_raw, video_height, final_width, source_path, source_offset, track_key)
         else:
             main_clip_resized = main_clip_raw.resize(height=video_height)
             main_clip = main_clip_resized.fx(vfx.crop, x_center=main_clip_resized.w / 2, width=final_width)
@@ -3,6 +3,7 @@ import re
 import tempfile
 import subprocess
 import logging
+import threading
 from typing import List, Dict, Any, Tuple, Optional
 
 import pysubs2
@@ -115,15 +116,12 @@ def _snap_items_to_reference(items: List[Dict[str, Any]], reference_tokens: List
 # ПРЕОБРАЗОВАНИЕ СЕГМЕНТОВ В СЛОВА
 # ============================ 
 
-def _segments_to_word_items(segments,
-                            window_start: float,
-                            window_end: float,
-                            offset_abs: float) -> List[Dict[str, Any]]:
+def _segments_to_abs_words(segments, offset_abs: float) -> List[Dict[str, Any]]:
     """
-    1 слово -> 1 item. Чистим пунктуацию (запятые/точки/кавычки),
-    клиппим в окно и возвращаем относительные тайминги.
+    1 слово -> 1 item с абсолютными таймингами. Чистим пунктуацию
+    (запятые/точки/кавычки) и прогоняем через спеллчекер.
     """
-    items: List[Dict[str, Any]] = []
+    words: List[Dict[str, Any]] = []
     for seg in segments:
         if not getattr(seg, "words", None):
             continue
@@ -142,23 +140,159 @@ def _segments_to_word_items(segments,
             if not corrected_text:
                 continue
 
-            s_abs = float(w.start) + offset_abs
-            e_abs = float(w.end) + offset_abs
-            if e_abs <= window_start or s_abs >= window_end:
-                continue
+            words.append({
+                "text": corrected_text,                # БЕЗ пунктуации
+                "start": float(w.start) + offset_abs,
+                "end": float(w.end) + offset_abs
+            })
+    return words
 
-            s_clip = max(s_abs, window_start)
-            e_clip = min(e_abs, window_end)
-            if e_clip <= s_clip:
-                continue
+def _clip_words_to_window(words: List[Dict[str, Any]],
+                          window_start: float,
+                          window_end: float) -> List[Dict[str, Any]]:
+    """Клиппим абсолютные слова в окно и возвращаем относительные тайминги."""
+    items: List[Dict[str, Any]] = []
+    for w in words:
+        s_abs, e_abs = w["start"], w["end"]
+        if e_abs <= window_start or s_abs >= window_end:
+            continue
 
-            items.append({
-                "text": corrected_text,                          # БЕЗ пунктуации
-                "start": s_clip - window_start,        # относительный старт
-                "end": e_clip - window_start           # относительный конец
-            })
+        s_clip = max(s_abs, window_start)
+        e_clip = min(e_abs, window_end)
+        if e_clip <= s_clip:
+            continue
+
+        items.append({
+            "text": w["text"],
+            "start": s_clip - window_start,        # относительный старт
+            "end": e_clip - window_start           # относительный конец
+        })
     return items
 
+def _segments_to_word_items(segments,
+                            window_start: float,
+                            window_end: float,
+                            offset_abs: float) -> List[Dict[str, Any]]:
+    """
+    1 слово -> 1 item. Чистим пунктуацию (запятые/точки/кавычки),
+    клиппим в окно и возвращаем относительные тайминги.
+    """
+    return _clip_words_to_window(_segments_to_abs_words(segments, offset_abs), window_start, window_end)
+
+
+# ============================ 
+# ХРАНИЛИЩЕ СЛОВ ПО ВИДЕО
+# ============================ 
+
+class WordTimestampStore:
+    """
+    Word timestamps of one video on its absolute timeline.
+    Each stretch of audio goes through Whisper once; overlapping or adjacent
+    clips reuse the words that are already there. Whisper runs outside the lock:
+    ranges being transcribed are marked in flight, and callers that need them
+    wait on the condition instead of transcribing them again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._covered: List[Tuple[float, float]] = []     # отсортированные, без пересечений
+        self._in_flight: List[Tuple[float, float]] = []   # диапазоны, которые сейчас распознаются
+        self._words: List[Dict[str, Any]] = []
+
+    @staticmethod
+    def _merge(ranges: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+        merged = []
+        for r_start, r_end in sorted(ranges):
+            if merged and r_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], r_end))
+            else:
+                merged.append((r_start, r_end))
+        return merged
+
+    def _uncovered(self, start: float, end: float) -> List[Tuple[float, float]]:
+        """Parts of [start, end] that are neither in the store nor being transcribed."""
+        gaps = []
+        cursor = start
+        for c_start, c_end in self._merge(self._covered + self._in_flight):
+            if c_end <= cursor:
+                continue
+            if c_start >= end:
+                break
+            if c_start > cursor:
+                gaps.append((cursor, c_start))
+            cursor = max(cursor, c_end)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+    def _waits_for_others(self, ranges: List[Tuple[float, float]]) -> bool:
+        return any(f_start < end and start < f_end
+                   for start, end in ranges for f_start, f_end in self._in_flight)
+
+    def _finish(self, gaps: List[Tuple[float, float]], words: Optional[List[Dict[str, Any]]]):
+        # Вызывается под self._cond
+        for gap in gaps:
+            self._in_flight.remove(gap)
+        if words is not None:
+            for g_start, g_end in gaps:
+                # слово принадлежит тому окну, где лежит его середина
+                self._words.extend(
+                    w for w in words if g_start <= (w["start"] + w["end"]) / 2 < g_end
+                )
+            self._covered = self._merge(self._covered + gaps)
+            self._words.sort(key=lambda w: w["start"])
+        self._cond.notify_all()
+
+    def ensure_ranges(self, audio_path, ranges: List[Tuple[float, float]], audio_offset: float):
+        """
+        Makes sure every range in `ranges` is in the store. audio_path starts at
+        audio_offset on the video timeline. The missing parts of all ranges go
+        through a single Whisper call (clip_timestamps); parts that another caller
+        is transcribing are waited for. If that caller fails, they are retried here.
+        """
+        ranges = self._merge(ranges)
+        transcribed_any = False
+        while True:
+            with self._cond:
+                gaps = [gap for start, end in ranges for gap in self._uncovered(start, end)]
+                if not gaps:
+                    if not self._waits_for_others(ranges):
+                        break
+                    self._cond.wait()
+                    continue
+                self._in_flight.extend(gaps)
+
+            clip_timestamps: List[float] = []
+            for g_start, g_end in gaps:
+                # немного контекста по краям, чтобы не терять слова на стыках
+                clip_timestamps.append(max(0.0, g_start - AUDIO_PAD_SEC - audio_offset))
+                clip_timestamps.append(g_end + AUDIO_PAD_SEC - audio_offset)
+            try:
+                segments = transcribe_with_word_timestamps(str(audio_path), clip_timestamps=clip_timestamps)
+                words = _segments_to_abs_words(segments, audio_offset)
+            except Exception:
+                with self._cond:
+                    self._finish(gaps, None)
+                raise
+            with self._cond:
+                self._finish(gaps, words)
+                total_words = len(self._words)
+            transcribed_any = True
+            logger.info(f"Transcribed {len(gaps)} new range(s) in one pass, {total_words} words in the store.")
+
+        if not transcribed_any:
+            logger.info(f"Word timestamps for {len(ranges)} range(s) reused from the store.")
+
+    def ensure_range(self, audio_path, start_cut: float, end_cut: float, audio_offset: float):
+        """Transcribes the parts of [start_cut, end_cut] that are not in the store yet."""
+        self.ensure_ranges(audio_path, [(start_cut, end_cut)], audio_offset)
+
+    def words_for_window(self, start_cut: float, end_cut: float) -> List[Dict[str, Any]]:
+        """Returns word items of the window with timings relative to start_cut."""
+        with self._lock:
+            return _clip_words_to_window(self._words, start_cut, end_cut)
+
 
 # ============================ 
 # PUBLIC: ASS РЕНДЕР
@@ -280,24 +414,31 @@ def get_subtitle_items(subtitles_type: str,
                        transcript_segments: List[Dict[str, Any]],
                        audio_path: str,
                        start_cut: float,
-                       end_cut: float) -> List[Dict[str, Any]]:
+                       end_cut: float,
+                       audio_offset: Optional[float] = None,
+                       word_items: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
     """
     - 'word-by-word': простая транскрибация faster-whisper БЕЗ initial_prompt,
       каждое слово с таймкодом начала и конца; точки/запятые/кавычки убраны.
       Затем (если включено) пост-коррекция на основе референс-текста (snap).
     - 'phrases': как есть из transcript_segments (относительные тайминги).
+    audio_offset — абсолютное время начала audio_path (по умолчанию start_cut).
+    word_items — готовые слова клипа из WordTimestampStore, тогда Whisper не запускается.
     """
     items: List[Dict[str, Any]] = []
 
     if subtitles_type == "word-by-word":
         # audio_path is the path to the video segment. No need to extract a chunk.
-        offset = start_cut
+        offset = start_cut if audio_offset is None else audio_offset
         try:
-            # Минимальный и стабильный вызов распознавания:
-            segments = transcribe_with_word_timestamps(str(audio_path))
-
-            # Слова из сегментов
-            items = _segments_to_word_items(segments, start_cut, end_cut, offset)
+            if word_items is not None:
+                items = list(word_items)
+            else:
+                # Минимальный и стабильный вызов распознавания:
+                segments = transcribe_with_word_timestamps(str(audio_path))
+
+                # Слова из сегментов
+                items = _segments_to_word_items(segments, start_cut, end_cut, offset)
 
             # Пост-коррекция к эталонному тексту (правильные окончания/падежи)
             if REF_SNAP_ENABLED and items:
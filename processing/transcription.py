@@ -1,8 +1,11 @@
 # pip install -U pytubefix python-dotenv
 import os
+import copy
 import subprocess
 import math
 import tempfile
+import threading
+import multiprocessing
 import yt_dlp
 import logging
 import pysubs2
@@ -15,21 +18,124 @@ from pathlib import Path
 import xml.etree.ElementTree as ET
 import html, re
 from typing import List, Dict, Tuple, Optional
+from queue import Queue
+from contextlib import contextmanager
 from config import YOUTUBE_COOKIES_FILE
+from config import (
+    WHISPER_MODEL_WORD_BY_WORD, WHISPER_MODEL_PHRASES, WHISPER_POOL_SIZE, WHISPER_CPU_THREADS,
+    WHISPER_NUM_WORKERS, WHISPER_COMPUTE_TYPE, WHISPER_BATCH_SIZE, WHISPER_BEAM_SIZE_WORD_BY_WORD
+)
+from processing.download import get_video_info
 
 client = None # No longer using OpenAI API
 
-_whisper_model = None
+try:
+    from faster_whisper import BatchedInferencePipeline
+except ImportError:  # faster-whisper < 1.1
+    BatchedInferencePipeline = None
 
-def get_whisper_model():
-    """Initializes and returns a singleton WhisperModel instance."""
-    global _whisper_model
-    if _whisper_model is None:
-        logger.info("Initializing Whisper model for the first time...")
-        # Using "small" model. For better quality, "medium" can be used.
-        _whisper_model = WhisperModel("small", device="cpu", compute_type="int8")
-        logger.info("Whisper model initialized.")
-    return _whisper_model
+
+# Слоты распознавания, общие для всех размеров моделей и процессов рендера:
+# одновременно идут не больше WHISPER_POOL_SIZE проходов по WHISPER_CPU_THREADS потоков
+_whisper_slots = None
+_whisper_slots_lock = threading.Lock()
+
+def get_whisper_slots():
+    """Returns the node-wide transcription semaphore (created in the main process)."""
+    global _whisper_slots
+    with _whisper_slots_lock:
+        if _whisper_slots is None:
+            _whisper_slots = multiprocessing.get_context("spawn").BoundedSemaphore(max(1, WHISPER_POOL_SIZE))
+        return _whisper_slots
+
+def init_whisper_slots(slots):
+    """Process pool initializer: render workers share the parent's transcription slots."""
+    global _whisper_slots
+    _whisper_slots = slots
+
+def reset_whisper_slots():
+    """
+    Starts a fresh semaphore, e.g. after a render worker died: a slot it held
+    would otherwise never be released. Holders of the old one release it as usual.
+    """
+    global _whisper_slots
+    with _whisper_slots_lock:
+        _whisper_slots = None
+
+
+class WhisperModelPool:
+    """
+    Up to `size` WhisperModel instances of one size. Callers borrow an instance for
+    the duration of a transcription and wait in line when all are busy, so concurrent
+    jobs never share a model. Every pool also takes one of the shared transcription
+    slots, so all model sizes together never use more than
+    WHISPER_POOL_SIZE * WHISPER_CPU_THREADS cores.
+    """
+
+    def __init__(self, model_size: str, size: int):
+        self.model_size = model_size
+        self.size = max(1, size)
+        self._free: Queue = Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _create_instance(self):
+        logger.info(f"Loading Whisper model '{self.model_size}' "
+                    f"({self._created + 1}/{self.size}, {WHISPER_CPU_THREADS} threads)...")
+        model = WhisperModel(self.model_size, device="cpu", compute_type=WHISPER_COMPUTE_TYPE,
+                             cpu_threads=WHISPER_CPU_THREADS, num_workers=WHISPER_NUM_WORKERS)
+        batched = None
+        if BatchedInferencePipeline is not None and WHISPER_BATCH_SIZE > 1:
+            batched = BatchedInferencePipeline(model=model)
+        return model, batched
+
+    @contextmanager
+    def acquire(self):
+        """Yields (model, batched_pipeline or None); instances are created lazily."""
+        slots = get_whisper_slots()
+        slots.acquire()
+        try:
+            with self._borrow() as instance:
+                yield instance
+        finally:
+            slots.release()
+
+    @contextmanager
+    def _borrow(self):
+        instance = None
+        with self._lock:
+            if self._free.empty() and self._created < self.size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                instance = self._create_instance()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        else:
+            instance = self._free.get()
+        try:
+            yield instance
+        finally:
+            self._free.put(instance)
+
+
+_model_pools: Dict[str, WhisperModelPool] = {}
+_model_pools_lock = threading.Lock()
+
+def get_whisper_pool(mode: str = "phrases") -> WhisperModelPool:
+    """Returns the model pool for a subtitle mode ('word-by-word' or 'phrases')."""
+    model_size = WHISPER_MODEL_WORD_BY_WORD if mode == "word-by-word" else WHISPER_MODEL_PHRASES
+    with _model_pools_lock:
+        pool = _model_pools.get(model_size)
+        if pool is None:
+            pool = WhisperModelPool(model_size, WHISPER_POOL_SIZE)
+            _model_pools[model_size] = pool
+        return pool
 
 
 # =========================
@@ -248,23 +354,11 @@ def write_captions_file(segments: List[Dict[str, float]], filename: str = "capti
 # ПОЛУЧЕНИЕ СЕГМЕНТОВ ИЗ YOUTUBE
 # =========================
 def download_captions_from_youtube(url: str) -> Tuple[List[Dict[str, float]], Optional[str]]:
-    # 1. Получаем информацию о доступных субтитрах (без скачивания)
-    ydl_opts_info = {
-        'skip_download': True,
-        'noplaylist': True,
-        'quiet': True,
-        'http_headers': {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36',
-        }
-    }
-    if YOUTUBE_COOKIES_FILE and os.path.exists(YOUTUBE_COOKIES_FILE):
-        ydl_opts_info['cookiefile'] = YOUTUBE_COOKIES_FILE
-
-    with yt_dlp.YoutubeDL(ydl_opts_info) as ydl:
-        try:
-            info = ydl.extract_info(url, download=False)
-        except Exception as e:
-            raise RuntimeError(f"Ошибка получения инфо о видео: {e}")
+    # 1. Получаем информацию о доступных субтитрах (без скачивания, из общего кэша метаданных)
+    try:
+        info = get_video_info(url)
+    except Exception as e:
+        raise RuntimeError(f"Ошибка получения инфо о видео: {e}")
 
     # 2. Выбираем лучшую дорожку по нашей логике
     chosen_code, is_auto = _pick_best_subtitle_yt_dlp(info)
@@ -287,8 +381,9 @@ def download_captions_from_youtube(url: str) -> Tuple[List[Dict[str, float]], Op
         if YOUTUBE_COOKIES_FILE and os.path.exists(YOUTUBE_COOKIES_FILE):
             ydl_opts_down['cookiefile'] = YOUTUBE_COOKIES_FILE
 
+        # Обрабатываем уже полученный info dict (как --load-info-json), без повторного запроса страницы
         with yt_dlp.YoutubeDL(ydl_opts_down) as ydl:
-            ydl.download([url])
+            ydl.process_ie_result(copy.deepcopy(info), download=True)
 
         # Ищем скачанный файл (yt-dlp добавляет код языка в имя файла)
         files = [f for f in os.listdir(tmpdirname) if f.endswith('.srt')]
@@ -331,44 +426,56 @@ def transcribe_via_faster_whisper(audio_path) -> List[Dict[str, float]]:
     """
     Transcribes the given audio file using the local faster-whisper model.
     """
-    model = get_whisper_model()
-    
-    segments, _ = model.transcribe(
-        str(audio_path),
-        task="transcribe",
-        word_timestamps=False, # We only need phrase-level timestamps here
-        beam_size=1,
-        best_of=1,
-        temperature=0.0
-    )
-
-    # Convert generator to list of dicts
-    transcript_list = []
-    for segment in segments:
-        transcript_list.append({
-            "start": segment.start,
-            "end": segment.end,
-            "text": segment.text.strip()
-        })
+    with get_whisper_pool("phrases").acquire() as (model, batched):
+        if batched is not None:
+            # Батч по VAD-чанкам одного файла: все ядра инстанса заняты одним проходом
+            segments, _ = batched.transcribe(
+                str(audio_path),
+                task="transcribe",
+                word_timestamps=False, # We only need phrase-level timestamps here
+                beam_size=1,
+                temperature=0.0,
+                batch_size=WHISPER_BATCH_SIZE
+            )
+        else:
+            segments, _ = model.transcribe(
+                str(audio_path),
+                task="transcribe",
+                word_timestamps=False, # We only need phrase-level timestamps here
+                beam_size=1,
+                best_of=1,
+                temperature=0.0
+            )
+
+        # Convert generator to list of dicts (the model is busy until it is consumed)
+        transcript_list = []
+        for segment in segments:
+            transcript_list.append({
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text.strip()
+            })
     
     logger.info(f"Transcription via faster-whisper complete for {audio_path}.")
     return transcript_list
 
-def transcribe_with_word_timestamps(audio_path):
+def transcribe_with_word_timestamps(audio_path, clip_timestamps=None):
     """
-    Transcribes audio with word-level timestamps using high quality settings.
-    Returns list of Segment objects (from faster_whisper).
+    Transcribes audio with word-level timestamps using the word-by-word model settings.
+    clip_timestamps ([start, end, start, end, ...] in seconds of the file) limits
+    the pass to those ranges. Returns list of Segment objects (from faster_whisper).
     """
-    model = get_whisper_model()
-    segments, _ = model.transcribe(
-        str(audio_path),
-        task="transcribe",
-        word_timestamps=True,
-        beam_size=5,
-        best_of=5,
-        temperature=0.0
-    )
-    return list(segments)
+    with get_whisper_pool("word-by-word").acquire() as (model, _):
+        segments, _ = model.transcribe(
+            str(audio_path),
+            task="transcribe",
+            word_timestamps=True,
+            beam_size=WHISPER_BEAM_SIZE_WORD_BY_WORD,
+            best_of=WHISPER_BEAM_SIZE_WORD_BY_WORD,
+            temperature=0.0,
+            clip_timestamps=clip_timestamps or "0"
+        )
+        return list(segments)
 
 # =========================
 # ЕДИНАЯ ТОЧКА: ПОЛУЧИТЬ СЕГМЕНТЫ И ЗАПИСАТЬ SRT
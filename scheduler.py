@@ -0,0 +1,135 @@
+import json
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from config import (
+    MAX_SHORTS_PER_VIDEO, RENDER_WORKERS_PER_JOB, WHISPER_CPU_THREADS, WHISPER_POOL_SIZE,
+    SCHEDULER_CPU_BUDGET, SCHEDULER_RAM_BUDGET_MB, SCHEDULER_MAX_JOBS, SCHEDULER_MAX_BYPASS_WAIT
+)
+from database import lease_next_task
+from processing.ffmpeg_render import FACE_TRACKING_LAYOUTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VIDEO_DURATION = 30 * 60  # если длительность не сохранилась в задаче
+BRAINROT_LAYOUTS = ('square_top_brainrot_bottom', 'full_top_brainrot_bottom')
+# Whisper ограничен общими слотами на весь узел: сколько бы задач ни распознавали, больше этих ядер он не займёт
+WHISPER_RESERVED_CPU = max(1, WHISPER_POOL_SIZE) * WHISPER_CPU_THREADS
+
+
+def estimate_job_cost(user_data: Dict[str, Any]) -> Dict[str, float]:
+    """
+    Rough peak resources of a job: {'cpu': cores, 'ram_mb': MB, 'whisper': 0 or 1}.
+    Renders run RENDER_WORKERS_PER_JOB at a time; face tracking and a background video make
+    each render heavier; Whisper (word-by-word subtitles, Twitch) adds a model's memory, while
+    its threads come from the node-wide Whisper budget the scheduler reserves once;
+    long videos add audio and transcript memory.
+    """
+    config = user_data.get('config') or {}
+    duration = float(user_data.get('video_duration') or DEFAULT_VIDEO_DURATION)
+    layout = config.get('layout', 'square_center')
+
+    try:
+        clips = int(config.get('shorts_number'))
+    except (TypeError, ValueError):
+        # 'auto': примерно как _auto_shorts_count в processing.gpt
+        clips = min(MAX_SHORTS_PER_VIDEO - 1, max(3, int(duration / 420)))
+    parallel_renders = max(1, min(RENDER_WORKERS_PER_JOB, clips))
+
+    render_cpu, render_ram = 1.0, 400
+    if config.get('use_face_tracking') and layout in FACE_TRACKING_LAYOUTS:
+        render_cpu, render_ram = render_cpu + 0.5, render_ram + 200
+    if config.get('bottom_video') and layout in BRAINROT_LAYOUTS:
+        render_cpu, render_ram = render_cpu + 0.25, render_ram + 100
+
+    cpu = parallel_renders * render_cpu
+    ram_mb = 300 + parallel_renders * render_ram + duration / 3600 * 150
+
+    # Whisper: пословные субтитры или Twitch (нет субтитров YouTube)
+    whisper = config.get('subtitles_type', 'word-by-word') == 'word-by-word' or config.get('platform') == 'twitch'
+    if whisper:
+        ram_mb += 1000
+
+    return {'cpu': round(cpu, 2), 'ram_mb': int(ram_mb), 'whisper': int(whisper)}
+
+
+class ResourceScheduler:
+    """
+    Admits jobs against CPU and RAM budgets instead of a fixed number of workers.
+    Light jobs may run next to a heavy one; a job that does not fit is bypassed by smaller
+    ones until it has waited SCHEDULER_MAX_BYPASS_WAIT, after which nothing overtakes it.
+    A job larger than the whole budget still runs, but only alone.
+    Whisper threads are shared by all jobs of the node, so WHISPER_RESERVED_CPU is charged
+    once while at least one admitted job uses Whisper, not once per job.
+    """
+
+    def __init__(self, cpu_budget: float = SCHEDULER_CPU_BUDGET, ram_budget_mb: float = SCHEDULER_RAM_BUDGET_MB,
+                 max_jobs: int = SCHEDULER_MAX_JOBS):
+        self.cpu_budget = cpu_budget
+        self.ram_budget_mb = ram_budget_mb
+        self.max_jobs = max(1, max_jobs)
+        self._used_cpu = 0.0
+        self._used_ram_mb = 0.0
+        self._running = 0
+        self._whisper_jobs = 0
+        self._lock = threading.Lock()
+        self._lease_lock = threading.Lock()
+
+    def fits(self, cost: Dict[str, float]) -> bool:
+        with self._lock:
+            if self._running == 0:
+                return True
+            whisper_cpu = WHISPER_RESERVED_CPU if (self._whisper_jobs or cost.get('whisper')) else 0.0
+            return (self._running < self.max_jobs
+                    and self._used_cpu + cost['cpu'] + whisper_cpu <= self.cpu_budget
+                    and self._used_ram_mb + cost['ram_mb'] <= self.ram_budget_mb)
+
+    def _admit(self, cost: Dict[str, float]):
+        with self._lock:
+            self._running += 1
+            self._whisper_jobs += cost.get('whisper', 0)
+            self._used_cpu += cost['cpu']
+            self._used_ram_mb += cost['ram_mb']
+
+    def release(self, cost: Dict[str, float]):
+        with self._lock:
+            self._running = max(0, self._running - 1)
+            self._whisper_jobs = max(0, self._whisper_jobs - cost.get('whisper', 0))
+            self._used_cpu = max(0.0, self._used_cpu - cost['cpu'])
+            self._used_ram_mb = max(0.0, self._used_ram_mb - cost['ram_mb'])
+
+    def lease_next(self, worker_id: str) -> Optional[Tuple[tuple, Dict[str, float]]]:
+        """Leases the first queued task that fits right now. Returns (task, cost) or None."""
+        blocked = False
+
+        def accept(user_data, queued_for):
+            nonlocal blocked
+            if blocked:
+                return False
+            if self.fits(estimate_job_cost(user_data)):
+                return True
+            if queued_for >= SCHEDULER_MAX_BYPASS_WAIT:
+                # Старая тяжёлая задача ждёт слишком долго - лёгкие больше не обгоняют её
+                blocked = True
+            return False
+
+        with self._lease_lock:
+            if self.is_full():
+                return None
+            task = lease_next_task(worker_id, accept=accept)
+            if task is None:
+                return None
+            cost = estimate_job_cost(json.loads(task[3]))
+            self._admit(cost)
+        logger.info(f"Task {task[0]} admitted with cost {cost} (running: {self.snapshot()}).")
+        return task, cost
+
+    def is_full(self) -> bool:
+        with self._lock:
+            return self._running >= self.max_jobs
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            whisper_cpu = WHISPER_RESERVED_CPU if self._whisper_jobs else 0.0
+            return {'jobs': self._running, 'cpu': round(self._used_cpu + whisper_cpu, 2), 'ram_mb': int(self._used_ram_mb)}
@@ -1,3 +1,4 @@
+import re
 from localization import get_translation
 from config import REQUIRED_CHANNELS
 from telegram import Bot
@@ -91,3 +92,23 @@ def get_video_platform(url: str):
     if "twitch.tv/" in url:
         return "twitch"
     return None
+
+_YOUTUBE_ID_RE = re.compile(r'(?:v=|youtu\.be/|/shorts/|/live/|/embed/)([0-9A-Za-z_-]{11})')
+_TWITCH_ID_RE = re.compile(r'(?:twitch\.tv/videos/(\d+)|twitch\.tv/\w+/clip/([\w-]+)|clips\.twitch\.tv/([\w-]+))')
+
+def get_video_id(url: str) -> str:
+    """
+    Normalizes a video URL to a stable key: 'youtube:<id>', 'twitch:<id>',
+    or the stripped URL when the ID can't be recognized.
+    """
+    url = (url or "").strip()
+    platform = get_video_platform(url)
+    if platform == "youtube":
+        match = _YOUTUBE_ID_RE.search(url)
+        if match:
+            return f"youtube:{match.group(1)}"
+    elif platform == "twitch":
+        match = _TWITCH_ID_RE.search(url)
+        if match:
+            return f"twitch:{next(g for g in match.groups() if g)}"
+    return url
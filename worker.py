@@ -0,0 +1,183 @@
+import os
+import json
+import shutil
+import socket
+import logging
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+
+from config import (
+    DELETE_OUTPUT_AFTER_SENDING, TASK_HEARTBEAT_INTERVAL, TASK_POLL_INTERVAL, WORKER_OUTBOX_DIR,
+    SCHEDULER_CPU_BUDGET, SCHEDULER_RAM_BUDGET_MB, SCHEDULER_MAX_JOBS
+)
+from database import (
+    heartbeat_task, complete_task, fail_task, add_task_event, TaskCheckpoint
+)
+from analytics import log_event
+from processing.bot_logic import main as process_video, TaskCancelled
+from scheduler import ResourceScheduler
+
+# Настройка логирования
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def _move_to_outbox(file_path, task_id: int) -> str:
+    """
+    Кладёт готовый клип в общий WORKER_OUTBOX_DIR: временная папка задачи удаляется,
+    а Telegram-процесс отправит файл позже и удалит его сам.
+    """
+    Path(WORKER_OUTBOX_DIR).mkdir(parents=True, exist_ok=True)
+    outbox_path = os.path.join(WORKER_OUTBOX_DIR, f"task{task_id}_{os.path.basename(str(file_path))}")
+    if os.path.exists(outbox_path):
+        os.remove(outbox_path)
+    try:
+        os.link(file_path, outbox_path)
+    except OSError:
+        shutil.copy2(file_path, outbox_path)
+    return os.path.abspath(outbox_path)
+
+
+def _heartbeat_loop(task_id: int, worker_id: str, stop: threading.Event, cancelled: threading.Event):
+    while not stop.wait(TASK_HEARTBEAT_INTERVAL):
+        try:
+            if not heartbeat_task(task_id, worker_id):
+                # Задачу забрал другой воркер - останавливаем свою обработку
+                logger.warning(f"Lease on task {task_id} lost by {worker_id}, cancelling it.")
+                cancelled.set()
+                return
+        except Exception as e:
+            logger.warning(f"Heartbeat for task {task_id} failed: {e}")
+
+
+def run_task(task, worker_id: str, cancelled: threading.Event = None):
+    """
+    Runs one leased task and reports everything the user should see as task_events:
+    started / status / clip / finished / error. The Telegram process delivers them.
+    Raises TaskCancelled when `cancelled` is set because the lease was lost; processing
+    errors are re-raised after the 'error' event so the task is stored as failed.
+    The generation is charged by the Telegram process once the first clip is delivered.
+    """
+    task_id, user_id, chat_id, user_data_json, status_message_id = task
+    user_data = json.loads(user_data_json)
+    generation_id = user_data.get('generation_id')
+    checkpoint = TaskCheckpoint(task_id, cancelled)
+
+    def emit(kind, payload=None, clip_id=None):
+        add_task_event(task_id, chat_id, kind, {'status_message_id': status_message_id, **(payload or {})}, clip_id=clip_id)
+
+    def status_callback(status_text: str):
+        emit('status', {'text': status_text})
+
+    def send_video_callback(file_path, hook, start, end, virality_score, clip_key=None):
+        # Клип из кэша может быть только в Telegram (file_id без файла) - его отправят по clip_key.
+        # Отправленным клип отметит Telegram-процесс после успешной доставки.
+        clip_id = TaskCheckpoint.clip_id(start, end)
+        emit('clip', {
+            'file_path': _move_to_outbox(file_path, task_id) if file_path else None,
+            'hook': hook, 'start': start, 'end': end,
+            'virality_score': virality_score, 'clip_key': clip_key,
+            'generation_id': generation_id, 'clip_id': clip_id,
+        }, clip_id=clip_id)
+        result = Future()
+        result.set_result(True)
+        return result
+
+    log_event(chat_id, 'generation_start', {'generation_id': generation_id})
+    emit('started')
+    try:
+        shorts_generated_count, extra_shorts_found = process_video(
+            user_data['url'], user_data['config'], status_callback, send_video_callback,
+            DELETE_OUTPUT_AFTER_SENDING, checkpoint
+        )
+    except TaskCancelled:
+        # Пользователю ничего не пишем: задачу доделает новый владелец аренды
+        raise
+    except Exception as e:
+        logger.error(f"Task {task_id} failed: {e}", exc_info=True)
+        log_event(chat_id, 'generation_error', {
+            'url': user_data.get('url'),
+            'config': user_data.get('config'),
+            'error': str(e),
+            'generation_id': generation_id
+        })
+        emit('error', {'error': str(e)})
+        raise
+
+    if shorts_generated_count > 0:
+        log_event(chat_id, 'generation_success', {
+            'url': user_data['url'],
+            'generated_count': shorts_generated_count,
+            'generation_id': generation_id
+        })
+    else:
+        log_event(chat_id, 'generation_error', {
+            'url': user_data['url'],
+            'config': user_data['config'],
+            'error': 'No shorts generated',
+            'generation_id': generation_id
+        })
+    emit('finished', {'generated_count': shorts_generated_count, 'extra_shorts_found': extra_shorts_found})
+
+
+def _run_leased_task(task, worker_id: str, scheduler: ResourceScheduler, cost: dict, wakeup: threading.Event):
+    task_id = task[0]
+    stop_heartbeat = threading.Event()
+    cancelled = threading.Event()
+    threading.Thread(target=_heartbeat_loop, args=(task_id, worker_id, stop_heartbeat, cancelled), daemon=True).start()
+    logger.info(f"Worker {worker_id} took task {task_id}.")
+    try:
+        run_task(task, worker_id, cancelled)
+        complete_task(task_id, worker_id)
+    except TaskCancelled:
+        # Задача принадлежит другому воркеру - не завершаем её за него
+        logger.warning(f"Worker {worker_id} stopped task {task_id} after losing its lease.")
+    except Exception as e:
+        logger.error(f"Worker {worker_id} crashed on task {task_id}: {e}", exc_info=True)
+        fail_task(task_id, str(e), worker_id)
+    finally:
+        stop_heartbeat.set()
+        scheduler.release(cost)
+        # Освободились ресурсы - можно брать следующую задачу
+        wakeup.set()
+
+
+def scheduler_loop(node_id: str):
+    """Leases tasks from the shared queue while they fit the node's CPU/RAM budget."""
+    scheduler = ResourceScheduler()
+    wakeup = threading.Event()
+    lease_number = 0
+    while True:
+        lease_number += 1
+        worker_id = f"{node_id}:{lease_number}"
+        try:
+            leased = scheduler.lease_next(worker_id)
+        except Exception as e:
+            logger.error(f"Could not lease a task: {e}")
+            leased = None
+        if leased is None:
+            wakeup.wait(TASK_POLL_INTERVAL)
+            wakeup.clear()
+            continue
+
+        task, cost = leased
+        threading.Thread(
+            target=_run_leased_task, args=(task, worker_id, scheduler, cost, wakeup), daemon=True
+        ).start()
+
+
+def main():
+    """Worker-only entry point: no Telegram connection, only the shared queue and outbox."""
+    node_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(
+        f"Processing node {node_id} is running with a budget of {SCHEDULER_CPU_BUDGET} CPU, "
+        f"{SCHEDULER_RAM_BUDGET_MB} MB RAM, up to {SCHEDULER_MAX_JOBS} jobs."
+    )
+    scheduler_loop(node_id)
+
+
+if __name__ == "__main__":
+    main()